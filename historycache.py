@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Recent messages per topic for subscribers starting up: mqtt_historycache keeps the last n payloads of every topic
+in a ring buffer, topics not used for the longest time are dropped once all of them take more than maxbytes.
+Request and response follow the MQTT v5 request/response pattern within the payload, as the clients speak v3.1.1:
+a request on REQUESTTOPIC is "<response topic>:<correlation>:<n>:<topic filter>", the response on the response topic
+one binary message "HIST", length of the correlation, number of messages, the correlation and per message the length
+of the topic and of the payload followed by both, oldest first.
+"""
+import collections, getopt, itertools, struct, sys, time
+import paho.mqtt.client as mqtt
+
+
+REQUESTTOPIC = "COSY/$history"
+TIMEOUT = 5. # s subscribers hold back live messages for the response before showing them without it
+_HEADER = struct.Struct("<4sHI")
+_ENTRY = struct.Struct("<HI")
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -m [MB] -n [Messages] -t [Topics]
+
+Fill a cache with messages of some topics and report the time to add one and to answer a request.
+
+-h               Show this help message and exit
+-m [MB]          Size of the cache, default "64"
+-n [Messages]    Messages per topic, default "1000"
+-t [Topics]      Number of topics, default "50"
+""" % sys.argv[0])
+
+
+class Cache:
+    """
+    Last n payloads of each topic, least recently used topics are dropped beyond maxbytes
+    """
+    def __init__(self, n = 1000, maxbytes = 64 << 20):
+        self.n = n
+        self.maxbytes = maxbytes
+        self.topics = collections.OrderedDict() # topic: [deque of payloads, bytes], least recently used first
+        self.size = 0
+        self.evicted = 0
+
+    def add(self, topic, payload):
+        entry = self.topics.get(topic)
+        if entry is None:
+            entry = self.topics[topic] = [collections.deque(), 0]
+        else:
+            self.topics.move_to_end(topic)
+        ring = entry[0]
+        if len(ring) == self.n:
+            dropped = len(ring.popleft())
+            entry[1] -= dropped
+            self.size -= dropped
+        ring.append(payload)
+        entry[1] += len(payload)
+        self.size += len(payload)
+        while self.size > self.maxbytes and len(self.topics) > 1:
+            old, (ring, size) = self.topics.popitem(last = False)
+            self.size -= size
+            self.evicted += 1
+
+    def last(self, topic):
+        entry = self.topics.get(topic)
+        return entry[0][-1] if entry else None
+
+    def get(self, topicfilter, n):
+        """
+        List of (topic, payload) of the last n messages of each topic matching topicfilter
+        """
+        messages = []
+        if topicfilter in self.topics:
+            topics = [topicfilter]
+        else:
+            topics = [topic for topic in self.topics if mqtt.topic_matches_sub(topicfilter, topic)]
+        for topic in topics:
+            self.topics.move_to_end(topic)
+            ring = self.topics[topic][0]
+            messages.extend((topic, payload) for payload in itertools.islice(ring, max(0, len(ring) - n), None))
+        return messages
+
+
+def pack(correlation, messages):
+    """
+    Binary response with the correlation of the request and a list of (topic, payload)
+    """
+    correlation = correlation.encode('utf-8')
+    parts = [_HEADER.pack(b"HIST", len(correlation), len(messages)), correlation]
+    for topic, payload in messages:
+        topic = topic.encode('utf-8')
+        parts += [_ENTRY.pack(len(topic), len(payload)), topic, payload]
+    return b"".join(parts)
+
+
+def unpack(response):
+    """
+    Inverse of pack(), returns the correlation and a list of (topic, payload)
+    """
+    magic, ncorrelation, count = _HEADER.unpack_from(response)
+    if magic != b"HIST":
+        raise ValueError("not a history response")
+    pos = _HEADER.size + ncorrelation
+    correlation = response[_HEADER.size:pos].decode('utf-8')
+    messages = []
+    for i in range(count):
+        ntopic, npayload = _ENTRY.unpack_from(response, pos)
+        pos += _ENTRY.size
+        messages.append((response[pos:pos + ntopic].decode('utf-8'), response[pos + ntopic:pos + ntopic + npayload]))
+        pos += ntopic + npayload
+    return correlation, messages
+
+
+def merge(readings, after = float("-inf"), column = 0):
+    """
+    Readings of the history and the live messages held back in order of their t in column, only those after
+    t = after, the newest already shown, and each t once
+    """
+    merged = []
+    for reading in sorted(readings, key = lambda reading: reading[column]): # stable, history before live at equal t
+        if reading[column] > after:
+            merged.append(reading)
+            after = reading[column]
+    return merged
+
+
+def request(client, topicfilter, n, callback, requesttopic = REQUESTTOPIC):
+    """
+    Ask mqtt_historycache for the last n messages of the topics matching topicfilter, callback(messages) gets the
+    list of (topic, payload) in the network thread. Sent once connected, before the messages queued afterwards.
+    """
+    response = requesttopic + "/" + client.uid
+    correlation = "%.6f" % time.time()
+    done = []
+    def on_response(client, userdata, msg):
+        try:
+            received, messages = unpack(msg.payload)
+        except (ValueError, struct.error):
+            print("%s: cannot unpack history response" % msg.topic)
+            return
+        if received != correlation or done: # or sent twice
+            return
+        done.append(True)
+        client.unsubscribe(response)
+        callback(messages)
+    client.message_callback_add(response, on_response)
+    client.subscribe(response) # sent on connecting before the queued request below
+    client.publish(requesttopic, "%s:%s:%d:%s" % (response, correlation, n, topicfilter), qos = 1, spool = False)
+
+
+def main(argv):
+    n = 1000
+    ntopics = 50
+    maxbytes = 64 << 20
+    try:
+        opts, args = getopt.getopt(argv, "hm:n:t:")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-m":
+            maxbytes = int(float(arg) * (1 << 20))
+        elif opt == "-n":
+            n = int(arg)
+        elif opt == "-t":
+            ntopics = int(arg)
+
+    cache = Cache(n, maxbytes)
+    payload = b"1700000000.000000:L:1.0000005|1700000000.000000:1700000000.000000:1700000000.000000"
+    topics = ["COSY/test/%d" % i for i in range(ntopics)]
+    start = time.perf_counter()
+    for i in range(2 * n):
+        for topic in topics:
+            cache.add(topic, payload)
+    added = time.perf_counter() - start
+    start = time.perf_counter()
+    response = pack("1", cache.get(topics[0], n))
+    served = time.perf_counter() - start
+    correlation, messages = unpack(response)
+    print("%d topics, %d messages, %.1f MB cached, %d topics evicted" % (len(cache.topics), sum(len(e[0]) for e in cache.topics.values()), cache.size / 1E6, cache.evicted))
+    print("add %.2f us/message, %d messages answered with %d bytes in %.2f ms" % (1E6 * added / (2 * n * ntopics), len(messages), len(response), 1000. * served))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
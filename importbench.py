@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Startup time of the entry points: each module is imported in a fresh interpreter with "python -X importtime", the
+best of some runs is compared with a target, so a slow import creeping into a publisher shows before it delays a
+restart after a crash. The heaviest direct imports are listed to show where the time goes.
+"""
+import getopt, os, subprocess, sys, time
+
+
+# publishers which run headless and get restarted by a supervisor
+MODULES = ["mqtt_nmr", "mqtt_tune", "mqtt_frev", "mqtt_picopoll", "mqtt_picopush", "mqtt_daemon", "mqtt_fitservice"]
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -n [Runs] -T [Target] -v [Module] ...
+
+Import each module in a fresh interpreter and report its import time, exits with 1 if one misses the target or fails.
+
+-h             Show this help message and exit
+-n [Runs]      Runs per module, the fastest counts, default "5"
+-T [Target]    Target import time in ms, default "150"
+-v             List the three heaviest imports of each module
+[Module]       Modules to import, default the headless publishers "%s"
+""" % (sys.argv[0], ", ".join(MODULES)))
+
+
+def importtime(module, cwd = None):
+    """
+    Import module in a new interpreter, return its cumulative import time and the direct imports as (name, time)
+    in s and the wall time of the whole process, raise ImportError with the last line of the traceback if it fails
+    """
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module], cwd = cwd, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, universal_newlines = True)
+    wall = time.perf_counter() - start
+    lines = proc.stderr.splitlines()
+    if proc.returncode:
+        raise ImportError(lines[-1] if lines else "exit code %d" % proc.returncode)
+    children = []
+    for line in lines:
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(fields[1]) * 1E-6
+        except ValueError: # header
+            continue
+        name = fields[2][1:] # single space after the bar, then two per nesting level
+        level = (len(name) - len(name.lstrip())) // 2
+        if level == 0:
+            if name == module:
+                return cumulative, sorted(children, key = lambda c: -c[1]), wall
+            children = []
+        elif level == 1:
+            children.append((name.strip(), cumulative))
+    return 0., [], wall # imported during startup already
+
+
+def main(argv):
+    runs = 5
+    target = 150.
+    verbose = False
+    try:
+        opts, args = getopt.getopt(argv, "hn:T:v")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-n":
+            runs = int(arg)
+        elif opt == "-T":
+            target = float(arg)
+        elif opt == "-v":
+            verbose = True
+    modules = [m[:-3] if m.endswith(".py") else m for m in args] or MODULES
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    failed = 0
+    for module in modules:
+        try:
+            best = min((importtime(module, cwd) for i in range(runs)), key = lambda r: r[0])
+        except ImportError as err:
+            print("%-22s failed: %s" % (module, err))
+            failed += 1
+            continue
+        ms = 1000. * best[0]
+        over = ms > target
+        failed += over
+        print("%-22s import %6.1f ms, process %6.1f ms%s" % (module, ms, 1000. * best[2], "  over target" if over else ""))
+        if verbose:
+            for name, t in best[1][:3]:
+                print("    %-18s %6.1f ms" % (name, 1000. * t))
+    print("%d of %d modules within %.0f ms" % (len(modules) - failed, len(modules), target))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Timestamps of every message from the device to the screen: the publishers append start and end of the acquisition
+and the time of publishing as "|start:end:publish" to the payload, the subscribers add the time of arrival and the
+time the data was shown. Payloads without them, e.g. from publishers not updated yet, are passed on unchanged.
+The trailer changes the payloads, consumers that do not strip it with split() cannot parse them any more, so
+stamp() only appends it once a publisher sets enabled, with its option -T.
+"""
+import time
+
+
+SEP = "|" # neither in the text payloads nor at the end of the binary ones
+enabled = False # off: stamp() leaves the payloads as they are
+STAGES = ("acquire", "queue", "transit", "render", "total") # end - start, publish - end, received - publish, shown - received, shown - start
+
+
+def stamp(payload, start, end):
+    """
+    Append acquisition start, end and the current time as publish time to a text or binary payload, if enabled
+    """
+    if not enabled:
+        return payload
+    trailer = "%s%.6f:%.6f:%.6f" % (SEP, start, end, time.time())
+    if isinstance(payload, bytes):
+        return payload + trailer.encode('ascii')
+    return payload + trailer
+
+
+def split(payload):
+    """
+    Return the payload without the timestamps and (start, end, publish), or None if it has none
+    """
+    if isinstance(payload, bytes):
+        head, sep, trailer = payload.rpartition(SEP.encode('ascii'))
+        trailer = trailer.decode('ascii', 'replace')
+    else:
+        head, sep, trailer = payload.rpartition(SEP)
+    if sep:
+        try:
+            stamps = tuple(float(t) for t in trailer.split(":"))
+            if len(stamps) == 3:
+                return head, stamps
+        except ValueError:
+            pass
+    return payload, None
+
+
+def stages(stamps, received, shown = None):
+    """
+    List of (stage, latency / s) of one message, without render if it was not shown
+    """
+    start, end, publish = stamps
+    result = [("acquire", end - start), ("queue", publish - end), ("transit", received - publish)]
+    if shown is not None:
+        result.append(("render", shown - received))
+    result.append(("total", (received if shown is None else shown) - start))
+    return result
+
+
+def describe(stamps, received, shown = None):
+    return ", ".join("%s %.1f ms" % (stage, 1000. * t) for stage, t in stages(stamps, received, shown))
+
+
+class Tracker:
+    """
+    Latencies of the stages of the last n messages of one topic / s
+    """
+    def __init__(self, n = 1000):
+        self.n = n
+        self.latencies = dict((stage, [0.] * n) for stage in STAGES)
+        self.count = dict((stage, 0) for stage in STAGES)
+        self.transit = float("inf") # smallest transit time, offset of the clocks plus the fastest way through the broker
+
+    def _add(self, stage, value):
+        self.latencies[stage][self.count[stage] % self.n] = value
+        self.count[stage] += 1
+
+    def add(self, stamps, received, shown = None):
+        """
+        Add the timestamps of a message, the time it was received and, for displays, the time it was shown
+        """
+        for stage, value in stages(stamps, received, shown):
+            self._add(stage, value)
+        self.transit = min(self.transit, received - stamps[2])
+
+    def percentiles(self, stage):
+        """
+        Percentiles 50, 99, 100 of a stage
+        """
+        last = sorted(self.latencies[stage][:min(self.count[stage], self.n)])
+        if not last:
+            return 0., 0., 0.
+        return last[len(last) // 2], last[min(len(last) - 1, len(last) * 99 // 100)], last[-1]
+
+    def report(self):
+        """
+        One line per stage with its percentiles in ms
+        """
+        return "\n".join("%-8s p50 = %8.1f ms, p99 = %8.1f ms, max = %8.1f ms" % ((stage,) + tuple(1000. * t for t in self.percentiles(stage))) for stage in STAGES if self.count[stage])
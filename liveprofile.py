@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Look inside a running publisher or subscriber without stopping it: after install(), SIGUSR1 samples the stacks of
+all threads for some seconds and SIGUSR2 compares the allocations at the signal with those some seconds later.
+Both run in a thread of their own and write "<name>_<pid>_<time>.folded", one stack per line with its count or
+bytes as read by flamegraph.pl or speedscope, the allocations also a text report with the growing object types.
+Signals are not available on Windows, there install() only says so.
+"""
+import collections, gc, getopt, os, signal, sys, threading, time, tracemalloc
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -d [Duration] -i [Interval]
+
+Profile a busy loop with the sampling profiler and report the overhead of sampling.
+
+-h             Show this help message and exit
+-d [Duration]  Seconds to sample, default "5"
+-i [Interval]  Seconds between samples, default "0.005"
+""" % sys.argv[0])
+
+
+_busy = threading.Lock() # one profile or snapshot at a time
+
+
+def _frame(code):
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+def _folded(stacks, path):
+    with open(path, 'w') as f:
+        for stack, count in sorted(stacks.items(), key = lambda s: -s[1]):
+            f.write("%s %d\n" % (stack, count))
+
+
+def sample(duration = 10., interval = 0.005):
+    """
+    Return a Counter of the stacks of all other threads, "thread;outermost;...;innermost", sampled every interval
+    seconds for duration seconds
+    """
+    me = threading.get_ident()
+    stacks = collections.Counter()
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        names = dict((t.ident, t.name) for t in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            codes = []
+            while frame is not None:
+                codes.append(_frame(frame.f_code))
+                frame = frame.f_back
+            stacks[";".join([names.get(ident, str(ident))] + codes[::-1])] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def profile(path, duration = 10., interval = 0.005):
+    """
+    Sample the stacks and write them as folded stacks to path
+    """
+    start = time.time()
+    stacks = sample(duration, interval)
+    _folded(stacks, path)
+    print(time.strftime("%Y-%m-%d %H:%M:%S") + ": %d samples in %.1f s written to %s" % (sum(stacks.values()), time.time() - start, path))
+
+
+def _types():
+    return collections.Counter(type(o).__module__ + "." + type(o).__qualname__ for o in gc.get_objects())
+
+
+def allocations(path, duration = 10., nframes = 25):
+    """
+    Trace allocations for duration seconds and write the growth as folded stacks weighted by bytes to path
+    and the largest ones with the object types that grew in number to path.txt
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(nframes)
+    before = tracemalloc.take_snapshot()
+    types = _types()
+    time.sleep(duration)
+    after = tracemalloc.take_snapshot()
+    grown = _types()
+    grown.subtract(types)
+    if started:
+        tracemalloc.stop()
+    own = [tracemalloc.Filter(False, __file__, all_frames = True), tracemalloc.Filter(False, tracemalloc.__file__)]
+    diff = [d for d in after.filter_traces(own).compare_to(before.filter_traces(own), 'traceback') if d.size_diff > 0]
+    stacks = collections.Counter()
+    for d in diff:
+        stacks[";".join("%s:%d" % (os.path.basename(f.filename), f.lineno) for f in reversed(d.traceback))] += d.size_diff
+    _folded(stacks, path)
+    with open(path + ".txt", 'w') as f:
+        f.write("%d bytes more in %.0f s\n\n" % (sum(stacks.values()), duration))
+        for d in diff[:20]:
+            f.write("%+d bytes, %+d blocks\n    %s\n" % (d.size_diff, d.count_diff, "\n    ".join(d.traceback.format()[-6:])))
+        f.write("\nobjects by type\n")
+        for name, n in grown.most_common(20):
+            if n > 0:
+                f.write("%+8d %s\n" % (n, name))
+    print(time.strftime("%Y-%m-%d %H:%M:%S") + ": %d bytes allocated in %.0f s written to %s" % (sum(stacks.values()), duration, path))
+
+
+def _run(target, name, suffix, duration):
+    if not _busy.acquire(False):
+        print("profile or allocation snapshot still running, signal ignored")
+        return
+    path = "%s_%d_%s%s" % (name, os.getpid(), time.strftime("%Y%m%d%H%M%S"), suffix)
+    def run():
+        try:
+            target(path, duration)
+        except Exception as err: # must not take the acquisition down
+            print("%s failed: %r" % (path, err))
+        finally:
+            _busy.release()
+    threading.Thread(target = run, name = "liveprofile", daemon = True).start()
+
+
+def install(name, duration = 10.):
+    """
+    Profile on SIGUSR1 and trace allocations on SIGUSR2 for duration seconds, files are named after name
+    """
+    if not hasattr(signal, "SIGUSR1"):
+        print("No SIGUSR1/SIGUSR2 on this system, live profiling is not available")
+        return
+    signal.signal(signal.SIGUSR1, lambda signum, frame: _run(profile, name, ".folded", duration))
+    signal.signal(signal.SIGUSR2, lambda signum, frame: _run(allocations, name, ".alloc.folded", duration))
+
+
+def main(argv):
+    duration = 5.
+    interval = 0.005
+    try:
+        opts, args = getopt.getopt(argv, "hd:i:")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-d":
+            duration = float(arg)
+        elif opt == "-i":
+            interval = float(arg)
+
+    def work(seconds):
+        n = 0
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            sum(i * i for i in range(1000))
+            n += 1
+        return n
+    base = work(duration)
+    result = []
+    worker = threading.Thread(target = lambda: result.append(work(duration)), name = "work")
+    worker.start()
+    stacks = sample(duration, interval)
+    worker.join()
+    print("%d samples, %d stacks, loop at %.1f %% of its speed without sampling" % (sum(stacks.values()), len(stacks), 100. * result[0] / base))
+    for stack, count in stacks.most_common(3):
+        print("%6d %s" % (count, stack))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
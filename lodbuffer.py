@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Ring buffer of the last n readings with min/max/mean pyramids for plotting long time windows: level k combines
+factor**k readings per block. A plot asks for the coarsest level that still has about one block per pixel, so the
+draw cost depends on the width of the axis and not on the window, and min/max keep single spikes visible.
+"""
+import getopt, sys, time
+import numpy as np
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -n [Readings] -p [Pixels]
+
+Fill a buffer with random readings and report the cost of adding a reading and of fetching the plot data.
+
+-h             Show this help message and exit
+-n [Readings]  Window in readings, default "864000" (one day at 10 Hz)
+-p [Pixels]    Width of the axis in pixels, default "1000"
+""" % sys.argv[0])
+
+
+class _Level:
+    """
+    Ring of blocks: start time, minimum, maximum, mean and worst flag
+    """
+    def __init__(self, size):
+        self.size = size
+        self.t = np.zeros(size)
+        self.lo = np.zeros(size)
+        self.hi = np.zeros(size)
+        self.mean = np.zeros(size)
+        self.flag = np.zeros(size, dtype = np.int8)
+        self.count = 0
+
+    def append(self, t, lo, hi, mean, flag):
+        i = self.count % self.size
+        self.t[i], self.lo[i], self.hi[i], self.mean[i], self.flag[i] = t, lo, hi, mean, flag
+        self.count += 1
+
+    def ordered(self):
+        n = min(self.count, self.size)
+        i = self.count % self.size
+        if n < self.size or i == 0:
+            return [a[:n] for a in (self.t, self.lo, self.hi, self.mean, self.flag)]
+        return [np.concatenate((a[i:], a[:i])) for a in (self.t, self.lo, self.hi, self.mean, self.flag)]
+
+
+class LODBuffer:
+    """
+    Last n readings (t, value +- err, flag) at all levels of detail, flags are combined by their maximum,
+    so e.g. a lost lock shows in every level
+    """
+    def __init__(self, n, factor = 4, minblocks = 64):
+        self.n = n
+        self.factor = factor
+        self.levels = [_Level(n)]
+        size = n
+        while size > minblocks:
+            size = -(-size // factor) # blocks of the window at the next level
+            self.levels.append(_Level(size + 1))
+        self.partial = [None] * len(self.levels) # per level: completed blocks of the level below not yet combined
+
+    def add(self, t, value, err = 0., flag = 0):
+        self._push(0, t, value - err, value + err, value, flag)
+
+    def load(self, t, values, errs = 0., flags = 0):
+        """
+        Fill the buffer from arrays of readings at once, with the same result as add() for each of them
+        """
+        if self.levels[0].count:
+            for reading in zip(*np.broadcast_arrays(t, values, errs, flags)):
+                self.add(*reading)
+            return
+        t, values, errs, flags = np.broadcast_arrays(np.asarray(t, dtype = float), np.asarray(values, dtype = float), errs, flags)
+        lo, hi, mean, flag = values - errs, values + errs, values, flags.astype(np.int8)
+        for k, level in enumerate(self.levels):
+            m = len(t) # complete blocks of this level
+            keep = min(m, level.size)
+            i = np.arange(m - keep, m) % level.size
+            level.t[i], level.lo[i], level.hi[i], level.mean[i], level.flag[i] = t[m - keep:], lo[m - keep:], hi[m - keep:], mean[m - keep:], flag[m - keep:]
+            level.count = m
+            if k + 1 == len(self.levels):
+                break
+            nb = m // self.factor
+            r = nb * self.factor
+            self.partial[k + 1] = [t[r], lo[r:].min(), hi[r:].max(), mean[r:].sum(), flag[r:].max(), m - r] if m > r else None
+            t = t[:r:self.factor]
+            lo = lo[:r].reshape(nb, self.factor).min(axis = 1)
+            hi = hi[:r].reshape(nb, self.factor).max(axis = 1)
+            mean = mean[:r].reshape(nb, self.factor).sum(axis = 1) / self.factor
+            flag = flag[:r].reshape(nb, self.factor).max(axis = 1)
+
+    def _push(self, k, t, lo, hi, mean, flag):
+        self.levels[k].append(t, lo, hi, mean, flag)
+        if k + 1 == len(self.levels):
+            return
+        p = self.partial[k + 1]
+        if p is None:
+            p = self.partial[k + 1] = [t, lo, hi, mean, flag, 1]
+        else:
+            p[1], p[2], p[3], p[4], p[5] = min(p[1], lo), max(p[2], hi), p[3] + mean, max(p[4], flag), p[5] + 1
+        if p[5] == self.factor:
+            self.partial[k + 1] = None
+            self._push(k + 1, p[0], p[1], p[2], p[3] / self.factor, p[4])
+
+    def __len__(self):
+        return min(self.levels[0].count, self.n)
+
+    def get(self, npixels = 1000):
+        """
+        Return arrays t, lo, hi, mean, flag of the coarsest level with at least npixels blocks in the window,
+        the readings not yet combined into a block of that level are added as the last one
+        """
+        k = 0
+        while k + 1 < len(self.levels) and self.n // self.factor**(k + 1) >= npixels:
+            k += 1
+        t, lo, hi, mean, flag = self.levels[k].ordered()
+        if k:
+            raw = self.levels[0]
+            oldest = raw.t[raw.count % self.n] if raw.count >= self.n else raw.t[0]
+            keep = t >= oldest # drop blocks that started before the window
+            t, lo, hi, mean, flag = t[keep], lo[keep], hi[keep], mean[keep], flag[keep]
+            last = None
+            for j in range(k, 0, -1): # newest readings are in the partial blocks of the finer levels
+                p = self.partial[j]
+                if p is None:
+                    continue
+                weight = p[5] * self.factor**(j - 1)
+                if last is None:
+                    last = [p[0], p[1], p[2], p[3] * self.factor**(j - 1), p[4], weight]
+                else:
+                    last = [min(last[0], p[0]), min(last[1], p[1]), max(last[2], p[2]), last[3] + p[3] * self.factor**(j - 1), max(last[4], p[4]), last[5] + weight]
+            if last:
+                t, lo, hi, flag = np.append(t, last[0]), np.append(lo, last[1]), np.append(hi, last[2]), np.append(flag, last[4])
+                mean = np.append(mean, last[3] / last[5])
+        return t, lo, hi, mean, flag
+
+
+def main(argv):
+    n = 864000
+    npixels = 1000
+    try:
+        opts, args = getopt.getopt(argv, "hn:p:")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-n":
+            n = int(arg)
+        elif opt == "-p":
+            npixels = int(arg)
+
+    values = np.random.normal(0., 1., n)
+    values[n // 3] = 100. # a single spike has to survive the decimation
+    buf = LODBuffer(n)
+    start = time.perf_counter()
+    for i, value in enumerate(values):
+        buf.add(float(i), float(value), 0., int(value > 50.))
+    tadd = time.perf_counter() - start
+    start = time.perf_counter()
+    t, lo, hi, mean, flag = buf.get(npixels)
+    tget = time.perf_counter() - start
+    print("%d readings, %d levels, add %.1f us/reading, get %.2f ms for %d blocks" % (n, len(buf.levels), 1E6 * tadd / n, 1000. * tget, len(t)))
+    print("max. %.1f, flagged blocks %d, mean %.4f (readings %.4f)" % (hi.max(), flag.sum(), np.average(mean), values.mean()))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
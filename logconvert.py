@@ -0,0 +1,325 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Text logs to columns in .npz files for analysis: nmr.log (t, lock, field), picopoll.log (name as index into names,
+t, value, err), tunes.log and the per cycle _tunespectra.log of mqtt_tuneplot (per spectrum <name>_t, _n, _fmin,
+_fmax and the amplitudes of all records one after the other in <name>_amplitude as float32, record i from
+<name>_offset[i] to <name>_offset[i + 1]). Large logs are cut into shards at record boundaries, which a pool of
+processes parses with numpy, the columns of each log are joined in order and written as <log>.npz, all
+_tunespectra.log together as tunespectra.npz.
+"""
+import getopt, multiprocessing, os, sys, time, warnings
+import numpy as np
+
+
+SEPARATORS = {"nmr": b"\n", "pico": b"/n/t", "tunes": b"\n\n", "tunespectra": None} # None: one record per file
+NAMES = ["frev", "channel1", "channel2"] # as tunefit.NAMES, without importing the fit code into every worker
+LOCKS = b"LSN"
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -f [Format] -o [Directory] -s [MB] -w [Workers] -z Logfile ...
+
+Convert text logs to columns in .npz files, one per log and one for all _tunespectra.log, in parallel.
+
+-h               Show this help message and exit
+-f [Format]      Format of all logs, "nmr", "pico", "tunes" or "tunespectra", default from the file names
+-o [Directory]   Directory of the .npz files, default "."
+-s [MB]          Size of the shards, default "16"
+-w [Workers]     Number of processes, default the number of CPUs
+-z               Compress the .npz files
+""" % sys.argv[0])
+
+
+def detect(path):
+    """
+    Format of a log from its name, also of rotated logs like nmr.log.20261019-000000
+    """
+    name = os.path.basename(path)
+    if name.endswith("_tunespectra.log"):
+        return "tunespectra"
+    for prefix, fmt in (("nmr", "nmr"), ("picopoll", "pico"), ("tunes", "tunes")):
+        if name.startswith(prefix):
+            return fmt
+    return None
+
+
+def shards(path, sep, size):
+    """
+    Byte ranges of about size bytes, each starting after a separator
+    """
+    total = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for guess in range(size, total, size):
+            if guess <= bounds[-1]:
+                continue
+            f.seek(guess)
+            window = b""
+            while True:
+                block = f.read(1 << 16)
+                window += block
+                i = window.find(sep)
+                if i >= 0 or not block:
+                    break
+            if i < 0:
+                break
+            bounds.append(guess + i + len(sep))
+    if bounds[-1] < total:
+        bounds.append(total)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _nmr(data):
+    data = data.strip()
+    text = data
+    for lock in LOCKS:
+        text = text.replace(b":%c:" % lock, b" %d " % lock)
+    nrecords = data.count(b"\n") + 1 - data.count(b"\n\n") if data else 0 # more blank lines fall back below
+    values = None
+    if b":" not in text:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            try:
+                values = np.fromstring(text, sep = " ")
+            except (ValueError, DeprecationWarning):
+                pass
+    skipped = 0
+    if values is None or len(values) != 3 * nrecords: # lines that do not fit, parse one by one
+        rows = []
+        for line in data.split(b"\n"):
+            if not line.strip():
+                continue
+            try:
+                t, lock, field = line.split(b":")
+                rows.append((float(t), lock[0] if lock else 0, float(field)))
+            except (ValueError, IndexError):
+                skipped += 1
+        values = np.array(rows, float).reshape(-1, 3)
+    values = values.reshape(-1, 3)
+    return {"t": values[:, 0], "lock": values[:, 1].astype(np.uint8), "field": values[:, 2]}, skipped
+
+
+def _pico(data):
+    names = {}
+    index = []
+    numbers = []
+    skipped = 0
+    for record in data.split(b"/n/t"):
+        if not record.strip():
+            continue
+        p = record.decode('utf-8', 'replace').split(": ", 1)[-1].rsplit(":", 3)
+        if len(p) != 4:
+            skipped += 1
+            continue
+        index.append(names.setdefault(p[0], len(names)))
+        numbers += p[1:]
+    try:
+        values = np.array(numbers).astype(float).reshape(-1, 3)
+    except ValueError: # a record with text in the numbers, find it
+        values = []
+        keep = []
+        for i in range(len(index)):
+            try:
+                values.append([float(v) for v in numbers[3 * i:3 * i + 3]])
+                keep.append(index[i])
+            except ValueError:
+                skipped += 1
+        index = keep
+        values = np.array(values, float).reshape(-1, 3)
+    return {"name": np.array(index, np.uint32), "names": np.array(list(names)), "t": values[:, 0], "value": values[:, 1], "err": values[:, 2]}, skipped
+
+
+def _spectra(records):
+    """
+    Columns of a list of records, each a list of three spectra [t, n, fmin, fmax, amplitudes...] as strings
+    """
+    columns = {}
+    for j, name in enumerate(NAMES):
+        heads = np.array([spectra[j][:4] for spectra in records]).astype(float).reshape(-1, 4)
+        amplitudes = [spectra[j][4:] for spectra in records]
+        columns[name + "_t"] = heads[:, 0]
+        columns[name + "_n"] = heads[:, 1].astype(np.int32)
+        columns[name + "_fmin"] = heads[:, 2]
+        columns[name + "_fmax"] = heads[:, 3]
+        columns[name + "_offset"] = np.concatenate([[0], np.cumsum([len(a) for a in amplitudes])]).astype(np.int64)
+        columns[name + "_amplitude"] = np.array([v for a in amplitudes for v in a]).astype(np.float32)
+    return columns
+
+
+def _tunes(data):
+    records = []
+    skipped = 0
+    for record in data.split(b"\n\n"):
+        if not record.strip():
+            continue
+        plist = record.decode('utf-8', 'replace').strip().split(":")
+        spectra = []
+        try:
+            for j in range(len(NAMES)): # name:t:n:fmin:fmax:n amplitudes
+                n = int(plist[2])
+                spectra.append(plist[1:n + 5])
+                del plist[:n + 5]
+                if len(spectra[-1]) != n + 4:
+                    raise ValueError("record cut short")
+        except (IndexError, ValueError):
+            skipped += 1
+            continue
+        records.append(spectra)
+    try:
+        return _spectra(records), skipped
+    except ValueError: # text among the numbers, drop the records with it
+        good = []
+        for spectra in records:
+            try:
+                _spectra([spectra])
+                good.append(spectra)
+            except ValueError:
+                skipped += 1
+        return _spectra(good), skipped
+
+
+def _tunespectra(paths):
+    records = []
+    skipped = 0
+    for path in paths:
+        with open(path, 'r', errors = 'replace') as f:
+            parts = f.read().split("spectrum: \n")[1:]
+        spectra = [part.split("\n")[0].strip().split(":") for part in parts]
+        try:
+            _spectra([spectra])
+        except (IndexError, ValueError):
+            skipped += 1
+            continue
+        records.append(spectra)
+    return _spectra(records), skipped
+
+
+def _convert(task):
+    """
+    Parse one shard in a worker process, returns the task, its columns, records skipped and bytes read
+    """
+    fmt, path, start, end = task
+    if fmt == "tunespectra":
+        columns, skipped = _tunespectra(path)
+        return task, columns, skipped, sum(os.path.getsize(p) for p in path)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    columns, skipped = {"nmr": _nmr, "pico": _pico, "tunes": _tunes}[fmt](data)
+    return task, columns, skipped, len(data)
+
+
+def join(fmt, parts):
+    """
+    Columns of a whole log from those of its shards in order
+    """
+    if fmt == "pico":
+        names = {}
+        for part in parts:
+            mapping = np.array([names.setdefault(name, len(names)) for name in part["names"]], np.uint32)
+            part["name"] = mapping[part["name"]] if len(mapping) else part["name"]
+        columns = dict((key, np.concatenate([part[key] for part in parts])) for key in ("name", "t", "value", "err"))
+        columns["names"] = np.array(list(names))
+        return columns
+    columns = {}
+    for key in parts[0]:
+        if key.endswith("_offset"):
+            shift = np.cumsum([0] + [part[key][-1] for part in parts[:-1]])
+            columns[key] = np.concatenate([[0]] + [part[key][1:] + s for part, s in zip(parts, shift)]).astype(np.int64)
+        else:
+            columns[key] = np.concatenate([part[key] for part in parts])
+    return columns
+
+
+def main(argv):
+    fmt = None
+    odir = "."
+    size = 16 << 20
+    nworkers = multiprocessing.cpu_count()
+    compress = False
+    try:
+        opts, args = getopt.getopt(argv, "hf:o:s:w:z")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-f":
+            fmt = arg
+        elif opt == "-o":
+            odir = arg
+        elif opt == "-s":
+            size = int(float(arg) * (1 << 20))
+        elif opt == "-w":
+            nworkers = int(arg)
+        elif opt == "-z":
+            compress = True
+    if not args or fmt not in list(SEPARATORS) + [None]:
+        usage()
+        sys.exit(2)
+
+    # shards of all logs in order, each log is written once its last shard is parsed
+    tasks = []
+    outputs = {}
+    used = set()
+    spectrafiles = []
+    for path in args:
+        f = fmt or detect(path)
+        if f is None:
+            print("%s: unknown format, use -f" % path)
+            continue
+        if f == "tunespectra":
+            spectrafiles.append(path)
+            continue
+        name = os.path.basename(path).replace(".log", "", 1)
+        opath = os.path.join(odir, name + ".npz")
+        k = 1
+        while opath in used: # same name in another directory
+            opath = os.path.join(odir, "%s_%d.npz" % (name, k))
+            k += 1
+        used.add(opath)
+        ranges = shards(path, SEPARATORS[f], size)
+        outputs[path] = (f, opath, len(ranges))
+        tasks += [(f, path, start, end) for start, end in ranges]
+    if spectrafiles:
+        batch = max(1, min(256, len(spectrafiles) // (4 * nworkers)))
+        outputs["tunespectra"] = ("tunespectra", os.path.join(odir, "tunespectra.npz"), (len(spectrafiles) + batch - 1) // batch)
+        tasks += [("tunespectra", spectrafiles[i:i + batch], 0, 0) for i in range(0, len(spectrafiles), batch)]
+    total = sum(os.path.getsize(p) for p in args if os.path.isfile(p))
+    os.makedirs(odir, exist_ok = True)
+
+    start = time.perf_counter()
+    done = 0
+    records = 0
+    skipped = 0
+    parts = {}
+    shown = start
+    with multiprocessing.Pool(nworkers) as pool:
+        for task, columns, nskipped, nbytes in pool.imap(_convert, tasks): # in order of the tasks
+            key = "tunespectra" if task[0] == "tunespectra" else task[1]
+            parts.setdefault(key, []).append(columns)
+            done += nbytes
+            records += len(next(iter(columns.values())))
+            skipped += nskipped
+            f, opath, nshards = outputs[key]
+            if len(parts[key]) == nshards:
+                joined = join(f, parts.pop(key))
+                (np.savez_compressed if compress else np.savez)(opath, **joined)
+                print("%s: %d records written to %s" % ("all _tunespectra.log" if key == "tunespectra" else key, len(next(iter(joined.values()))), opath))
+            now = time.perf_counter()
+            if now - shown > 1.:
+                shown = now
+                print("%.0f of %.0f MB, %.1f MB/s, %d records" % (done / 1E6, total / 1E6, done / 1E6 / (now - start), records))
+    dt = time.perf_counter() - start
+    print("%.0f MB in %.1f s with %d workers, %.1f MB/s, %.0f records/s, %d records skipped" % (done / 1E6, dt, nworkers, done / 1E6 / dt, records / dt, skipped))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Last records of a log file, read backwards from the end in blocks, so a display can be preloaded at startup in a
+time that depends on the window and not on the size of the log: nmr.log (one reading per line), tunes.log (one
+payload per paragraph) and picopoll.log (records separated by "/n/t").
+"""
+import getopt, os, sys, time
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -i [Logfile] -n [Records] -s [Separator]
+
+Read the last records of a logfile and report the time it took.
+
+-h                Show this help message and exit
+-i [Logfile]      Logfile, default "tunes.log"
+-n [Records]      Number of records, default "1000"
+-s [Separator]    Separator of the records, default "\\n\\n"
+""" % sys.argv[0])
+
+
+def tail(path, n, sep = "\n", match = None, blocksize = 1 << 16):
+    """
+    Return the last n records of path separated by sep, oldest first, empty if there is no such file,
+    match(record) can skip records, e.g. of other channels
+    """
+    if not os.path.isfile(path):
+        return []
+    sep = sep.encode('utf-8')
+    records = [] # newest first
+    def take(part):
+        text = part.decode('utf-8', 'replace').strip()
+        if text and (match is None or match(text)):
+            records.append(text)
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        rest = b""
+        while pos > 0 and len(records) < n:
+            size = min(blocksize, pos)
+            pos -= size
+            f.seek(pos)
+            parts = (f.read(size) + rest).split(sep)
+            rest = parts[0] # may continue in the block before
+            for part in reversed(parts[1:]):
+                take(part)
+        if pos == 0 and len(records) < n:
+            take(rest)
+    return records[:n][::-1]
+
+
+def main(argv):
+    ifile = "tunes.log"
+    n = 1000
+    sep = "\n\n"
+    try:
+        opts, args = getopt.getopt(argv, "hi:n:s:")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-i":
+            ifile = arg
+        elif opt == "-n":
+            n = int(arg)
+        elif opt == "-s":
+            sep = arg.encode('utf-8').decode('unicode_escape')
+
+    start = time.perf_counter()
+    records = tail(ifile, n, sep)
+    print("%d of %d records from the end of %s (%.1f MB) in %.1f ms" % (len(records), n, ifile, os.path.getsize(ifile) / 1E6 if os.path.isfile(ifile) else 0., 1000. * (time.perf_counter() - start)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
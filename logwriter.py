@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Log files written in a background thread, so a slow or lost network share holds up the writer and not the
+acquisition or the MQTT callbacks: write() only puts the record into a bounded queue, the thread appends what has
+come together once there is a batch of it or a second has passed, and starts a new file when the current one gets
+too large or at midnight. Records that cannot be written are tried again with the next batch, after cutting off
+what a failed write left of them in the file, while the queue is full new records are dropped and counted.
+"""
+import getopt, os, queue, sys, threading, time
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -n [Records] -o [Logfile] -s [Size]
+
+Write records to a logfile with and without the background writer and report the time the caller spends per record.
+
+-h             Show this help message and exit
+-n [Records]   Number of records, default "100000"
+-o [Logfile]   Logfile, default "logwriter.log", removed afterwards
+-s [Size]      Bytes per record, default "40" (one NMR reading)
+""" % sys.argv[0])
+
+
+class LogWriter:
+    """
+    Background writer for path, or for the path given with each record, with rotate the size in MB at which a new
+    file is started or "daily" and header written at the start of every new file
+    """
+    def __init__(self, path = None, rotate = None, maxqueue = 10000, batchsize = 1 << 16, interval = 1., header = None):
+        self.path = path
+        self.header = header
+        self.maxbytes = 0
+        self.daily = rotate == "daily"
+        if rotate and not self.daily:
+            self.maxbytes = int(float(rotate) * 1E6)
+        self.maxqueue = maxqueue
+        self.batchsize = batchsize
+        self.interval = interval
+        self.queue = queue.Queue(maxqueue)
+        self.files = {}
+        self.good = {} # path: size of the file before a write that failed, to be restored before trying again
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.rotations = 0
+        self.errors = 0
+        self._latencies = [0.] * 1000
+        self.thread = threading.Thread(target = self._run, name = "logwriter", daemon = True)
+        self.thread.start()
+
+    def write(self, data, path = None):
+        """
+        Queue text or bytes for path or the default path, returns False if the queue is full and it was dropped
+        """
+        try:
+            self.queue.put_nowait((path or self.path, data))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped in (1, 10, 100) or self.dropped % 1000 == 0:
+                print(time.strftime("%Y-%m-%d %H:%M:%S") + ": log queue full, %d records dropped" % self.dropped)
+            return False
+
+    def flush(self):
+        pass # the thread writes at least every interval
+
+    def close(self, timeout = 10.):
+        """
+        Write what is queued and stop, gives up after timeout s if the share does not answer
+        """
+        try:
+            self.queue.put(None, timeout = timeout)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+
+    def _run(self):
+        batch = []
+        size = 0
+        deadline = None
+        closing = False
+        while not closing:
+            try:
+                item = self.queue.get(timeout = None if deadline is None else max(0., deadline - time.monotonic()))
+                if item is None:
+                    closing = True
+                else:
+                    batch.append(item)
+                    size += len(item[1])
+                    if deadline is None:
+                        deadline = time.monotonic() + self.interval
+            except queue.Empty:
+                pass
+            if batch and (closing or size >= self.batchsize or time.monotonic() >= deadline):
+                batch = self._flush(batch)
+                size = sum(len(data) for path, data in batch)
+                deadline = time.monotonic() + self.interval if batch else None
+        if batch:
+            print("%d log records could not be written" % len(batch))
+        for f in self.files.values():
+            f.close()
+
+    def _open(self, path, nbytes):
+        """
+        Open file of path for appending, move it aside first if it is full or from an earlier day
+        """
+        f = self.files.get(path)
+        if f is None:
+            f = self.files[path] = self._new(path)
+        if f.tell() > len(self.header or b"") and (self.maxbytes and f.tell() + nbytes > self.maxbytes or self.daily and time.strftime("%Y%m%d", time.localtime(os.fstat(f.fileno()).st_mtime)) != time.strftime("%Y%m%d")):
+            del self.files[path]
+            f.close()
+            os.replace(path, self._rotated(path))
+            self.rotations += 1
+            f = self.files[path] = self._new(path)
+        return f
+
+    def _rotated(self, path):
+        """
+        Name of a full file moved aside, path with the time of its last write and a counter if that exists already
+        """
+        name = path + "." + time.strftime("%Y%m%d-%H%M%S", time.localtime(os.path.getmtime(path)))
+        rotated = name
+        k = 1
+        while os.path.exists(rotated):
+            rotated = "%s.%d" % (name, k)
+            k += 1
+        return rotated
+
+    def _new(self, path):
+        f = open(path, 'ab')
+        if path in self.good:
+            if f.tell() > self.good[path]: # part of the batch that failed
+                f.truncate(self.good[path])
+            del self.good[path]
+        if self.header and not f.tell():
+            f.write(self.header)
+        return f
+
+    def _flush(self, batch):
+        """
+        Write a batch, return the records that failed
+        """
+        start = time.perf_counter()
+        paths = {}
+        for path, data in batch:
+            paths.setdefault(path, []).append(data.encode('utf-8') if isinstance(data, str) else data)
+        failed = []
+        for path, chunks in paths.items():
+            data = b"".join(chunks)
+            f = offset = None
+            try:
+                f = self._open(path, len(data))
+                offset = f.tell()
+                f.write(data)
+                f.flush()
+                self.written += len(data)
+            except OSError as err:
+                if offset is not None and path not in self.good:
+                    self.good[path] = offset
+                self.errors += 1
+                print(time.strftime("%Y-%m-%d %H:%M:%S") + ": cannot write %s, trying again: %s" % (path, err))
+                f = self.files.pop(path, None)
+                if f:
+                    try:
+                        f.close()
+                    except OSError:
+                        pass
+                failed.extend((path, chunk) for chunk in chunks)
+        for path in [path for path in self.files if path not in paths]: # e.g. one file per spectrum
+            self.files.pop(path).close()
+        if len(failed) > self.maxqueue:
+            self.dropped += len(failed) - self.maxqueue
+            failed = failed[-self.maxqueue:]
+        self._latencies[self.batches % len(self._latencies)] = time.perf_counter() - start
+        self.batches += 1
+        return failed
+
+    def stats(self):
+        """
+        Queue depth, bytes written, batches, dropped records, rotations, write errors and write latency percentiles / s
+        """
+        latencies = sorted(self._latencies[:min(self.batches, len(self._latencies))])
+        result = {"queued": self.queue.qsize(), "written": self.written, "batches": self.batches, "dropped": self.dropped, "rotations": self.rotations, "errors": self.errors}
+        for p in (50, 99, 100):
+            result["p%d" % p] = latencies[min(len(latencies) - 1, len(latencies) * p // 100)] if latencies else 0.
+        return result
+
+    def printstats(self):
+        s = self.stats()
+        print("%d bytes logged in %d batches, %d queued, %d dropped, %d write errors, write latency p50 = %.1f ms, p99 = %.1f ms, max = %.1f ms" % (s["written"], s["batches"], s["queued"], s["dropped"], s["errors"], 1000 * s["p50"], 1000 * s["p99"], 1000 * s["p100"]))
+
+
+def main(argv):
+    n = 100000
+    ofile = "logwriter.log"
+    size = 40
+    try:
+        opts, args = getopt.getopt(argv, "hn:o:s:")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-n":
+            n = int(arg)
+        elif opt == "-o":
+            ofile = arg
+        elif opt == "-s":
+            size = int(arg)
+
+    record = "x" * (size - 1) + "\n"
+    f = open(ofile, 'a')
+    start = time.perf_counter()
+    for i in range(n):
+        f.write(record)
+        f.flush()
+    direct = time.perf_counter() - start
+    f.close()
+    os.remove(ofile)
+    writer = LogWriter(ofile, maxqueue = n)
+    start = time.perf_counter()
+    for i in range(n):
+        writer.write(record)
+    queued = time.perf_counter() - start
+    writer.close()
+    total = time.perf_counter() - start
+    print("write and flush %.2f us/record, queued %.2f us/record, written after %.2f s" % (1E6 * direct / n, 1E6 * queued / n, total))
+    writer.printstats()
+    if os.path.getsize(ofile) != n * size:
+        print("%s has %d bytes instead of %d" % (ofile, os.path.getsize(ofile), n * size))
+    os.remove(ofile)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
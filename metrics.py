@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Timers around the stages of a cycle (acquire, parse, fit, encode, publish, render, log), collected in histograms with
+power of two buckets and published every interval on "<topic>/$metrics/<client>" as
+"t:interval:stage:count:sum:max:c0:...:c27:stage:...", where c0 counts durations below 1 us and ck those from
+2**(k-1) us to 2**k us, the last one everything longer. With metrics off the timers are a shared no-op.
+"""
+import contextlib, getopt, math, sys, time
+import mqttclient
+
+
+METRICSTOPIC = "/$metrics"
+NBUCKETS = 28 # up to 2**26 us = 67 s
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -b [Broker IP-address:Port] -t [Topic]
+
+Print the stage timings published by publishers and subscribers started with -M.
+
+-h                     Show this help message and exit
+-b [IP:Port]           Specify different broker IP-address and port, default "jedibroker.ikp.kfa-juelich.de:1883"
+-t [Topic]             Topics to watch, default "COSY/#"
+""" % sys.argv[0])
+
+
+class _Timer:
+    """
+    Context manager adding the time spent within to a stage, one per stage, so it must not be nested in itself
+    """
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.metrics.add(self.stage, time.perf_counter() - self.start)
+
+
+class Metrics:
+    """
+    Histograms of the stage durations of one program, published every interval seconds
+    """
+    def __init__(self, client, topic, interval = 60.):
+        self.client = client
+        self.topic = topic + METRICSTOPIC + "/" + client.uid
+        self.interval = interval
+        self.stages = {}
+        self.timers = {}
+        self.start = time.time()
+
+    def time(self, stage):
+        timer = self.timers.get(stage)
+        if timer is None:
+            timer = self.timers[stage] = _Timer(self, stage)
+        return timer
+
+    def add(self, stage, duration):
+        """
+        Add a duration / s to the histogram of a stage
+        """
+        h = self.stages.get(stage)
+        if h is None:
+            h = self.stages[stage] = [0, 0., 0., [0] * NBUCKETS]
+        h[0] += 1
+        h[1] += duration
+        h[2] = max(h[2], duration)
+        h[3][min(max(math.frexp(duration * 1E6)[1], 0), NBUCKETS - 1)] += 1
+
+    def payload(self, now):
+        return ":".join(["%f:%.3f" % (now, now - self.start)] + ["%s:%d:%.9g:%.9g:" % (stage, h[0], h[1], h[2]) + ":".join(map(str, h[3])) for stage, h in self.stages.items()])
+
+    def publish(self):
+        """
+        Publish and restart the histograms once the interval is over, call it once per cycle
+        """
+        now = time.time()
+        if now - self.start < self.interval:
+            return
+        if self.stages:
+            self.client.publish(self.topic, self.payload(now), spool = False) # of no use later
+        self.stages = {}
+        self.start = now
+
+
+class _Off:
+    """
+    Stand-in for Metrics when they are off
+    """
+    def time(self, stage):
+        return _NOTIMER
+
+    def add(self, stage, duration):
+        pass
+
+    def publish(self):
+        pass
+
+
+_NOTIMER = contextlib.nullcontext()
+OFF = _Off()
+
+
+def parse(payload):
+    """
+    Return t, interval and a dict stage: (count, sum, max, buckets) of a metrics payload
+    """
+    p = payload.split(":")
+    stages = {}
+    for i in range(2, len(p), 4 + NBUCKETS):
+        stages[p[i]] = (int(p[i + 1]), float(p[i + 2]), float(p[i + 3]), [int(c) for c in p[i + 4:i + 4 + NBUCKETS]])
+    return float(p[0]), float(p[1]), stages
+
+
+def percentile(buckets, q):
+    """
+    Upper bound / s of the bucket holding the q-th percentile
+    """
+    n = sum(buckets)
+    total = 0
+    for k, c in enumerate(buckets):
+        total += c
+        if total and total >= q / 100. * n:
+            return 2.**k * 1E-6
+    return 0.
+
+
+def on_message(client, userdata, msg):
+    """
+    Callback for when a PUBLISH message is received from the server
+    """
+    if METRICSTOPIC + "/" not in msg.topic:
+        return
+    try:
+        t, interval, stages = parse(msg.payload.decode('utf-8'))
+    except (IndexError, ValueError):
+        print("%s: cannot parse %r" % (msg.topic, msg.payload[:40]))
+        return
+    print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)) + ": %s over %.0f s" % (msg.topic, interval))
+    for stage, (count, total, longest, buckets) in sorted(stages.items()):
+        p50, p99 = [min(percentile(buckets, q), longest) for q in (50, 99)]
+        print("  %-8s %6d x, mean %9.3f ms, p50 < %9.3f ms, p99 < %9.3f ms, max %9.3f ms" % (stage, count, 1000. * total / max(count, 1), 1000. * p50, 1000. * p99, 1000. * longest))
+
+
+def main(argv):
+    brokerIP = "jedibroker.ikp.kfa-juelich.de"
+    brokerPort = 1883
+    topic = "COSY/#"
+    try:
+        opts, args = getopt.getopt(argv, "hb:t:")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-b":
+            brokerIP = arg.split(":")[0]
+            brokerPort = int(arg.split(":")[1])
+        elif opt == "-t":
+            topic = str(arg)
+
+    client = mqttclient.connect(brokerIP, brokerPort, "metrics")
+    try:
+        client.subscribe(topic) # renewed after every reconnect
+        client.on_message = on_message
+        # blocking call that processes network traffic, dispatches callbacks and handles reconnecting.
+        client.loop_forever(retry_first_connection = True)
+    except (KeyboardInterrupt):
+        print("Disconnecting...")
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
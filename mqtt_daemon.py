@@ -0,0 +1,268 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import asyncio, concurrent.futures, getopt, queue, sys, threading, time
+import latency, liveprofile, mqttclient, mqttspool
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -b [Broker IP-address:Port] -f [user@host:path,Sleeptime] -g [GPIB,Sleeptime] -i [File] -n [IP:Port] -p [Sleeptime] -q [Path] -t [Prefix] -T -z [Interval]
+
+Acquisition daemon: runs the publishers of mqtt_nmr, mqtt_tune, mqtt_frev and mqtt_picopoll as tasks of one process
+on one broker connection, every device given is polled on its own schedule.
+
+-h                            Show this help message and exit
+-b [IP:Port]                  Specify different broker IP-address and port, default "jedibroker.ikp.kfa-juelich.de:1883"
+-f [user@host:path,Sleeptime] Spectrum analyzer file read via ssh for "<Prefix>/frev", e.g. "cosy@snoopy.cc.kfa-juelich.de:/mnt/cc-x/smb/fsv/update,10"
+-g [GPIB,Sleeptime]           Network analyzer for "<Prefix>/tune", e.g. "TCPIP0::ikp060.ikp.kfa-juelich.de::gpib0,7::INSTR,30"
+-i [File]                     Sync. osz. spectrum sent along with the tune spectra, default "/mnt/cc-x/smb/fsv/update"
+-n [IP:Port]                  NMR device for "<Prefix>/nmr", e.g. "localhost:20001"
+-p [Sleeptime]                Poll the running picoscope for "<Prefix>/RF-Devs/<measurement>" every Sleeptime s
+-q [Path]                     Store messages in directory while the broker is unreachable and send them afterwards
+-t [Prefix]                   Optional MQTT topic prefix, default "COSY"
+-T                            Append acquisition and publish times as "|start:end:publish" for mqtt_latencysuscriber, only if all subscribers strip them
+-z [Interval]                 Send compressed differences to a full spectrum sent every z cycles instead of text
+""" % sys.argv[0])
+
+
+def device(arg, wait):
+    """
+    Split "address,Sleeptime", addresses like GPIB ones may contain commas themselves
+    """
+    address, sep, interval = arg.rpartition(",")
+    try:
+        return (address, float(interval)) if sep else (arg, wait)
+    except ValueError:
+        return (arg, wait)
+
+
+class DaemonExecutor(concurrent.futures.Executor):
+    """
+    One long-lived daemon thread running the calls in order, periodic() uses one per device. A device that hangs
+    only holds up its own calls and, unlike the threads of ThreadPoolExecutor, cannot keep the interpreter from exiting.
+    """
+    def __init__(self, name = None):
+        self.calls = queue.SimpleQueue()
+        threading.Thread(target = self._work, name = name, daemon = True).start()
+
+    def _work(self):
+        while True:
+            future, fn, args, kwargs = self.calls.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as err: # also SystemExit of the device functions
+                future.set_exception(err)
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        self.calls.put((future, fn, args, kwargs))
+        return future
+
+
+def timed(acquire):
+    """
+    Return acquire() with the start and end time of the acquisition, taken in the thread that does it
+    """
+    start = time.time()
+    data = acquire()
+    return data, start, time.time()
+
+
+async def periodic(name, interval, acquire, send):
+    """
+    Run blocking acquire() in the thread of the device every interval seconds and send its result, errors of one
+    device are printed and do not stop the others
+    """
+    loop = asyncio.get_running_loop()
+    executor = DaemonExecutor(name) # the thread of this device
+    while True:
+        start = loop.time()
+        try:
+            send(*await loop.run_in_executor(executor, timed, acquire))
+        except (Exception, SystemExit) as err: # the device functions of the single publishers exit on errors
+            print(time.strftime("%Y-%m-%d %H:%M:%S") + ": %s failed: %r" % (name, err))
+        await asyncio.sleep(max(0., interval - (loop.time() - start)))
+
+
+async def nmr(ip, port, topic):
+    """
+    Read the NMR stream without blocking and publish every reading, reconnect if the stream is closed
+    """
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(ip, port)
+        except OSError as err:
+            print("Cound not connect to %s:%s via TCP: %s" % (ip, str(port), err))
+            await asyncio.sleep(5.)
+            continue
+        print("Connected TCP Stream at %s:%s" % (ip, str(port)))
+        while True:
+            data = (await reader.readline()).decode('utf-8', 'replace')
+            if not data:
+                break
+            start = time.time()
+            try:
+                state = data[0]
+                field = float(data.rstrip()[1:-1])
+            except (IndexError, ValueError) as err:
+                print(str(err))
+                continue
+            client.publish(topic, latency.stamp("%f:%s:%f" % (start, state, field), start, time.time()), retain = True)
+        writer.close()
+        print("TCP Stream at %s:%s closed" % (ip, str(port)))
+        await asyncio.sleep(1.)
+
+
+def spectra(topic, names, encoder):
+    """
+    Return send function publishing a list of spectra like mqtt_tune and mqtt_frev
+    """
+    def send(spectrumlist, start, end):
+        if encoder:
+            payload, iskey = encoder.encode(spectrumlist)
+            payload = latency.stamp(payload, start, end)
+            client.publish(topic, payload, retain = True)
+            if iskey:
+                import spectrumcodec
+                client.publish(topic + spectrumcodec.KEYTOPIC, payload, retain = True)
+        else:
+            client.publish(topic, latency.stamp(":".join((name + ":" if name else "") + ":".join(map(str, spectrum)) for name, spectrum in zip(names, spectrumlist)), start, end), retain = True)
+        print(time.strftime("%Y-%m-%d %H:%M:%S") + ": %s spectra sent" % topic)
+    return send
+
+
+def tune(address, ifile):
+    """
+    Return acquire function polling the network analyzer like mqtt_tune
+    """
+    import mqtt_tune # visa is only needed with a network analyzer
+    lib, nwa = mqtt_tune.gpib(address)
+    def acquire():
+        spectrumlist = [mqtt_tune.getfrev(ifile)]
+        nwa.write('CHAN1') # Switch network analyzer to channel 1
+        spectrumlist.append(mqtt_tune.gettune(nwa))
+        nwa.write('CHAN2') # Switch network analyzer to channel 2
+        spectrumlist.append(mqtt_tune.gettune(nwa))
+        lib.gpib_control_ren(nwa.session, 6) # Raw command to switch network analyzer back to local
+        return spectrumlist
+    return acquire
+
+
+def frev(address):
+    """
+    Return acquire function copying the spectrum analyzer file like mqtt_frev
+    """
+    import mqtt_frev # paramiko and scp are only needed with a spectrum analyzer
+    user, host = address.split(":")[0].split("@")
+    ifile = address.split(":")[1]
+    ssh, scp = mqtt_frev.sshtransport(host, user, "")
+    def acquire():
+        scp.get(ifile)
+        return [mqtt_frev.getspectrum(ifile.split("/")[-1])[0]]
+    return acquire
+
+
+def pico(topic):
+    """
+    Return acquire and send functions polling the picoscope like mqtt_picopoll
+    """
+    import mqtt_picopoll
+    def send(picodata, start, end):
+        for point in picodata:
+            datastring = point[0]+":"+str(point[1])+":"+str(point[2])+":"+str(point[3])
+            client.publish(topic+"/"+point[0].split(" / ")[0], latency.stamp(datastring, start, end), retain = True)
+        print(time.strftime("%Y-%m-%d %H:%M:%S") + ": %d picoscope measurements sent" % len(picodata))
+    return mqtt_picopoll.pico, send
+
+
+async def run(tasks):
+    await asyncio.gather(*[task() for task in tasks])
+
+
+def main(argv):
+    # Default parameters
+    global client
+    brokerIP = "jedibroker.ikp.kfa-juelich.de"
+    brokerPort = 1883
+    prefix = "COSY"
+    ifile = "/mnt/cc-x/smb/fsv/update"
+    nmrdev = frevdev = tunedev = None
+    picowait = 0.
+    spool = ""
+    encoder = None
+    # Read CMD-arguments given
+    try:
+        opts, args = getopt.getopt(argv, "hb:f:g:i:n:p:q:t:Tz:")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-b":
+            brokerIP = arg.split(":")[0]
+            brokerPort = int(arg.split(":")[1])
+        elif opt == "-f":
+            frevdev = device(arg, 10.)
+        elif opt == "-g":
+            tunedev = device(arg, 30.)
+        elif opt == "-i":
+            ifile = arg
+        elif opt == "-n":
+            nmrdev = (arg.split(":")[0], int(arg.split(":")[1]))
+        elif opt == "-p":
+            picowait = float(arg)
+        elif opt == "-q":
+            spool = str(arg)
+        elif opt == "-t":
+            prefix = str(arg)
+        elif opt == "-T":
+            latency.enabled = True
+        elif opt == "-z":
+            import spectrumcodec # needs numpy, which the text mode does not
+            encoder = spectrumcodec.Encoder(int(arg))
+    if not (nmrdev or frevdev or tunedev or picowait):
+        usage()
+        sys.exit(2)
+
+    client = mqttclient.connect(brokerIP, brokerPort, "mqtt_daemon")
+    liveprofile.install("mqtt_daemon") # SIGUSR1 samples the stacks, SIGUSR2 the allocations
+    if spool:
+        client.spool = mqttspool.Spool(spool)
+        client.spool.start(client, 20.)
+    client.loop_start() # network traffic and reconnects are handled in the background
+    tasks = []
+    if nmrdev:
+        tasks.append(lambda: nmr(nmrdev[0], nmrdev[1], prefix + "/nmr"))
+    if tunedev:
+        acquiretune = tune(tunedev[0], ifile)
+        sendtune = spectra(prefix + "/tune", ["frev", "channel1", "channel2"], encoder)
+        tasks.append(lambda: periodic("tune", tunedev[1], acquiretune, sendtune))
+    if frevdev:
+        acquirefrev = frev(frevdev[0])
+        # an encoder per topic, the keyframes of one topic are no use for the other
+        sendfrev = spectra(prefix + "/frev", [""], spectrumcodec.Encoder(encoder.keyinterv) if encoder else None)
+        tasks.append(lambda: periodic("frev", frevdev[1], acquirefrev, sendfrev))
+    if picowait:
+        acquirepico, sendpico = pico(prefix + "/RF-Devs")
+        tasks.append(lambda: periodic("picoscope", picowait, acquirepico, sendpico))
+    try:
+        asyncio.run(run(tasks))
+    # Quit daemon upon keyboard interrupt
+    except (KeyboardInterrupt):
+        print("Disconnecting...")
+        client.printstats()
+        client.disconnect()
+        client.loop_stop()
+        if client.spool:
+            client.spool.close()
+        # devices still hanging in their daemon threads end with the interpreter
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,25 +1,88 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
-import getopt, os, sys, paho.mqtt.publish as publish
+import getopt, os, sys, time, paho.mqtt.publish as publish
+import paho.mqtt.client as mqtt
 
 def usage():
     """
     Usage function
     """
-    print("""Usage: %s -b <Broker IP-address:Port> -t <topic>
+    print("""Usage: %s -b <Broker IP-address:Port> -t <topic> -w <wildcard> -q <quiet time> -n -y
 
 -h    Show this help message and exit
 -b    Specify different broker IP-address and port, default "jedibroker.ikp.kfa-juelich.de:1883"
 -t    Retained MQTT topic to delete
+-w    Delete all retained topics matching a wildcard subscription, e.g. "COSY/RF-Devs/#"
+-q    Seconds without new retained messages after which collecting stops, default "2"
+-n    Dry run, only list the retained topics matching the wildcard
+-y    Do not ask for confirmation before deleting
 """ % sys.argv[0])
 
 
+def collect(ip, port, wildcard, quiet):
+    """
+    Subscribe to wildcard and collect retained topics until the broker stays quiet for the given time
+    """
+    topics = []
+    last = [time.time()]
+    def on_connect(client, userdata, flags, rc):
+        client.subscribe(wildcard)
+    def on_message(client, userdata, msg):
+        if msg.retain and msg.payload and msg.topic not in topics: # empty payloads are already deleted
+            topics.append(msg.topic)
+            last[0] = time.time()
+    client = mqtt.Client("delretained_"+str(os.getpid()), True)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(ip, port)
+    client.loop_start()
+    try:
+        while time.time() - last[0] < quiet:
+            time.sleep(0.05)
+    finally:
+        client.loop_stop()
+        client.disconnect()
+    return sorted(topics)
+
+
+def clear(ip, port, topics):
+    """
+    Publish empty retained messages for all topics in one pipelined batch and wait for the broker's acknowledgements
+    """
+    pending = set()
+    client = mqtt.Client("delretained_"+str(os.getpid()), True)
+    client.max_inflight_messages_set(max(len(topics), 20)) # do not throttle the batch to paho's default window of 20
+    client.max_queued_messages_set(0)
+    def on_publish(client, userdata, mid):
+        pending.discard(mid)
+    client.on_publish = on_publish
+    client.connect(ip, port)
+    client.loop_start()
+    start = time.time()
+    try:
+        for topic in topics:
+            rc, mid = client.publish(topic, None, qos = 1, retain = True)
+            pending.add(mid)
+        while pending and time.time() - start < 10. + 0.01 * len(topics):
+            time.sleep(0.001)
+    finally:
+        duration = time.time() - start
+        client.loop_stop()
+        client.disconnect()
+    return len(topics) - len(pending), duration
+
+
 def main(argv):
     brokerIP = "jedibroker.ikp.kfa-juelich.de"#"134.94.220.203"
     brokerPort = 1883
+    topic = ""
+    wildcard = ""
+    quiet = 2.
+    dryrun = 0
+    confirm = 1
     # read CMD-arguments given
-    try:         
-        opts, args = getopt.getopt(argv, "hb:t:")
+    try:
+        opts, args = getopt.getopt(argv, "hb:t:w:q:ny")
     except getopt.GetoptError as err:
         print(str(err)+"\n")
         usage()
@@ -30,18 +93,48 @@ def main(argv):
             sys.exit()
         elif opt == "-b":
             brokerIP= arg.split(":")[0]
-            brokerPort = float(arg.split(":")[1])
+            brokerPort = int(arg.split(":")[1])
         elif opt == "-t":
             topic = str(arg)
-            
+        elif opt == "-w":
+            wildcard = str(arg)
+        elif opt == "-q":
+            quiet = float(arg)
+        elif opt == "-n":
+            dryrun = 1
+        elif opt == "-y":
+            confirm = 0
+
+    if wildcard:
+        try:
+            topics = collect(brokerIP, brokerPort, wildcard, quiet)
+        except:
+            print("Broker %s:%s not found" % (brokerIP, brokerPort))
+            sys.exit(2)
+        print("\n".join(topics))
+        print("%d retained topics matching %s on %s:%s" % (len(topics), wildcard, brokerIP, str(brokerPort)))
+        if dryrun or not topics:
+            sys.exit()
+        if confirm and input("Delete all %d topics? [y/N] " % len(topics)).lower() != "y":
+            sys.exit()
+        try:
+            n, duration = clear(brokerIP, brokerPort, topics)
+        except:
+            print("Broker %s:%s not found" % (brokerIP, brokerPort))
+            sys.exit(2)
+        print("Deleted %d of %d topics in %.3f s (%.0f topics/s)" % (n, len(topics), duration, n / max(duration, 1E-6)))
+        if n != len(topics):
+            sys.exit(1)
+        sys.exit()
+
     try:
         uid = "delretained_"+str(os.getpid())
         payload = [(topic, None, 0, True)]
         publish.multiple(payload, brokerIP, brokerPort, uid)
         print("Deleting "+topic+" from "+brokerIP+":"+str(brokerPort))
-    except:     
+    except:
         print("Broker %s:%s not found" % (brokerIP, brokerPort))
         sys.exit(2)
-            
+
 if __name__ == "__main__":
     main(sys.argv[1:])
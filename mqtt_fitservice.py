@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import getopt, sys, time
+import liveprofile, mqttclient, peakfinder, spectrumcodec, tunefit, tunehistory
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -a [Window] -b [Broker IP-address:Port] -e -F [frev harmonic] -g [Group] -H [Tune harmonic] -o [Delay] -t [Topic]
+
+Headless fit service: fits the beam spectra once and publishes the results on "<Topic>/fit", so displays started with -r do not have to fit themselves.
+For high rates start any number of workers with -g on one or more hosts, the broker hands each spectrum to one of them,
+and one collector with -o, which publishes their results in timestamp order.
+
+-h                     Show this help message and exit
+-a [Window]            Keep rolling statistics of f_rev and tunes over the last fits and publish them on "<Topic>/history"
+-b [IP:Port]           Specify different broker IP-address and port, default "jedibroker.ikp.kfa-juelich.de:1883"
+-e                     Fast mode, use closed-form peak estimates instead of fits
+-F [frev Harmonic]     Harmonic F of the revolution frequency the Spectrum Analyzer set up for, as in df= F*frev, default "1"
+-g [Group]             Worker of a shared subscription "$share/<Group>/<Topic>", publishes unordered results on "<Topic>/fit/raw"
+-H [Tune harmonic]     Harmonic H of the revolution frequency the NWA is set up for, as in f=(H+q)*frev, default "1"
+-o [Delay]             Collector, publishes the results of the workers on "<Topic>/fit" in timestamp order after Delay seconds
+-t [Topic]             Optional MQTT topic, default "COSY/tune"
+""" % sys.argv[0])
+
+
+def on_message(client, userdata, msg):
+    """
+    Callback for when a PUBLISH message is received from the server
+    """
+    global lastt
+    key = cached = None
+    if not msg.topic.endswith(spectrumcodec.KEYTOPIC):
+        key = tunefit.digest(msg.payload)
+        cached = cache.get(key)
+        if cached and msg.retain:
+            return
+    if cached: # sent again by the publisher, its result is cheap to repeat
+        t, fits, results = cached
+    else:
+        parsed = tunefit.parse(msg, decoder)
+        if not parsed:
+            return
+        spectra, p = parsed
+        t = float(spectra[0][0])
+        if msg.retain and t <= lastt: # retained spectra after a reconnect, their result is retained as well
+            return
+        lastt = max(lastt, t)
+        fits, results = tunefit.fitspectra(spectra, revh, tuneh, fast)
+        if key:
+            cache.put(key, (t, fits, results))
+    if group:
+        client.publish(topic + tunefit.RAWTOPIC, tunefit.pack(t, fits, results), qos = 1)
+    else:
+        publish(client, t, fits, results)
+    print("fit latency p50 = %.1f ms, p99 = %.1f ms, max = %.1f ms" % tuple(1000. * t for t in peakfinder.latency()))
+
+
+def on_result(client, userdata, msg):
+    """
+    Callback of the collector for the results of the workers
+    """
+    payload = msg.payload.decode('utf-8')
+    reorder.add(float(payload.split(":")[0]), payload)
+
+
+def publish(client, t, fits, results):
+    """
+    Publish fit results retained on <topic>/fit and update the history
+    """
+    client.publish(topic + tunefit.FITTOPIC, tunefit.pack(t, fits, results), retain = True)
+    peaks, peakerrs = results[0], results[1]
+    print(time.strftime("%Y-%m-%d %H:%M:%S") + ": f_rev = (%.5f +- %.5f) kHz, q_x = %.4f +- %.4f, q_y = %.4f +- %.4f, converged %s" % (peaks[0], peakerrs[0], peaks[1], peakerrs[1], peaks[2], peakerrs[2], "".join(str(fit[2]) for fit in fits)))
+    if history:
+        drifting = history.add(peaks)
+        client.publish(topic + tunehistory.HISTORYTOPIC, history.payload(t), retain = True)
+        if drifting:
+            print(time.strftime("%Y-%m-%d %H:%M:%S") + ": drift of %s beyond threshold" % ", ".join(drifting))
+
+
+def main(argv):
+    # Default parameters
+    global topic, revh, tuneh, fast, decoder, history, group, reorder, cache, lastt
+    brokerIP = "jedibroker.ikp.kfa-juelich.de"
+    brokerPort = 1883
+    topic = "COSY/tune"
+    revh = 1.
+    tuneh = 1.
+    fast = False
+    history = None
+    group = None
+    reorder = None
+    decoder = spectrumcodec.Decoder()
+    cache = tunefit.FitCache()
+    lastt = 0.
+    # Read CMD-arguments given
+    try:
+        opts, args = getopt.getopt(argv, "ha:b:eF:g:H:o:t:")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-a":
+            history = tunehistory.TuneHistory(int(arg))
+        elif opt == "-b":
+            brokerIP = arg.split(":")[0]
+            brokerPort = int(arg.split(":")[1])
+        elif opt == "-e":
+            fast = True
+        elif opt == "-F":
+            revh = float(arg)
+        elif opt == "-g":
+            group = str(arg)
+        elif opt == "-H":
+            tuneh = float(arg)
+        elif opt == "-o":
+            reorder = tunefit.Reorder(float(arg))
+        elif opt == "-t":
+            topic = str(arg)
+
+    if reorder:
+        collect(brokerIP, brokerPort)
+        return
+    if not fast:
+        peakfinder.preload() # import now, not within the time budget of the first fit
+    client = mqttclient.connect(brokerIP, brokerPort, "mqtt_fitservice")
+    liveprofile.install("mqtt_fitservice") # SIGUSR1 samples the stacks, SIGUSR2 the allocations
+    try:
+        # renewed after every reconnect, the keyframes of delta encoded spectra go to every worker
+        client.subscribe("$share/%s/%s" % (group, topic) if group else topic)
+        client.subscribe(topic + spectrumcodec.KEYTOPIC)
+        client.on_message = on_message
+        # blocking call that processes network traffic, dispatches callbacks and handles reconnecting.
+        client.loop_forever(retry_first_connection = True)
+    except (KeyboardInterrupt):
+        print("Disconnecting...")
+        client.printstats()
+        client.disconnect()
+
+
+def collect(brokerIP, brokerPort):
+    """
+    Collector of a shared subscription, releases the results of the workers in timestamp order
+    """
+    client = mqttclient.connect(brokerIP, brokerPort, "mqtt_fitcollector")
+    liveprofile.install("mqtt_fitcollector") # SIGUSR1 samples the stacks, SIGUSR2 the allocations
+    client.subscribe(topic + tunefit.RAWTOPIC, qos = 1)
+    client.on_message = on_result
+    client.loop_start()
+    try:
+        while True:
+            time.sleep(reorder.window / 4.)
+            for t, payload in reorder.ready():
+                t, fits, results = tunefit.unpack(payload)
+                publish(client, t, fits, results)
+            if reorder.late:
+                print("%d results arrived too late, increase the delay" % reorder.late)
+                reorder.late = 0
+    except (KeyboardInterrupt):
+        print("Disconnecting...")
+        client.printstats()
+        client.disconnect()
+        client.loop_stop()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,16 +1,14 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import getpass, getopt, os, sys, time
-import paramiko
-from scp import SCPClient
-import paho.mqtt.client as mqtt
+import latency, liveprofile, mqttclient
 
 
 def usage():
     """
     Usage function
     """
-    print("""Usage: %s -i [user@host:path] -t [Topic] -s [sleeptime]
+    print("""Usage: %s -i [user@host:path] -t [Topic] -T -z [Interval] -s [sleeptime]
 
 Read in spectrum analyzer File (/mnt/cc-x/smb/fsv/update) and transmit measured spectra via MQTT in fixed time intervals.
 
@@ -18,30 +16,17 @@ Read in spectrum analyzer File (/mnt/cc-x/smb/fsv/update) and transmit measured
 -i [user@host:path]   Input file, default "cosy@snoopy.cc.kfa-juelich.de:/mnt/cc-x/smb/fsv/update"
 -s [sleeptime]        Poll interval in s, should match COSY cycle length, default "60"
 -t [Topic]            Optional MQTT topic, default "COSY/frev"
+-T                    Append acquisition and publish times as "|start:end:publish" for mqtt_latencysuscriber, only if all subscribers strip them
+-z [Interval]         Send compressed differences to a full spectrum sent every z cycles instead of text
 """ % sys.argv[0])
 
 
-def connect(ip, port):
-    """
-    Generate unique client name and connect to mqtt broker
-    """
-    try:
-        pid = os.getpid()
-        uid = "visa_"+str(pid)
-        global client
-        client = mqtt.Client(uid, False)
-        client.connect(ip, port, 300)
-    except:
-        print("Broker %s not found" % ip)
-        if client:
-            client.disconnect()
-        sys.exit(2)
-
-        
 def sshtransport(server, user, passwd):
     """
     Try to connect to server via ssh and open transport for file transfer
     """
+    import paramiko # slow to import, loaded when connecting
+    from scp import SCPClient
     ssh = paramiko.SSHClient()
     ssh.load_system_host_keys()
     ssh.load_host_keys(os.path.expanduser("~/.ssh/known_hosts"))
@@ -98,9 +83,10 @@ def main(argv):
     brokerPort = 1883
     topic="COSY/frev"
     wait = 10
+    encoder = None
     # Read CMD-arguments given
     try:
-        opts, args = getopt.getopt(argv, "hi:s:t:")
+        opts, args = getopt.getopt(argv, "hi:s:t:Tz:")
     except getopt.GetoptError as err:
         print(str(err)+"\n")
         usage()
@@ -118,8 +104,15 @@ def main(argv):
             wait = int(arg)
         elif opt == "-t":
             topic = str(arg)
+        elif opt == "-T":
+            latency.enabled = True
+        elif opt == "-z":
+            import spectrumcodec
+            encoder = spectrumcodec.Encoder(int(arg))
 
-    #connect(brokerIP, brokerPort)
+    client = mqttclient.connect(brokerIP, brokerPort, "mqtt_frev")
+    liveprofile.install("mqtt_frev") # SIGUSR1 samples the stacks, SIGUSR2 the allocations
+    client.loop_start() # network traffic and reconnects are handled in the background
     ssh, scp = sshtransport(sshIP, sshUser, sshPWD)
     # test
     try:
@@ -134,7 +127,8 @@ def main(argv):
     print(":".join(map(str, fspectrum[0])))
     
     try:
-        while client.loop() == 0:
+        while True:
+            start = time.time()
             try:
                 scp.get(ifile)
                 ssh.close()
@@ -143,16 +137,26 @@ def main(argv):
                 ssh.close()
                 sys.exit(2)
             syncspectrum = getspectrum(ifile.split("/")[-1])
-            syncspectrum = ":".join(map(str, syncspectrum[0]))
-            # debug
-            #print(syncspectrum)
-            client.publish(topic, syncspectrum, retain=True)
+            end = time.time()
+            if encoder:
+                payload, iskey = encoder.encode([syncspectrum[0]])
+                payload = latency.stamp(payload, start, end)
+                client.publish(topic, payload, retain=True)
+                if iskey:
+                    client.publish(topic + spectrumcodec.KEYTOPIC, payload, retain=True)
+            else:
+                syncspectrum = ":".join(map(str, syncspectrum[0]))
+                # debug
+                #print(syncspectrum)
+                client.publish(topic, latency.stamp(syncspectrum, start, end), retain=True)
             print(time.strftime("%Y-%m-%d %H:%M:%S")+": "+"Longitudnal beam spectrum sent")
             time.sleep(wait) 
     # Quit publisher upon keyboard interrupt
     except (KeyboardInterrupt):
         print("Disconnecting...")
+        client.printstats()
         client.disconnect()
+        client.loop_stop()
 
                     
 if __name__ == "__main__":
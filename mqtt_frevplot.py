@@ -1,50 +1,36 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
-import getpass, getopt, os, sys, time
+import getpass, getopt, sys, time
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
-import paramiko
-from scp import SCPClient
-import paho.mqtt.client as mqtt
+import latency, mqttclient, peakfinder, waterfall
 
 
 def usage():
     """
     Usage function
     """
-    print("""Usage: %s -i [user@host:path] -t [Topic] -s [Sleeptime]
+    print("""Usage: %s -e -i [user@host:path] -t [Topic] -T -z [Interval] -s [Sleeptime] -w [N]
 
 Read in spectrum analyzer File (/mnt/cc-x/smb/fsv/update) and transmit measured spectra via MQTT in fixed time intervals.
 
 -h                    Show this help message and exit
+-e                    Fast mode, use closed-form peak estimate instead of fit
 -i [user@host:path]   Input file, default "cosy@snoopy.cc.kfa-juelich.de:/mnt/cc-x/smb/fsv/update"
 -s [sleeptime]        Poll interval in s, should match COSY cycle length, default "60"
 -t [Topic]            Optional MQTT topic, default "COSY/frev"
+-T                    Append acquisition and publish times as "|start:end:publish" for mqtt_latencysuscriber, only if all subscribers strip them
+-w [N]                Show the last N spectra and fitted peaks as waterfall in a second window
+-z [Interval]         Send compressed differences to a full spectrum sent every z cycles instead of text
 """ % sys.argv[0])
 
 
-def connect(ip, port):
-    """
-    Generate unique client name and connect to mqtt broker
-    """
-    try:
-        pid = os.getpid()
-        uid = "visa_"+str(pid)
-        global client
-        client = mqtt.Client(uid, False)
-        client.connect(ip, port, 300)
-    except:
-        print("Broker %s not found" % ip)
-        if client:
-            client.disconnect()
-        sys.exit(2)
-
-        
 def sshtransport(server, user, passwd):
     """
     Try to connect to server via ssh and open transport for file tranfer
     """
+    import paramiko # slow to import, loaded when connecting
+    from scp import SCPClient
     ssh = paramiko.SSHClient()
     ssh.load_system_host_keys()
     #ssh.load_host_keys(os.path.expanduser("~" + os.sep() + ".ssh" + os.sep() + "known_hosts"))
@@ -106,18 +92,16 @@ def lorentz_offset(x, amp, xpeak, fwhm, offset):
     return amp / (1 + ((x - xpeak) / fwhm)**2) + offset
 
     
-def peakfit(xdata, ydata):
+def peakfit(xdata, ydata, fast = False):
     """
-    A simple peakfinder
+    A simple peakfinder, seeded by the closed-form estimate, which is returned without errors in fast mode,
+    fits only the region around the peak unless that fit fails
     """
-    ymax = max(ydata)
-    imax = ydata.index(ymax)
-    xmax = xdata[imax]
-    startvalues = (ymax, xmax, 10.)
+    startvalues = peakfinder.estimate(xdata, ydata) # replaces the preliminary fit without offset
+    if fast:
+        return (np.array(startvalues), np.zeros(4), np.zeros((4, 4)))
     # see http://docs.scipy.org/doc/scipy-0.15.1/reference/generated/scipy.optimize.curve_fit.html
-    fitpar, fitcovar = curve_fit(lorentz, xdata, ydata, startvalues)
-    fitpar, fitcovar = curve_fit(lorentz_offset, xdata, ydata, (fitpar[0], fitpar[1], fitpar[2], -100.))
-    fitparerr = np.sqrt(np.diag(fitcovar))
+    fitpar, fitparerr, fitcovar = peakfinder.fit(xdata, ydata, startvalues) # FitTimeout with the best parameters so far at the deadline
     return (fitpar, fitparerr, fitcovar)
      
 
@@ -125,7 +109,7 @@ def createplot(ntraces, npoints, fmin, fmax):
     """
     Create empty plot with all the traces used later on
     """
-    global f, ax, x, y, l, lfit
+    global f, ax, x, y, l, lfit, wf
     f, ax = plt.subplots(1, 1, sharex = 'col') # 2 plots sharing one x-axis
     #plt.rcParams['text.usetex'] = True
     plt.rcParams['font.size'] = 14
@@ -145,6 +129,13 @@ def createplot(ntraces, npoints, fmin, fmax):
     lfit, = ax.plot(x, [0] * npoints, 'k--', lw = 2, label = "Lorentzian") # Empty fit function 
     ax.legend()
     ax.set_ylabel("Amp. / dBm")
+    wf = None
+    if rows: # Waterfall of the spectrum history in a second window
+        fw, axw = plt.subplots(1, 1)
+        fw.suptitle("Synchrotron Oscillation Spectra History")
+        axw.set_xlabel("f / Hz")
+        wf = waterfall.Waterfall(axw, rows)
+        plt.figure(f.number) # the spectrum stays the current figure, e.g. for savefig
     plt.draw()
     return
 
@@ -160,8 +151,12 @@ def updateplot(npoints, fmin, fmax, data):
     conv = 1
     x = [fmin + n * (fmax - fmin) / npoints for n in range(npoints)]
     # Peakfit
+    timedout = False
     try:
-        pars, parerrs, covariance = peakfit(x, data)
+        try:
+            pars, parerrs, covariance = peakfit(x, data, fast)
+        except peakfinder.FitTimeout as err:
+            pars, parerrs, timedout = err.pars, np.zeros(4), True
         if pars[1] < fmin or pars[1] > fmax:
             raise UserWarning
         frev = pars[1] / harm / 1000 # harmonic of revolution frequency / kHz
@@ -171,19 +166,24 @@ def updateplot(npoints, fmin, fmax, data):
         print("frev = (%.3f +- %.3f) kHz, FWHM = (%.3f +- %.3f) kHz" % (frev, freverr, fwhm, fwhmerr))
         result = "Current Amp.: $f_{peak} \pm FWHM/2= (%.2f \pm %.2f)$ kHz" % (pars[1], pars[2])
         conv = 1
+        if timedout: # best-effort result, shown but flagged as not converged
+            print("Fit stopped at its deadline")
+            result = "Stopped at deadline, " + result
+            conv = 0
     except (RuntimeError, UserWarning): # Catch faulty/ non-converged fits
-        ymax = max(data)
-        imax = data.index(ymax)
-        xmax = x[imax]
+        xmax = peakfinder.estimate(x, data)[1]
         print("Fit did not converge, max. amp at %.2f Hz" % xmax)
         result = "Fit did not converge, max. Amp. at $%.2f$ Hz" % xmax
         conv = 0
+        timedout = False # best parameters so far outside the spectrum
 
     y.append(data) # Append latest measurement
     del y[0] # Delete oldest measurement
+    if wf:
+        wf.add(data, fmin, fmax, pars[1] if conv == 1 or timedout else np.nan)
     for i, line in enumerate(l):
         line.set_ydata(y[i]) # Update plot data
-    if conv == 1:
+    if conv == 1 or timedout:
         lfit.set_ydata([lorentz_offset(xdata, pars[0], pars[1], pars[2], pars[3]) for xdata in x]) 
     elif conv ==0:
         lfit.set_ydata([0] * len(x))
@@ -205,13 +205,16 @@ def main(argv):
     brokerIP = "jedibroker.ikp.kfa-juelich.de"
     brokerPort = 1883
     topic = "COSY/frev"
-    global harm
+    global harm, fast, rows
     harm = 1.
+    fast = False
+    rows = 0
     history = 1
+    encoder = None
 
     # Read CMD-arguments given
     try:
-        opts, args = getopt.getopt(argv, "hi:s:t:")
+        opts, args = getopt.getopt(argv, "hei:s:t:Tw:z:")
     except getopt.GetoptError as err:
         print(str(err)+"\n")
         usage()
@@ -220,6 +223,8 @@ def main(argv):
         if opt == "-h":
             usage()
             sys.exit()
+        elif opt == "-e":
+            fast = True
         elif opt == "-i":
             address= arg.split(":")
             sshuser = adress[0].split("@")[0]
@@ -229,8 +234,16 @@ def main(argv):
             wait = int(arg)
         elif opt == "-t":
             topic = str(arg)
+        elif opt == "-T":
+            latency.enabled = True
+        elif opt == "-w":
+            rows = int(arg)
+        elif opt == "-z":
+            import spectrumcodec
+            encoder = spectrumcodec.Encoder(int(arg))
 
-    connect(brokerIP, brokerPort)
+    client = mqttclient.connect(brokerIP, brokerPort, "mqtt_frevplot")
+    client.loop_start() # network traffic and reconnects are handled in the background
     ssh, scp = sshtransport(sshIP, sshUser, sshPWD)
     # test
     try:
@@ -252,7 +265,8 @@ def main(argv):
     input("ENTER to continue")
     
     try:
-        while client.loop() == 0:
+        while True:
+            start = time.time()
             try:
                 scp.get(ifile)
                 ssh.close()
@@ -261,16 +275,26 @@ def main(argv):
                 ssh.close()
                 sys.exit(2)
             syncspectrum = getspectrum(ifile.split("/")[-1])
-            syncspectrum = ":".join(map(str, syncspectrum[0]))
-            # debug
-            #print(syncspectrum)
-            client.publish(topic, syncspectrum, retain=True)
+            end = time.time()
+            if encoder:
+                payload, iskey = encoder.encode([syncspectrum])
+                payload = latency.stamp(payload, start, end)
+                client.publish(topic, payload, retain=True)
+                if iskey:
+                    client.publish(topic + spectrumcodec.KEYTOPIC, payload, retain=True)
+            else:
+                syncspectrum = ":".join(map(str, syncspectrum[0]))
+                # debug
+                #print(syncspectrum)
+                client.publish(topic, latency.stamp(syncspectrum, start, end), retain=True)
             print(time.strftime("%Y-%m-%d %H:%M:%S")+": "+"Longitudnal beam spectrum sent")
             time.sleep(wait) 
     # Quit publisher upon keyboard interrupt
     except (KeyboardInterrupt):
         print("Disconnecting...")
+        client.printstats()
         client.disconnect()
+        client.loop_stop()
 
                     
 if __name__ == "__main__":
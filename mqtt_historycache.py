@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import getopt, sys, time
+import historycache, liveprofile, mqttclient
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -b [Broker IP-address:Port] -m [MB] -n [Messages] -r [Request topic] -t [Topics]
+
+Keep the last messages of every topic and send them to subscribers asking for them at start, e.g.
+mqtt_nmrsuscriber -C, in one binary message, so they start with a full window instead of the retained message only.
+
+-h                     Show this help message and exit
+-b [IP:Port]           Specify different broker IP-address and port, default "jedibroker.ikp.kfa-juelich.de:1883"
+-m [MB]                Size of the cache, topics not asked for or updated for the longest time are dropped first, default "64"
+-n [Messages]          Messages kept per topic, default "1000"
+-r [Request topic]     Topic of the requests, default "COSY/$history"
+-t [Topics]            Topics to keep, separated by commas, default "COSY/#"
+""" % sys.argv[0])
+
+
+def on_message(client, userdata, msg):
+    """
+    Callback for when a PUBLISH message is received from the server
+    """
+    if "/$" in msg.topic: # requests, responses, pings and metrics
+        return
+    if msg.retain and cache.last(msg.topic) == msg.payload: # sent again after a reconnect
+        return
+    cache.add(msg.topic, msg.payload)
+
+
+def on_request(client, userdata, msg):
+    """
+    Callback for the requests, "<response topic>:<correlation>:<n>:<topic filter>"
+    """
+    global served
+    start = time.perf_counter()
+    try:
+        response, correlation, n, topicfilter = msg.payload.decode('utf-8').split(":", 3)
+        n = int(n)
+    except (UnicodeDecodeError, ValueError):
+        print("cannot parse request %r" % msg.payload[:80])
+        return
+    messages = cache.get(topicfilter, n)
+    payload = historycache.pack(correlation, messages)
+    client.publish(response, payload, qos = 1, spool = False)
+    served += 1
+    print(time.strftime("%Y-%m-%d %H:%M:%S") + ": %d messages of %s, %d bytes to %s in %.1f ms" % (len(messages), topicfilter, len(payload), response, 1000. * (time.perf_counter() - start)))
+
+
+def main(argv):
+    # Default parameters
+    global cache, served
+    brokerIP = "jedibroker.ikp.kfa-juelich.de"
+    brokerPort = 1883
+    topics = ["COSY/#"]
+    requesttopic = historycache.REQUESTTOPIC
+    n = 1000
+    maxbytes = 64 << 20
+    served = 0
+    # Read CMD-arguments given
+    try:
+        opts, args = getopt.getopt(argv, "hb:m:n:r:t:")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-b":
+            brokerIP = arg.split(":")[0]
+            brokerPort = int(arg.split(":")[1])
+        elif opt == "-m":
+            maxbytes = int(float(arg) * (1 << 20))
+        elif opt == "-n":
+            n = int(arg)
+        elif opt == "-r":
+            requesttopic = str(arg)
+        elif opt == "-t":
+            topics = str(arg).split(",")
+
+    cache = historycache.Cache(n, maxbytes)
+    client = mqttclient.connect(brokerIP, brokerPort, "mqtt_historycache")
+    liveprofile.install("mqtt_historycache") # SIGUSR1 samples the stacks, SIGUSR2 the allocations
+    try:
+        for topic in topics:
+            client.subscribe(topic) # renewed after every reconnect
+        client.subscribe(requesttopic)
+        client.message_callback_add(requesttopic, on_request)
+        client.on_message = on_message
+        # blocking call that processes network traffic, dispatches callbacks and handles reconnecting.
+        client.loop_forever(retry_first_connection = True)
+    except (KeyboardInterrupt):
+        print("Disconnecting...")
+        print("%d topics, %.1f MB cached, %d topics dropped, %d requests served" % (len(cache.topics), cache.size / 1E6, cache.evicted, served))
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
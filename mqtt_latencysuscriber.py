@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import getopt, os, sys, time
+import latency, mqttclient
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -b [Broker IP-address:Port] -n [Messages] -p [Ping topic] -t [Topic] -u [Interval]
+
+Receive the messages of the publishers started with -T and report per topic where their time goes: acquisition at the device,
+waiting for the broker and transit from publishing to arrival here. Transit includes the offset between the clocks
+of the publisher and this host, which is estimated from the fastest message and the round trip of pings to this
+subscriber through the broker, assuming the publisher is as far from the broker as this host.
+
+-h                     Show this help message and exit
+-b [IP:Port]           Specify different broker IP-address and port, default "jedibroker.ikp.kfa-juelich.de:1883"
+-n [Messages]          Percentiles over the last messages of each topic, default "1000"
+-p [Ping topic]        Topic for the pings, default "COSY/$latency"
+-t [Topic]             Topics to watch, separated by commas, default "COSY/#"
+-u [Interval]          Report every Interval s, default "10"
+""" % sys.argv[0])
+
+
+def on_message(client, userdata, msg):
+    """
+    Callback for when a PUBLISH message is received from the server
+    """
+    received = time.time()
+    if msg.retain or "/$" in msg.topic: # stored by the broker before, or pings and metrics
+        return
+    stamps = latency.split(msg.payload)[1]
+    if not stamps:
+        unstamped.add(msg.topic)
+        return
+    if msg.topic not in trackers:
+        trackers[msg.topic] = latency.Tracker(n)
+    trackers[msg.topic].add(stamps, received)
+
+
+def on_ping(client, userdata, msg):
+    """
+    Callback for the pings of this subscriber, they took the way to the broker and back
+    """
+    global rtt
+    try:
+        rtt = min(rtt, time.time() - float(msg.payload))
+    except ValueError:
+        pass
+
+
+def report():
+    if rtt == float("inf"):
+        print(time.strftime("%Y-%m-%d %H:%M:%S") + ": no ping came back from the broker yet")
+    else:
+        print(time.strftime("%Y-%m-%d %H:%M:%S") + ": round trip to the broker %.1f ms" % (1000. * rtt))
+    for topic in sorted(trackers):
+        tracker = trackers[topic]
+        print("%s, %d messages" % (topic, tracker.count["total"]) + (", clock offset about %+.1f ms" % (1000. * (tracker.transit - rtt)) if rtt < float("inf") else ""))
+        print(tracker.report())
+    if unstamped:
+        print("without timestamps: " + ", ".join(sorted(unstamped)))
+
+
+def main(argv):
+    # Default parameters
+    global trackers, unstamped, rtt, n
+    brokerIP = "jedibroker.ikp.kfa-juelich.de"
+    brokerPort = 1883
+    topics = ["COSY/#"]
+    pingtopic = "COSY/$latency"
+    interval = 10.
+    n = 1000
+    trackers = {}
+    unstamped = set()
+    rtt = float("inf")
+    # Read CMD-arguments given
+    try:
+        opts, args = getopt.getopt(argv, "hb:n:p:t:u:")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-b":
+            brokerIP = arg.split(":")[0]
+            brokerPort = int(arg.split(":")[1])
+        elif opt == "-n":
+            n = int(arg)
+        elif opt == "-p":
+            pingtopic = str(arg)
+        elif opt == "-t":
+            topics = str(arg).split(",")
+        elif opt == "-u":
+            interval = float(arg)
+
+    ping = pingtopic + "/" + str(os.getpid())
+    client = mqttclient.connect(brokerIP, brokerPort, "mqtt_latencysuscriber")
+    for topic in topics:
+        client.subscribe(topic) # renewed after every reconnect
+    client.subscribe(ping)
+    client.message_callback_add(ping, on_ping)
+    client.on_message = on_message
+    client.loop_start()
+    try:
+        while True:
+            for i in range(10): # the fastest of some pings is closest to the way through the broker alone
+                client.publish(ping, "%f" % time.time())
+                time.sleep(interval / 20.)
+            time.sleep(interval / 2.)
+            report()
+    # Quit subscriber upon keyboard interrupt
+    except (KeyboardInterrupt):
+        print("Disconnecting...")
+        report()
+        client.disconnect()
+        client.loop_stop()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,41 +1,25 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
-import getopt, os, socket, sys, time
-import paho.mqtt.client as mqtt
+import getopt, socket, sys, time
+import latency, liveprofile, mqttclient, mqttspool
 
 
 def usage():
     """
     Usage function
     """
-    print("""Usage: %s -a [IP:Port] -t [Topic]
+    print("""Usage: %s -a [IP:Port] -q [Path] -t [Topic] -T
 
 Connect to NMR device via TCP and publisch received measurement results via MQTT.
 
 -h             Show this help message and exit
 -a [IP:Port]   IP4 address of device, default "134.94.216.123:10001"
+-q [Path]      Store messages in directory while the broker is unreachable and send them afterwards
 -t [Topic]     Optional MQTT topic, default "COSY/nmr"  
+-T             Append acquisition and publish times as "|start:end:publish" for mqtt_latencysuscriber, only if all subscribers strip them
 """ % sys.argv[0])
 
 
-def connect(ip, port):
-    """
-    Generate unique client name and connect to mqtt broker
-    """
-    try:
-        pid = os.getpid()
-        uid = "visa_"+str(pid)
-        global client
-        client = mqtt.Client(uid, False)
-        client.connect(ip, port, 300)
-        print("Connected to Broker %s:%s" %(ip, str(port)))
-    except:
-        print("Broker %s not found" % ip)
-        if client:
-            client.disconnect()
-        sys.exit(2)
-
-        
 def tcp(ip, port):
     """
     Connect to TCP device
@@ -71,9 +55,10 @@ def main(argv):
     brokerIP = "jedibroker.ikp.kfa-juelich.de"
     brokerPort = 1883
     topic="COSY/nmr"
+    spool = ""
     # Read CMD-arguments given
     try:
-        opts, args = getopt.getopt(argv, "ha:t:")
+        opts, args = getopt.getopt(argv, "ha:q:t:T")
     except getopt.GetoptError as err:
         print(str(err)+"\n")
         usage()
@@ -85,29 +70,43 @@ def main(argv):
         elif opt == "-a":
             devIP = arg.split(":")[0]
             devPort = int(arg.split(":")[1])
+        elif opt == "-q":
+            spool = str(arg)
         elif opt == "-t":
             topic = str(arg)
+        elif opt == "-T":
+            latency.enabled = True
 
     tcp(devIP, devPort)
-    connect(brokerIP, brokerPort)
+    client = mqttclient.connect(brokerIP, brokerPort, "mqtt_nmr")
+    liveprofile.install("mqtt_nmr") # SIGUSR1 samples the stacks, SIGUSR2 the allocations
+    if spool:
+        client.spool = mqttspool.Spool(spool)
+        client.spool.start(client, 50.)
+    client.loop_start() # network traffic and reconnects are handled in the background
     try:
-        while client.loop() == 0:
+        while True:
             #data = s.recv(4096)
             datafile = s.makefile()
             data = datafile.readline()
+            start = time.time() # the reading arrived, as close to the measurement as this side can tell
             try:
                 state = data[0]
                 field = float(data.rstrip()[1:-1])
             except ValueError as err:
                 print(str(err))
                 continue
-            client.publish(topic, "%f:%s:%f" % (time.time(), state, field), retain = True)
+            client.publish(topic, latency.stamp("%f:%s:%f" % (start, state, field), start, time.time()), retain = True)
             # debug
-            print(color("%d:%s:%.7f" % (time.time(), state, field), state))
+            print(color("%d:%s:%.7f" % (start, state, field), state))
     # Quit publisher upon keyboard interrupt
     except (KeyboardInterrupt):
         print("Disconnecting...")
+        client.printstats()
         client.disconnect()
+        client.loop_stop()
+        if client.spool:
+            client.spool.close()
         s.close()
                     
 if __name__ == "__main__":
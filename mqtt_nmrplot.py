@@ -6,22 +6,30 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as dates
 import matplotlib.lines as lines
 from matplotlib.animation import FuncAnimation
+from matplotlib.collections import LineCollection
 import paho.mqtt.client as mqtt
+import liveprofile, lodbuffer, logtail, logwriter, nmrlog
+
+
+LOCKS = "LSNX" # lock states in the order of their severity, X for unknown
 
 
 def usage():
     """
     Usage function
     """
-    print("""Usage: %s -i [IP:Port] -l -t [Topic] -w [Width]
+    print("""Usage: %s -B [Logfile] -i [IP:Port] -l -L -R [Rotation] -t [Topic] -w [Width]
 
 Connect to NMR device via TCP and publisch received measurement results via MQTT.
 
 -h             Show this help message and exit
+-B [Logfile]   Show the last readings of a logfile written with -l or -L, e.g. "nmr.log", at start
 -i [IP:Port]   IP4 address of device, default "134.94.216.123:10001"
 -l             Enable logging to local file
+-L             Enable logging to binary file nmr.nmrlog, fixed size records for analysis with nmrlog.py
+-R [Rotation]  Start a new logfile at midnight with "daily" or when it reaches Rotation MB
 -t [Topic]     Optional MQTT topic, default "COSY/nmr"
--w [Width]     Width of time interval to show in plot in seconds, default "200"
+-w [Width]     Width of time interval to show in plot in seconds, default "200", long windows are shown with min/max per pixel
 """ % sys.argv[0])
 
 
@@ -91,7 +99,7 @@ def getdata(file):
 
 
 def createplot(npoints = 120, updinterv = 1.):
-    global f, ax, x, y, c, coll
+    global f, ax, x, y, c, coll, bars, lod
     #plt.rcParams['text.usetex'] = True
     plt.rcParams['font.size'] = 14
     plt.rcParams['savefig.format'] = 'pdf'
@@ -105,6 +113,9 @@ def createplot(npoints = 120, updinterv = 1.):
     y = [0.] * npoints
     c = ['w'] * npoints
     coll = ax.scatter(x, y, s = 20, color = c, marker = 'o')
+    bars = LineCollection([], linewidths = 1) # min to max of the readings combined into one point
+    ax.add_collection(bars)
+    lod = lodbuffer.LODBuffer(npoints)
     f.autofmt_xdate()
     ax.xaxis.set_major_formatter(dates.DateFormatter('%H:%M:%S'))
     ax.set_xlabel("t / s")
@@ -117,16 +128,56 @@ def createplot(npoints = 120, updinterv = 1.):
     return coll,
 
 
+def add(time, lock, field):
+    lod.add(dates.date2num(dt.datetime.fromtimestamp(time)), field, 0., LOCKS.index(lock) if lock in LOCKS else len(LOCKS) - 1)
+
+
+def preload(path):
+    """
+    Fill the plot with the last readings of a logfile
+    """
+    readings = []
+    if os.path.isfile(path) and nmrlog.isbinary(path):
+        readings = nmrlog.readings(nmrlog.load(path)[-lod.n:])
+    else:
+        for record in logtail.tail(path, lod.n):
+            try:
+                t, lock, field = record.split(":")
+                readings.append((float(t), lock, float(field)))
+            except ValueError:
+                continue
+    if len(readings) > 1:
+        t = np.array([reading[0] for reading in readings[:-1]])
+        # matplotlib dates of local time, per reading only if the UTC offset changed within the window
+        offset = dates.date2num(dt.datetime.fromtimestamp(t[-1])) - t[-1] / 86400.
+        if dates.date2num(dt.datetime.fromtimestamp(t[0])) - t[0] / 86400. - offset < 1E-6:
+            t = t / 86400. + offset
+        else:
+            t = [dates.date2num(dt.datetime.fromtimestamp(ti)) for ti in t]
+        lod.load(t, [reading[2] for reading in readings[:-1]], 0., [LOCKS.index(reading[1]) if reading[1] in LOCKS else len(LOCKS) - 1 for reading in readings[:-1]])
+    if readings:
+        updateplot(*readings[-1])
+    print("%d readings loaded from %s" % (len(readings), path))
+
+
 def updateplot(time, lock, field):
-    x.append(dates.date2num(dt.datetime.fromtimestamp(time))) # add timestamp from x data to x
-    del x[0] # loose oldest x data
-    y.append(field) # same for y data
-    del y[0]
-    c.append(color(lock)) #same for color data
-    del c[0]
-    coll = ax.scatter(x, y, s = 30, color = c, marker = 'o')
+    """
+    Add reading and show the window at about one point per pixel, each point colored by the worst lock state
+    of the readings it combines, with bars from their minimum to maximum
+    """
+    add(time, lock, field)
+    x, lo, hi, y, flags = lod.get(int(ax.get_window_extent().width))
+    c = [color(LOCKS[flag]) for flag in flags]
+    coll.set_offsets(np.column_stack((x, y)))
+    coll.set_color(c)
+    bars.set_segments([((xi, l), (xi, h)) for xi, l, h in zip(x, lo, hi)])
+    bars.set_color(c)
+    if len(x) > 1:
+        ax.set_xlim(x[0], x[-1])
+    if hi.max() > lo.min():
+        ax.set_ylim(lo.min() - 0.05 * (hi.max() - lo.min()), hi.max() + 0.05 * (hi.max() - lo.min()))
     lbl = "Locked"
-    if c[-1] == 'g':
+    if lock == "L":
         lbl = dt.datetime.fromtimestamp(time).strftime("%H:%M:%S") + ": B = %.7f T" % field
     lock = lines.Line2D([], [], color='g', marker='o', markeredgecolor = 'g', markersize=10, linestyle = 'NONE', label = lbl)
     search = lines.Line2D([], [], color='y', marker='o', markeredgecolor = 'y', markersize=10, linestyle = 'NONE', label = 'Searching')
@@ -147,10 +198,13 @@ def main(argv):
     topic = "COSY/nmr"
     opath = "y:" + os.sep + "nmr" + os.sep #os.sep + "134.94.224.106"
     logfile = ""#open(opath + "nmr.log", 'a')#""
+    binlog = ""
+    rotate = None
     width = 200
+    backfill = None
     # Read CMD-arguments given
     try:
-        opts, args = getopt.getopt(argv, "hi:lt:w:")
+        opts, args = getopt.getopt(argv, "hB:i:lLR:t:w:")
     except getopt.GetoptError as err:
         print(str(err)+"\n")
         usage()
@@ -159,21 +213,34 @@ def main(argv):
         if opt == "-h":
             usage()
             sys.exit()
+        elif opt == "-B":
+            backfill = arg
         elif opt == "-i":
             devIP = arg.split(":")[0]
             devPort = int(arg.split(":")[1])
         elif opt == "-l":
-            logfile = open(opath + "nmr.log", 'a')
+            logfile = opath + "nmr.log"
+        elif opt == "-L":
+            binlog = opath + "nmr" + nmrlog.EXT
+        elif opt == "-R":
+            rotate = arg
         elif opt == "-t":
             topic = str(arg)
         elif opt == "-w":
             width = int(arg)
+    if logfile:
+        logfile = logwriter.LogWriter(logfile, rotate) # the share must not hold up the readings
+    if binlog:
+        binlog = logwriter.LogWriter(binlog, rotate, header = nmrlog.header())
             
     tcp(devIP, devPort)   
+    liveprofile.install("mqtt_nmrplot") # SIGUSR1 samples the stacks, SIGUSR2 the allocations
     #connect(brokerIP, brokerPort)
     global datafile
     datafile = s.makefile()
     createplot(width, 1.)
+    if backfill:
+        preload(backfill)
     try:
         while True:
             data = getdata(datafile)
@@ -186,12 +253,17 @@ def main(argv):
                 nmr = updateplot(time, lock, field)
                 if logfile:
                     logfile.write(":".join(map(str, data))+"\n")
-                    logfile.flush()
+                if binlog:
+                    binlog.write(nmrlog.pack(*data))
     # Quit publisher upon keyboard interrupt
     except (KeyboardInterrupt):
         print("Disconnecting...")
         #client.disconnect()
         s.close()
+        for log in (logfile, binlog):
+            if log:
+                log.close()
+                log.printstats()
         sys.exit(0)
     """
     try:
@@ -5,31 +5,36 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.dates as dates
 import matplotlib.lines as lines
-import paho.mqtt.client as mqtt
+import historycache, latency, liveprofile, logtail, logwriter, mqttclient, nmrlog
+
+
+newest = float("-inf") # t of the newest reading shown
+waiting = None # live readings held back until mqtt_historycache responds, with the time the first arrived
 
 
 def usage():
     """
     Usage function
     """
-    print("""Usage: %s -l -n [# of points] -t [topic]
+    print("""Usage: %s -B [Logfile] -C -l -L -n [# of points] -R [Rotation] -t [topic]
 
 Connect to NMR device via TCP and publisch received measurement results via MQTT.
 
 -h                 Show this help message and exit
+-B [Logfile]       Show the last readings of a logfile written with -l or -L, e.g. "nmr.log", at start
+-C                 Show the last readings kept by mqtt_historycache at start
 -l                 Enable logging to file .\\nmr.log
+-L                 Enable logging to binary file .\\nmr.nmrlog, fixed size records for analysis with nmrlog.py
 -n [# of points]   Width of time interval to show in plot in seconds, default "100"
+-R [Rotation]      Start a new logfile at midnight with "daily" or when it reaches Rotation MB
 -t [Topic]         Optional MQTT topic, default "COSY\\nmr"
 """ % sys.argv[0])
 
 
 def connect(ip, port):
 # Generate unique client name and connect to mqtt broker
-    pid = os.getpid()
-    uid = "visa_"+str(pid)
     global client
-    client = mqtt.Client(uid, False)
-    client.connect(ip, port, 300)
+    client = mqttclient.connect(ip, port, "mqtt_nmrsuscriber")
 
 
 def color(string):
@@ -66,7 +71,59 @@ def createplot(npoints = 180, updinterv = 1.):
     plt.show()
 
 
+def preload(path):
+    """
+    Fill the plot with the last readings of a logfile
+    """
+    readings = []
+    if os.path.isfile(path) and nmrlog.isbinary(path):
+        readings = nmrlog.readings(nmrlog.load(path)[-len(x):])
+    else:
+        for record in logtail.tail(path, len(x)):
+            try:
+                t, lock, field = record.split(":")
+                readings.append((float(t), lock, float(field)))
+            except ValueError:
+                continue
+    fill(readings, path)
+
+
+def history(messages):
+    """
+    Fill the plot with the readings sent by mqtt_historycache and the live readings held back meanwhile
+    """
+    global waiting
+    readings = []
+    for topic, payload in messages:
+        try:
+            t, lock, field = latency.split(payload.decode('utf-8'))[0].split(":")
+            readings.append((float(t), lock, float(field)))
+        except ValueError:
+            continue
+    if waiting:
+        readings += waiting[0]
+    waiting = None
+    fill(readings, "history cache")
+
+
+def fill(readings, source):
+    """
+    Append the readings after the newest shown to the plot in order of time
+    """
+    readings = historycache.merge(readings, newest)
+    older = readings[-len(x) - 1:-1]
+    if older:
+        x[:] = x[len(older):] + [dates.date2num(dt.datetime.fromtimestamp(t)) for t, lock, field in older]
+        y[:] = y[len(older):] + [field for t, lock, field in older]
+        c[:] = c[len(older):] + [color(lock) for t, lock, field in older]
+    if readings:
+        updateplot(*readings[-1])
+    print("%d readings loaded from %s" % (len(readings), source))
+
+
 def updateplot(time, lock, field):
+    global newest
+    newest = time
     x.append(dates.date2num(dt.datetime.fromtimestamp(time))) # add timestamp from x data to x
     del x[0] # loose oldest x data
     y.append(field) # same for y data
@@ -87,38 +144,50 @@ def updateplot(time, lock, field):
     plt.pause(0.001)
 
 
-def on_connect(client, userdata, flags, rc):
-    """
-    Callback for when the client receives a CONNACK response from the server
-    """
-    print("Connected with result code "+str(rc))
-    client.subscribe(topic)
-
-        
 def on_message(client, userdata, msg):
     """
     Callback for when a PUBLISH message is received from the server
     """
+    global waiting
+    received = time.time()
     t = msg.topic
-    p = msg.payload.decode('utf-8').split(":")
+    payload, stamps = latency.split(msg.payload.decode('utf-8'))
+    p = payload.split(":")
     print(p)
-    updateplot(float(p[0]), p[1], float(p[2]))
+    reading = (float(p[0]), p[1], float(p[2]))
+    if waiting is not None: # shown after the history, or without it once it is overdue
+        waiting[0].append(reading)
+        waiting[1] = waiting[1] or received
+        if received - waiting[1] > historycache.TIMEOUT:
+            readings = waiting[0]
+            waiting = None
+            fill(readings, "live messages, no response of the history cache")
+    elif reading[0] > newest: # not sent again after a reconnect
+        updateplot(*reading)
+    if stamps:
+        delays.add(stamps, received, time.time())
     if logfile:
-        logfile.write(":".join(p))
-        logfile.flush()
+        logfile.write(":".join(p)+"\n")
+    if binlog:
+        binlog.write(nmrlog.pack(float(p[0]), p[1], float(p[2])))
 
 
 def main(argv):
     # Default parameters
     brokerIP = "jedibroker.ikp.kfa-juelich.de"
     brokerPort = 1883
-    global logfile, npoints, topic
+    global logfile, binlog, npoints, topic, delays, waiting
     logfile = ''
+    binlog = ''
+    delays = latency.Tracker()
     npoints = 100
     topic = "COSY/nmr"
+    backfill = None
+    cached = False
+    rotate = None
     # Read CMD-arguments given
     try:
-        opts, args = getopt.getopt(argv, "hln:t:")
+        opts, args = getopt.getopt(argv, "hB:ClLn:R:t:")
     except getopt.GetoptError as err:
         print(str(err)+"\n")
         usage()
@@ -127,25 +196,46 @@ def main(argv):
         if opt == "-h":
             usage()
             sys.exit()
+        elif opt == "-B":
+            backfill = arg
+        elif opt == "-C":
+            cached = True
         elif opt == "-l":
-            logfile = open("nmr.log", 'a')
+            logfile = "nmr.log"
+        elif opt == "-L":
+            binlog = "nmr" + nmrlog.EXT
         elif opt == "-n":
             npoints = int(arg)
+        elif opt == "-R":
+            rotate = arg
         elif opt == "-t":
             topic = str(arg)
+    if logfile:
+        logfile = logwriter.LogWriter(logfile, rotate) # written in the background, not in the MQTT callback
+    if binlog:
+        binlog = logwriter.LogWriter(binlog, rotate, header = nmrlog.header())
             
     connect(brokerIP, brokerPort)
+    liveprofile.install("mqtt_nmrsuscriber") # SIGUSR1 samples the stacks, SIGUSR2 the allocations
     createplot(npoints) #create empty plot in right dimensions
+    if backfill:
+        preload(backfill)
+    if cached:
+        historycache.request(client, topic, len(x), history) # answered in one round trip after connecting
+        waiting = [[], None]
     try:
-        client.on_connect = on_connect
+        client.subscribe(topic) # renewed after every reconnect
         client.on_message = on_message
         # blocking call that processes network traffic, dispatches callbacks and handles reconnecting.    
-        client.loop_forever()
+        client.loop_forever(retry_first_connection = True)
     except (KeyboardInterrupt):
         print("Disconnecting...")     
+        print(delays.report())
         client.disconnect()
-        if logfile:
-            logfile.close()
+        for log in (logfile, binlog):
+            if log:
+                log.close()
+                log.printstats()
 
                     
 if __name__ == "__main__":
@@ -1,15 +1,12 @@
 #!/usr/bin/python3
-import getopt, os, sys, subprocess, math, time, datetime as dt
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-import paho.mqtt.client as mqtt
+import getopt, sys, subprocess, math, time, datetime as dt
+import latency, liveprofile, logwriter, metrics, mqttclient, mqttspool
 
 def usage():
     """
     Usage function
     """
-    print("""Usage: %s -b <Broker IP-address:Port> -t <topic> -u <updateintervall> -l -p -n <# of points>
+    print("""Usage: %s -b <Broker IP-address:Port> -t <topic> -u <updateintervall> -l -p -n <# of points> -q <path> -M <interval> -R <rotation> -T
 
 -h    Show this help message and exit
 -b    Specify different broker IP-address and port
@@ -18,22 +15,12 @@ def usage():
 -p    Enable plotting on local machine
 -l    Enable logging of measurements to file .\picopoll.log
 -n    Number of Points to show in plot, default 101 points
+-M    Publish histograms of the time spent to acquire, publish, log and plot on "<topic>/$metrics/<client>" every interval s
+-R    Start a new logfile at midnight with "daily" or when it reaches <rotation> MB
+-q    Store measurements in directory while the broker is unreachable and send them afterwards
+-T    Append acquisition and publish times as "|start:end:publish" for mqtt_latencysuscriber, only if all subscribers strip them
 """ % sys.argv[0])
 
-def connect(ip, port):
-    """
-    Generate unique client name and connect to mqtt broker
-    """
-    try:
-        pid = os.getpid()
-        uid = "picopoll_"+str(pid)
-        global client
-        client = mqtt.Client(uid, False)
-        client.connect(ip, port, 300)
-    except:
-        print("Broker %s:%s not found" % (ip, port))
-        sys.exit(2)
-                             
 def picounit(string):
     """
     Picoscopes give out measurement results in human readable units, postprocessing requires transformation back to floats
@@ -57,9 +44,9 @@ def pico():
     """
     Read configured measurements from running picoscope and return a list of data points
     """
+    timestamp = time.time() # time of the query, the picoscope answers with its current measurements
     try:
         csv = (str(subprocess.check_output("picoscope /a Measurements.CSV?"),"windows-1252").rstrip()).split("\r\n")[1:]
-        timestamp = time.time()
     except:
         sys.exit(2)
     datapoint = []
@@ -82,6 +69,8 @@ def createplot(picodata, n, u):
     Create empty plot with right dimensions for plottig the picoscope measurements
     """
     global x, xerr, y, yerr, f, axarr, l, c, b
+    import matplotlib.pyplot as plt # only needed for plotting, the publisher starts without it
+    import matplotlib.dates as mdates
     dim = len(picodata)
     start = picodata[0][1]
     timestamps = [start - u * (n - i) for i in range(n)] # generate list of npoints timestamps backwards from start
@@ -117,6 +106,7 @@ def set_errdata(line, caplines, barlinecols, x, xerr, y, yerr):
     """
     Matplotlibs default set_data() routine only updates the plotlines with x- and y-data, not the errorbars
     """
+    import numpy as np
     x = np.array(x)
     xerr = np.array(xerr)
     y = np.array(y)
@@ -130,6 +120,8 @@ def set_errdata(line, caplines, barlinecols, x, xerr, y, yerr):
     return
 
 def updateplot(picodata, updinterv):
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
     x.append(mdates.date2num(dt.datetime.fromtimestamp(picodata[0][1]))) # add timestamp from data to xdata
     del x[0] # loose oldest x-data
     for i, ax in enumerate(axarr):
@@ -143,10 +135,13 @@ def updateplot(picodata, updinterv):
         ax.autoscale_view()
         #print(i, mdates.num2date(x[0]), mdates.num2date(x[-1]), y[i][0], y[i][-1], yerr[i][-1])
     #plt.draw() # update plot
+    with timing.time("render"):
+        f.canvas.draw() # draw now, the pause only waits for the next update
     plt.pause(updinterv)
     return
     
 def main(argv):
+    global timing
     brokerIP = "jedibroker.ikp.kfa-juelich.de"#"134.94.220.203"
     brokerPort = 1883
     topic="COSY/RF-Devs"
@@ -154,10 +149,13 @@ def main(argv):
     plot = 0
     npoints = 21
     logfile = ''
+    spool = ''
+    metricsinterv = 0.
+    rotate = None
     
     # read CMD-arguments given
     try:         
-        opts, args = getopt.getopt(argv, "hb:t:u:lpn:")
+        opts, args = getopt.getopt(argv, "hb:t:u:lpn:q:M:R:T")
     except getopt.GetoptError as err:
         print(str(err)+"\n")
         usage()
@@ -171,29 +169,51 @@ def main(argv):
             brokerPort = float(arg.split(":")[1])
         elif opt == "-t":
             topic = str(arg)
+        elif opt == "-T":
+            latency.enabled = True
         elif opt == "-u":
             updinterv = float(arg)
         elif opt == "-l":
-            logfile = open("picopoll.log", 'a')
+            logfile = "picopoll.log"
         elif opt == "-p":
             plot = 1
         elif opt == "-n":
             npoints = int(arg)
+        elif opt == "-q":
+            spool = str(arg)
+        elif opt == "-M":
+            metricsinterv = float(arg)
+        elif opt == "-R":
+            rotate = arg
+    if logfile:
+        logfile = logwriter.LogWriter(logfile, rotate) # the share must not hold up the polling
     
-    connect(brokerIP, brokerPort)
+    client = mqttclient.connect(brokerIP, brokerPort, "picopoll")
+    liveprofile.install("mqtt_picopoll") # SIGUSR1 samples the stacks, SIGUSR2 the allocations
+    if spool:
+        client.spool = mqttspool.Spool(spool)
+        client.spool.start(client, 20.)
+    client.loop_start() # network traffic and reconnects are handled in the background
+    timing = metrics.Metrics(client, topic, metricsinterv) if metricsinterv else metrics.OFF
     if plot == 1:
         createplot(pico(), npoints, updinterv)
     try:
-        while client.loop() == 0:
+        while True:
+            start = time.time()
             picodata = pico()
+            end = time.time()
+            timing.add("acquire", end - start)
             for point in picodata:
                 datastring = point[0]+":"+str(point[1])+":"+str(point[2])+":"+str(point[3])
-                client.publish(topic+"/"+point[0].split(" / ")[0], datastring, retain = True)
+                with timing.time("publish"):
+                    client.publish(topic+"/"+point[0].split(" / ")[0], latency.stamp(datastring, start, end), retain = True)
                 print(time.strftime("%Y-%m-%d %H:%M:%S")+": "+datastring+" sent")
                 if logfile:
-                    logfile.write(time.strftime("%Y-%m-%d %H:%M:%S")+": "+datastring+"/n/t")
+                    with timing.time("log"):
+                        logfile.write(time.strftime("%Y-%m-%d %H:%M:%S")+": "+datastring+"/n/t")
             if (plot == 1 and len(picodata) == len(axarr)): #ommit empty points to cath dimension errors when plotting
                 updateplot(picodata, updinterv)
+            timing.publish()
             if plot == 0:
                 time.sleep(updinterv)
                 
@@ -201,8 +221,13 @@ def main(argv):
     except (KeyboardInterrupt):
         if logfile:
             logfile.close()
+            logfile.printstats()
         print("Disconnecting...")
+        client.printstats()
         client.disconnect()
+        client.loop_stop()
+        if client.spool:
+            client.spool.close()
             
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -1,21 +1,27 @@
 #!/usr/bin/python3
-import getopt, os, sys, math, time, datetime as dt
+import getopt, sys, math, time, datetime as dt
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-import paho.mqtt.client as mqtt
+import historycache, latency, liveprofile, lodbuffer, logtail, mqttclient
+
+
+newest = float("-inf") # t of the newest measurement shown
+waiting = None # live measurements held back until mqtt_historycache responds, with the time the first arrived
 
 
 def usage():
     """
     Usage function
     """
-    print("""Usage: %s -b <Broker IP-address:Port> -t <topic> -n <# of points>
+    print("""Usage: %s -B <Logfile> -C -b <Broker IP-address:Port> -t <topic> -n <# of points>
 
 -h    Show this help message and exit
+-B    Show the last measurements of the topic in a logfile of mqtt_picopoll -l, e.g. "picopoll.log", at start
+-C    Show the last measurements of the topic kept by mqtt_historycache at start
 -b    Specify different broker IP-address and port
 -t    MQTT topic, default "COSY/RF-Devs/A, Peak To Peak"
--n    Number of Points to show in plot, default 101 points
+-n    Number of Points to show in plot, default 101 points, long windows are shown with min/max per pixel
 """ % sys.argv[0])
 
     
@@ -23,13 +29,14 @@ def createplot(name, npoints, updinterv=1):
     """
     Create empty plot
     """
-    global x, xerr, y, yerr, l, c, b
+    global x, xerr, y, yerr, l, c, b, lod
     start = time.time()
     timestamps = [start - updinterv * (npoints - i) for i in range(npoints)] # generate list of npoints timestamps backwards from start
     x = [mdates.date2num(dt.datetime.fromtimestamp(t)) for t in timestamps] # reformat to python.datetime and from there to matplotlib floats and use as x-data
     xerr = [0.] * npoints # assuming error free timestams
     y = [0.] * npoints
     yerr = [0.] * npoints
+    lod = lodbuffer.LODBuffer(npoints)
     
     plt.ion() # interactive plotting
     plt.xticks(rotation=25 )
@@ -42,32 +49,33 @@ def createplot(name, npoints, updinterv=1):
     return
 
 
-def set_errdata(line, caplines, barlinecols, x, xerr, y, yerr):
+def set_errdata(line, caplines, barlinecols, x, xerr, y, ylo, yhi):
     """
-    Matplotlibs default set_data() routine only updates the plotlines with x- and y-data, not the errorbars, this does that
+    Matplotlibs default set_data() routine only updates the plotlines with x- and y-data, not the errorbars, this does that,
+    the y errorbars reach from ylo to yhi
     """
     x = np.array(x)
     xerr = np.array(xerr)
     y = np.array(y)
-    yerr = np.array(yerr)
+    ylo = np.array(ylo)
+    yhi = np.array(yhi)
     line.set_data(x, y)
-    errpos = (x-xerr,y), (x+xerr,y), (x, y - yerr), (x, y + yerr)
-    for i, pos in enumerate(errpos): # set caplines to ednpoints of errorbars
-        caplines[i].set_data(pos)
+    errpos = (x-xerr,y), (x+xerr,y), (x, ylo), (x, yhi)
+    for capline, pos in zip(caplines, errpos): # set caplines to ednpoints of errorbars, there are none without capsize
+        capline.set_data(pos)
     barlinecols[0].set_segments(zip(zip(x-xerr,y), zip(x+xerr,y))) # set xerror line between the endpoints
-    barlinecols[1].set_segments(zip(zip(x,y-yerr), zip(x,y+yerr))) # set yerror line between the endpoints
+    barlinecols[1].set_segments(zip(zip(x,ylo), zip(x,yhi))) # set yerror line between the endpoints
     return
 
     
 def updateplot(picodata):
-    x.append(mdates.date2num(dt.datetime.fromtimestamp(float(picodata[1])))) # add timestamp from data to xdata
-    del x[0] # loose oldest x-data
-    y.append(float(picodata[2])) #same for y data
-    del y[0]
-    yerr.append(float(picodata[3])) #same for y errors
-    del yerr[0]
+    global newest
+    newest = float(picodata[1])
+    lod.add(mdates.date2num(dt.datetime.fromtimestamp(float(picodata[1]))), float(picodata[2]), float(picodata[3])) # add timestamp, value and error
+    # about one point per pixel, errorbars from min to max of the readings combined into a point
+    x, ylo, yhi, y, flags = lod.get(int(plt.gca().get_window_extent().width))
     #plt.ion() #interactive plotting
-    set_errdata(l, c, b, x, xerr ,y, yerr) # update data
+    set_errdata(l, c, b, x, np.zeros(len(x)), y, ylo, yhi) # update data
     plt.gca().set_ylabel(picodata[0].split(", ")[1]) # get axis label from data
     plt.gca().relim() # autoscale axis if neccesary
     plt.gca().autoscale_view()
@@ -77,51 +85,95 @@ def updateplot(picodata):
     return
 
 
-def connect(ip, port):
+def preload(path):
     """
-    Generate unique client name and connect to mqtt broker
+    Fill the plot with the last measurements of the topic in a logfile of mqtt_picopoll, "date time: name:t:value:err/n/t"
     """
-    try:
-        pid = os.getpid()
-        uid = "mqtt_picosuscriber_"+str(pid)
-        global client
-        client = mqtt.Client(uid, False)
-        client.connect(ip, port)
-    except:
-        print("Broker %s:%s not found" % (ip, port))
-        sys.exit(2)
+    name = topic.split("/")[-1]
+    picodata = []
+    for record in logtail.tail(path, lod.n, "/n/t", lambda record: record.split(": ", 1)[-1].split(" / ")[0] == name):
+        p = record.split(": ", 1)[-1].split(":")
+        try:
+            picodata.append([p[0], float(p[1]), float(p[2]), float(p[3])])
+        except (IndexError, ValueError):
+            continue
+    fill(picodata, path)
+
+
+def history(messages):
+    """
+    Fill the plot with the measurements sent by mqtt_historycache and the live measurements held back meanwhile
+    """
+    global waiting
+    picodata = []
+    for topic, payload in messages:
+        p = latency.split(payload.decode('utf-8', 'replace'))[0].split(":")
+        try:
+            picodata.append([p[0], float(p[1]), float(p[2]), float(p[3])])
+        except (IndexError, ValueError):
+            continue
+    if waiting:
+        picodata += waiting[0]
+    waiting = None
+    fill(picodata, "history cache")
+
+
+def fill(picodata, source):
+    """
+    Add the measurements after the newest shown to the plot in order of time
+    """
+    picodata = historycache.merge(picodata, newest, 1)
+    if len(picodata) > 1:
+        lod.load([mdates.date2num(dt.datetime.fromtimestamp(p[1])) for p in picodata[:-1]], [p[2] for p in picodata[:-1]], [p[3] for p in picodata[:-1]])
+    if picodata:
+        updateplot(picodata[-1])
+    print("%d measurements loaded from %s" % (len(picodata), source))
 
-        
-def on_connect(client, userdata, flags, rc):
+
+def connect(ip, port):
     """
-    Callback for when the client receives a CONNACK response from the server
+    Generate unique client name and connect to mqtt broker
     """
-    print("Connected with result code "+str(rc))
-    # subscribing in on_connect() means that if we lose the connection and reconnect then subscriptions will be renewed.
-    client.subscribe(topic)
-    createplot(topic, npoints) #create empty plot in right dimensions with MQTT topic as name
+    global client
+    client = mqttclient.connect(ip, port, "mqtt_picosuscriber")
 
         
 def on_message(client, userdata, msg):
     """
     Callback for when a PUBLISH message is received from the server
     """
+    global waiting
+    received = time.time()
     t = msg.topic
-    p = msg.payload.decode('utf-8').split(":")
+    payload, stamps = latency.split(msg.payload.decode('utf-8'))
+    p = payload.split(":")
     print(p)
-    updateplot(p)
+    if waiting is not None: # shown after the history, or without it once it is overdue
+        waiting[0].append([p[0], float(p[1]), float(p[2]), float(p[3])])
+        waiting[1] = waiting[1] or received
+        if received - waiting[1] > historycache.TIMEOUT:
+            picodata = waiting[0]
+            waiting = None
+            fill(picodata, "live messages, no response of the history cache")
+    elif float(p[1]) > newest: # not sent again after a reconnect
+        updateplot(p)
+    if stamps:
+        delays.add(stamps, received, time.time())
 
 
 def main(argv):
-    global topic, npoints
+    global topic, npoints, delays, waiting
     brokerIP = "jedibroker.ikp.kfa-juelich.de"#"134.94.220.203"
     brokerPort = 1883
     topic="COSY/RF-Devs/D, Peak To Peak"
     npoints = 101
+    backfill = None
+    cached = False
+    delays = latency.Tracker()
 
     # read CMD-arguments given
     try:         
-        opts, args = getopt.getopt(argv, "hb:t:n:")
+        opts, args = getopt.getopt(argv, "hB:Cb:t:n:")
     except getopt.GetoptError as err:
         print(str(err)+"\n")
         usage()
@@ -130,6 +182,10 @@ def main(argv):
         if opt == "-h":
             usage()
             sys.exit()
+        elif opt == "-B":
+            backfill = arg
+        elif opt == "-C":
+            cached = True
         elif opt == "-b":
             brokerIP= arg.split(":")[0]
             brokerPort = float(arg.split(":")[1])
@@ -139,13 +195,21 @@ def main(argv):
             npoints = int(arg)
 
     connect(brokerIP, brokerPort)
+    liveprofile.install("mqtt_picosubscriber") # SIGUSR1 samples the stacks, SIGUSR2 the allocations
     try:
-        client.on_connect = on_connect
+        createplot(topic, npoints) #create empty plot in right dimensions with MQTT topic as name
+        if backfill:
+            preload(backfill)
+        if cached:
+            historycache.request(client, topic, lod.n, history) # answered in one round trip after connecting
+            waiting = [[], None]
+        client.subscribe(topic) # renewed after every reconnect
         client.on_message = on_message
         # blocking call that processes network traffic, dispatches callbacks and handles reconnecting.    
-        client.loop_forever()
+        client.loop_forever(retry_first_connection = True)
     except (KeyboardInterrupt):
         print("Disconnecting...")        
+        print(delays.report())
         client.disconnect()
 
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import getopt, os, sys, time
+import latency, liveprofile, logwriter, mqttclient, rollup
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -b [Broker IP-address:Port] -d [Directory] -t [Topics]
+
+Roll up the NMR readings and Picoscope measurements into buckets of 1 s, 1 min and 1 h with count, mean, standard
+deviation, min, max and lock states, one file per series and tier in Directory, to be queried with rollup.py.
+
+-h                     Show this help message and exit
+-b [IP:Port]           Specify different broker IP-address and port, default "jedibroker.ikp.kfa-juelich.de:1883"
+-d [Directory]         Directory of the rollups, default "rollup"
+-t [Topics]            Topics, separated by commas, default "COSY/nmr,COSY/RF-Devs/#"
+""" % sys.argv[0])
+
+
+def on_message(client, userdata, msg):
+    """
+    Callback for when a PUBLISH message is received from the server
+    """
+    if msg.retain or "/$" in msg.topic: # counted before a restart already, or pings and metrics
+        return
+    p = latency.split(msg.payload.decode('utf-8', 'replace'))[0].split(":")
+    try:
+        if len(p) == 3: # NMR, t:lock:field
+            t, lock, value = float(p[0]), p[1], float(p[2])
+        elif len(p) == 4: # Picoscope, name:t:value:err
+            t, lock, value = float(p[1]), "", float(p[2])
+        else:
+            return
+    except ValueError:
+        return
+    name = rollup.name(msg.topic)
+    if name not in series:
+        series[name] = rollup.Series(name, directory, logs.write)
+        print(time.strftime("%Y-%m-%d %H:%M:%S") + ": new series %s from %s" % (name, msg.topic))
+    series[name].add(t, value, lock)
+
+
+def main(argv):
+    # Default parameters
+    global series, directory, logs
+    brokerIP = "jedibroker.ikp.kfa-juelich.de"
+    brokerPort = 1883
+    topics = ["COSY/nmr", "COSY/RF-Devs/#"]
+    directory = "rollup"
+    series = {}
+    # Read CMD-arguments given
+    try:
+        opts, args = getopt.getopt(argv, "hb:d:t:")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-b":
+            brokerIP = arg.split(":")[0]
+            brokerPort = int(arg.split(":")[1])
+        elif opt == "-d":
+            directory = arg
+        elif opt == "-t":
+            topics = str(arg).split(",")
+
+    os.makedirs(directory, exist_ok = True)
+    logs = logwriter.LogWriter(header = rollup.header())
+    client = mqttclient.connect(brokerIP, brokerPort, "mqtt_rollup")
+    liveprofile.install("mqtt_rollup") # SIGUSR1 samples the stacks, SIGUSR2 the allocations
+    try:
+        for topic in topics:
+            client.subscribe(topic) # renewed after every reconnect
+        client.on_message = on_message
+        # blocking call that processes network traffic, dispatches callbacks and handles reconnecting.
+        client.loop_forever(retry_first_connection = True)
+    except (KeyboardInterrupt):
+        print("Disconnecting...")
+        client.disconnect()
+        for s in series.values():
+            s.flush() # the open buckets, a restart within them adds a second bucket of the same time
+            print("%s: %d samples, %d late" % (s.name, s.samples, s.late))
+        logs.close()
+        logs.printstats()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
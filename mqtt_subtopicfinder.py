@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
-import getopt, os, sys, time, xdrlib, paho.mqtt.client as mqtt
+import getopt, sys, time, xdrlib
+import mqttclient
 
 
 def usage():
@@ -52,20 +53,8 @@ def connect(ip, port):
     """
     generate unique client name and connect to mqtt broker
     """
-    try:
-        pid = os.getpid()
-        uid = "subtopicfinder_"+str(pid)
-        global client
-        client = mqtt.Client(uid, False)
-        client.connect(ip, port)
-    except:
-        print("Broker %s:%s not found" % (ip, port))
-        sys.exit(2)
-
-        
-def on_connect(client, userdata, rc):
-    print("Connected with result code "+str(rc))
-    client.subscribe(topic+"/#") # suscribe to all topics below specified
+    global client
+    client = mqttclient.connect(ip, port, "subtopicfinder")
 
 
 def on_message_topics(client, userdata, msg):
@@ -119,12 +108,12 @@ def main(argv):
             
     try:
         connect(brokerIP, brokerPort)
-        client.on_connect = on_connect
+        client.subscribe(topic+"/#") # suscribe to all topics below specified, renewed after every reconnect
         if subtopic:
             client.message_callback_add(subtopic, on_message_payload)
         else:
             client.on_message = on_message_topics
-        client.loop_forever()
+        client.loop_forever(retry_first_connection = True)
     except (KeyboardInterrupt):
         print("Disconnecting...")
         client.disconnect()
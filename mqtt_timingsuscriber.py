@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
-import array, getopt, os, sys, time, xdrlib, paho.mqtt.client as mqtt
+import array, getopt, sys, time, xdrlib
+import mqttclient
 
 
 def usage():
@@ -46,20 +47,8 @@ def decode(setup):
     
 def connect(ip, port):
 # generate unique client name and connect to mqtt broker
-    try:
-        pid = os.getpid()
-        uid = "subtopicfinder_"+str(pid)
-        global client
-        client = mqtt.Client(uid, False)
-        client.connect(ip, port)
-    except:
-        print("Broker %s:%s not found" % (ip, port))
-        sys.exit(2)
-
-        
-def on_connect(client, userdata, rc):
-    print("Connected with result code "+str(rc))
-    client.subscribe(topic+"/#") # suscribe to all topics below specified
+    global client
+    client = mqttclient.connect(ip, port, "timingsuscriber")
 
         
 def on_message_payload(client, userdata, msg):
@@ -116,9 +105,9 @@ def main(argv):
 
     try:
         connect(brokerIP, brokerPort)
-        client.on_connect = on_connect
+        client.subscribe(topic+"/#") # suscribe to all topics below specified, renewed after every reconnect
         client.message_callback_add(topic, on_message_payload)
-        client.loop_forever()
+        client.loop_forever(retry_first_connection = True)
     except (KeyboardInterrupt):
         print("Disconnecting...")
         client.disconnect()
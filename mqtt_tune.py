@@ -1,42 +1,35 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-import getopt, os, sys, time
-import visa
-import paho.mqtt.client as mqtt
+import getopt, getpass, sys, time
+import latency, liveprofile, metrics, mqttclient, mqttspool
 
 
 def usage():
     """
     Usage function
     """
-    print("""Usage: %s -g [GPIB] -i [user@host:file] -s [Sleeptime] -t [Topic]
+    print("""Usage: %s -g [GPIB] -i [user@host:file] -M [Interval] -q [Path] -s [Sleeptime] -t [Topic] -T -z [Keyframe interval]
 
 Connect to network analyzer via NI-libraries and transmit measured spectra via MQTT in fixed time intervals.
 
 -h                    Show this help message and exit
 -g [GPIB]             GPIB address, default "TCPIP0::ikp060.ikp.kfa-juelich.de::gpib0,7::INSTR"
 -i [user@host:file]   Input file of sync. osz. spectrum accessable via ssh, e.g. "cosy@snoopy.cc.kfa-juelich.de:/mnt/cc-x/smb/fsv/update", dafault is now input via samba network disk "//134.94.224.106/fsv/update"
+-M [Interval]         Publish histograms of the time spent to acquire, encode and publish on "<Topic>/$metrics/<client>" every Interval s
+-q [Path]             Store spectra in directory while the broker is unreachable and send them afterwards
 -s [Sleeptime]        Poll interval in s, default "30"
 -t [Topic]            Optional MQTT topic, default "COSY/tune"
+-T                    Append acquisition and publish times as "|start:end:publish" for mqtt_latencysuscriber, only if all subscribers strip them
+-z [Interval]         Send compressed differences to a full spectrum sent every z cycles instead of text
 """ % sys.argv[0])
 
 
-def connect(ip, port):
-    """
-    Generate unique client name and connect to mqtt broker
-    """
-    pid = os.getpid()
-    uid = "mqtt_tune_"+str(pid)
-    client = mqtt.Client(uid, False)
-    client.connect(ip, port, 300)
-    return client
-
-        
 def gpib(addr):
     """
     Try to connect to gpib networkanalyzer
     """
     try:
+        import visa # only needed with a network analyzer
         rm = visa.ResourceManager()
         lib = rm.visalib
         # debug
@@ -55,11 +48,12 @@ def gpib(addr):
     
 def gettune(instr):
     """
-    Poll network analyzer for data, add timestamp and give out spectrum as histograms
+    Poll network analyzer for data, add timestamp of the poll and give out spectrum as histograms
     """
+    t = time.time()
     flist = instr.ask('OUTPSWPRM?')[:-1].split(",") # SCPI poll for sweep parameters
     amplist = instr.ask('OUTPDTRC?')[:-1].split(",") # SCPI poll for data trace
-    spectrum = [time.time(), len(flist), float(flist[0]), float(flist[-1])]
+    spectrum = [t, len(flist), float(flist[0]), float(flist[-1])]
     for amp in amplist[::2]: # every 2nd entry, cuts imaginary part (which is not set up anyway)
        spectrum.append(float(amp))
     return spectrum
@@ -69,6 +63,8 @@ def sshtransport(server, user, passwd):
     """
     Try to connect to server via ssh and open transport for file transfer
     """
+    import paramiko # only needed with a file read via ssh
+    from scp import SCPClient
     ssh = paramiko.SSHClient()
     ssh.load_system_host_keys()
     #ssh.load_host_keys(os.path.expanduser("~" + os.sep() + ".ssh" + os.sep() + "known_hosts"))
@@ -87,8 +83,9 @@ def sshtransport(server, user, passwd):
     
 def getfrev(file):
     """
-    Read spectrum from file, add timestamp and return as histogram
+    Read spectrum from file, add timestamp of the read and return as histogram
     """
+    t = time.time()
     f = open(file, 'r')
     spectrum = []
     try:
@@ -109,7 +106,7 @@ def getfrev(file):
             spectrum.append(amp)
     finally:
         f.close()
-    spectrum = [time.time(), n, fstart, fend] + spectrum
+    spectrum = [t, n, fstart, fend] + spectrum
     return spectrum
 
     
@@ -125,9 +122,12 @@ def main(argv):
     topic="COSY/tune"   
     wait = 30
     spectra = [0, 0, 0]
+    spool = ""
+    encoder = None
+    metricsinterv = 0.
     # Read CMD-arguments given
     try:
-        opts, args = getopt.getopt(argv, "hg:i:s:t:")
+        opts, args = getopt.getopt(argv, "hg:i:M:q:s:t:Tz:")
     except getopt.GetoptError as err:
         print(str(err)+"\n")
         usage()
@@ -143,12 +143,27 @@ def main(argv):
             sshuser = adress[0].split("@")[0]
             sshIP = address[0].split("@")[1]
             ifile = address[1]
+        elif opt == "-M":
+            metricsinterv = float(arg)
+        elif opt == "-q":
+            spool = str(arg)
         elif opt == "-s":
             wait = int(arg)
         elif opt == "-t":
             topic = str(arg)
+        elif opt == "-T":
+            latency.enabled = True
+        elif opt == "-z":
+            import spectrumcodec # needs numpy, which the text mode does not
+            encoder = spectrumcodec.Encoder(int(arg))
                 
-    client = connect(brokerIP, brokerPort)
+    client = mqttclient.connect(brokerIP, brokerPort, "mqtt_tune")
+    liveprofile.install("mqtt_tune") # SIGUSR1 samples the stacks, SIGUSR2 the allocations
+    if spool:
+        client.spool = mqttspool.Spool(spool)
+        client.spool.start(client, 1.) # spectra are large, one per second leaves the line to live data
+    client.loop_start() # network traffic and reconnects are handled in the background
+    timing = metrics.Metrics(client, topic, metricsinterv) if metricsinterv else metrics.OFF
     lib, nwa = gpib(gpibAddress)
     if sshIP and sshuser:
         ssh, scp = sshtransport(sshIP, sshUser, sshPWD)
@@ -160,7 +175,8 @@ def main(argv):
             sys.exit(2)
 
     try:
-        while client.loop() == 0:
+        while True:
+            start = time.time()
             try:
                 spectra[0] = getfrev(ifile)#ifile.split("/")[-1])#ifile
                 # debug
@@ -177,8 +193,20 @@ def main(argv):
             # debug
             #print(spectra[2])
             lib.gpib_control_ren(nwa.session, 6) # Raw command to switch network analyzer back to local
+            end = time.time()
+            timing.add("acquire", end - start)
 
-            client.publish(topic, "frev:"+":".join(map(str,spectra[0]))+":channel1:"+":".join(map(str,spectra[1]))+":channel2:"+":".join(map(str,spectra[2])), retain = True)
+            with timing.time("encode"):
+                if encoder:
+                    payload, iskey = encoder.encode(spectra)
+                else:
+                    payload, iskey = "frev:"+":".join(map(str,spectra[0]))+":channel1:"+":".join(map(str,spectra[1]))+":channel2:"+":".join(map(str,spectra[2])), False
+                payload = latency.stamp(payload, start, end)
+            with timing.time("publish"):
+                client.publish(topic, payload, retain = True)
+                if iskey:
+                    client.publish(topic + spectrumcodec.KEYTOPIC, payload, retain = True)
+            timing.publish()
             print(time.strftime("%Y-%m-%d %H:%M:%S")+": "+"Beam spectra sent")
             # debug
             #print("frev:"+":".join(map(str,spectra[0]))+"\nchannel1:"+":".join(map(str,spectra[1]))+"\nchannel2:"+":".join(map(str,spectra[2])))
@@ -186,7 +214,11 @@ def main(argv):
     # Quit publisher upon keyboard interrupt
     except (KeyboardInterrupt):
         print("Disconnecting...")
+        client.printstats()
         client.disconnect()
+        client.loop_stop()
+        if client.spool:
+            client.spool.close()
         if sshIP and sshuser:
             ssh.close()
             
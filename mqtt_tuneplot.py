@@ -8,27 +8,28 @@ Changelog:  2015-06-06: improved exception handling in case of non-converging fi
             2015-10-30: added possibility to read out additional spectrum via ssh from the scope program on paxls1.kfa-juelich.de.cc (via snoopy in the same cc subnet)
             2015-11-06: Defined connected network shares on 134.94.224.106 as default save options
 """
-import getpass, getopt, math, os, sys, time
+import getpass, getopt, io, math, os, sys, time
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
-import visa
-import paramiko
-from scp import SCPClient
+import logwriter, peakfinder, tunefit, tunehistory, waterfall
 
 
 def usage():
     """
     Usage function
     """
-    print("""Usage: %s -g [GPIB] -i [user@host:file] -l  -o [oPath] -s [Sleeptime]-F [frev harmonic] -H [Tune harmonic]
+    print("""Usage: %s -a [Window] -e -g [GPIB] -i [user@host:file] -l -m [N] -o [oPath] -s [Sleeptime]-w [N] -F [frev harmonic] -H [Tune harmonic]
 
 -h    Show this help message and exit
+-a [Window]            Keep rolling statistics of f_rev and tunes over the last fits and warn about drifts
+-e                     Fast mode, use closed-form peak estimates instead of fits
 -g [GPIB]              GPIB address of NWA with tune spectra, default "TCPIP0::ikp060.ikp.kfa-juelich.de::gpib0,7::INSTR"
 -i [user@host:file]    Input file of sync. osz. spectrum accessable via ssh, e.g. "cosy@snoopy.cc.kfa-juelich.de:/mnt/cc-x/smb/fsv/update", dafault is input via smb from "//134.94.224.106/fsv/update"
 -l                     Enable logging of spectra to file and saving of screenshots
+-m [N]                 Fit the mean of the last N spectra, or for 0 < N < 1 their exponentially weighted mean with weight N of the latest
 -o [oPath]             Optional logfile path, default is "//134.94.224.106/spectra/"
 -s [Sleeptime]         Poll interval in s, should match COSY cycle length, default "30."
+-w [N]                 Show the last N spectra and fitted peaks as waterfall in a second window
 -F [frev Harmonic]     Harmonic F of the revolution frequency the Spectrum Analyzer set up for, as in df= F*frev, default "1"
 -H [Tune harmonic]     Harmonic H of the revolution frequency the NWA is set up for, as in f=(H+q)*frev, default "1"
 """ % sys.argv[0])
@@ -39,6 +40,7 @@ def gpib(addr):
     Try to connect to gpib networkanalyzer
     """
     try:
+        import visa # only needed with a network analyzer
         rm = visa.ResourceManager()
         lib = rm.visalib
         # debug
@@ -71,6 +73,8 @@ def sshtransport(server, user, passwd):
     """
     Try to connect to server via ssh and open transport for file transfer
     """
+    import paramiko # only needed with a file read via ssh
+    from scp import SCPClient
     ssh = paramiko.SSHClient()
     ssh.load_system_host_keys()
     #ssh.load_host_keys(os.path.expanduser("~" + os.sep() + ".ssh" + os.sep() + "known_hosts"))
@@ -137,20 +141,18 @@ def lorentz_offset(x, amp, xpeak, fwhm, offset):
     return amp / (1 + ((x - xpeak) / fwhm)**2) + offset
     
     
-def peakfit(xdata, ydata):
+def peakfit(xdata, ydata, fast = False):
     """
-    A simple peakfinder
+    A simple peakfinder, seeded by the closed-form estimate, which is returned without errors in fast mode,
+    fits only the region around the peak unless that fit fails
     """
-    ymax = max(ydata)
-    ymin = min(ydata)
-    imax = ydata.index(ymax)
-    xmax = xdata[imax]
-    startvalues = (math.fabs(ymax - ymin), xmax, 1., ymin)
+    startvalues = peakfinder.estimate(xdata, ydata)
+    if fast:
+        return np.array(startvalues), np.zeros(4), np.zeros((4, 4))
     # see http://docs.scipy.org/doc/scipy-0.15.1/reference/generated/scipy.optimize.curve_fit.html#
-    fitpar, fitcovar = curve_fit(lorentz_offset, xdata, ydata, startvalues)
+    fitpar, fitparerr, fitcovar = peakfinder.fit(xdata, ydata, startvalues) # FitTimeout with the best parameters so far at the deadline
     #fitpar, fitcovar = curve_fit(lorentz, xdata, ydata, startvalues)
     #fitpar, fitcovar = curve_fit(lorentz_offset, xdata, ydata, (fitpar[0], fitpar[1], fitpar[2], ymin))
-    fitparerr = np.sqrt(np.diag(fitcovar))
     #chisq = 0.
     #for x, y in zip(xdata, ydata):
     #    chisq += (lorentz_offset(x, fitpar[0], fitpar[1], fitpar[2], fitpar[3]) - y)**2
@@ -163,7 +165,7 @@ def createplot(ntraces, npoints, f0, fmax):
     """
     Create empty plot with all the traces used later on#
     """
-    global direction, f, axarr, x, y, l, lfit
+    global direction, f, axarr, x, y, l, lfit, lavg, waterfalls
     direction = ["synch. osz.", r"$q_x$", r"$q_y$"]
     color = ['g', 'r', 'b']
     f, axarr = plt.subplots(3, 1)
@@ -178,16 +180,26 @@ def createplot(ntraces, npoints, f0, fmax):
     y = [[[0] * 2*npoints], [[0] * npoints], [[0] * npoints]] # Fill y-data for both plots with zeros
     l = [[0] * (ntraces + 1), [0] * (ntraces + 1), [0] * (ntraces + 1)]
     lfit = [[0], [0], [0]]
+    lavg = [[0], [0], [0]]
     for j, ax in enumerate(axarr):
         for i in range(ntraces):
             y[j].append([0] * len(x[j]))#npoints)
             l[j][i], = ax.plot(x[j], y[j][i], c = str( 0.1 + 0.1 * float(i)), ls = '-') # Empty history spectra
         l[j][ntraces], = ax.plot(x[j], [0] * len(x[j]), '%s-' %color[j], lw = 2, label = "current %s tune" % direction[j]) # Empty current sprectrum
         lfit[j], = ax.plot(x[j], [0] * len(x[j]), 'k--', lw = 2, label = "Lorentzian") # Empty fit function
+        if averages: # Empty averaged spectrum
+            lavg[j], = ax.plot(x[j], [0] * len(x[j]), '%s:' %color[j], lw = 2, label = "averaged %s tune" % direction[j])
         ax.legend(fancybox=True, framealpha=0.5)
         ax.set_ylabel("Amp. %s" % direction[j])
         ax.ticklabel_format(style='sci', axis='x', scilimits=(-3, 3))
         ax.ticklabel_format(style='sci', axis='y', scilimits=(-3, 3))
+    waterfalls = None
+    if rows: # Waterfall of the spectrum history in a second window
+        fw, axw = plt.subplots(3, 1)
+        fw.suptitle("Beam Spectra History")
+        waterfalls = [waterfall.Waterfall(axw[j], rows) for j in range(3)]
+        axw[-1].set_xlabel("f / Hz")
+        plt.figure(f.number) # the spectra stay the current figure
     plt.show()
     #plt.tight_layout()
     return
@@ -208,6 +220,11 @@ def updateplot(spectrumlist, intervall):
         fmax = spectrumlist[j][3]
         data = spectrumlist[j][4:]
         x[j] = [fmin + n * (fmax - fmin) / (npoints-1) for n in range(npoints)]
+        y[j].append(data) # Append latest measurement
+        del y[j][0] # Delete oldest measurement
+        if averages: # fit the averaged spectrum instead
+            data = averages[j].add(data, fmin, fmax).tolist()
+            lavg[j].set_data(x[j], data)
         ymax = max(data)
         imax = data.index(ymax)
         xmax = x[j][imax]
@@ -215,8 +232,12 @@ def updateplot(spectrumlist, intervall):
         imin = data.index(ymin)
         xmin = x[j][imin]
         # Peakfit
+        timedout = False
         try:
-            pars, parerrs, covariance = peakfit(x[j], data)#, redchisq
+            try:
+                pars, parerrs, covariance = peakfit(x[j], data, fast)#, redchisq
+            except peakfinder.FitTimeout as err:
+                pars, parerrs, timedout = err.pars, np.zeros(4), True
             if pars[1] < x[j][0] or pars[1] > x[j][-1]:
                 raise UserWarning
             if j == 0:
@@ -233,22 +254,28 @@ def updateplot(spectrumlist, intervall):
                 result = (time.strftime("%Y-%m-%d %H:%M:%S") + r": %s spectrum" % direction[j], r"$f_{max} \pm FWHM/2 = (%.0f \pm %.0f) Hz \Rightarrow q = %.4f \pm %.4f$" % (pars[1], pars[2], peaks[j], fwhms[j]))
             print(time.strftime("%Y-%m-%d %H:%M:%S") + r": %s f_max = (%.2f +- %.2f) Hz, FWHM/2 = (%.2f +- %.2f) Hz" % (direction[j], pars[1], parerrs[1], pars[2], parerrs[2]))
             conv = 1
+            if timedout: # best-effort result, shown but flagged as not converged
+                print(time.strftime("%Y-%m-%d %H:%M:%S") + ": fit to %s stopped at its deadline" % direction[j])
+                result = (result[0], "Stopped at deadline, " + result[1])
+                conv = 0
         # Catch faulty/ non-converged fits
         except (RuntimeError, UserWarning):
+            xmax = peakfinder.estimate(x[j], data)[1]
             print(time.strftime("%Y-%m-%d %H:%M:%S") + ": fit to %s did not converge, max. amp at %.3f kHz" % (direction[j], xmax/1000.))
             if j == 0:
                 peaks[0] = xmax / revh / 1000.
                 peakerrs[0] = 0.01
             result = (time.strftime("%Y-%m-%d %H:%M:%S") + r": %s spectrum" % direction[j], "Fit did not converge, max. amp. at $%.3f kHz$" % (xmax/1000.))
             conv = 0
+            timedout = False # best parameters so far outside the spectrum
+        if waterfalls:
+            waterfalls[j].add(y[j][-1], fmin, fmax, pars[1] if conv == 1 or timedout else np.nan)
         # Plot
-        y[j].append(data) # Append latest measurement
-        del y[j][0] # Delete oldest measurement
         for i, line in enumerate(l[j]): # Update plot data
             if len(y[j][i]) != len(x[j]):
                 y[j][i] = [0] * len(x[j])
             line.set_data(x[j], y[j][i])
-        if conv == 1:
+        if conv == 1 or timedout:
             lfit[j].set_data(x[j], [lorentz_offset(xdata, pars[0], pars[1], pars[2], pars[3]) for xdata in x[j]])
         elif conv == 0:
             #lfit[j].set_data(x[j], [lorentz_offset(xdata, math.fabs(ymax-ymin), xmax, 5000., ymin) for xdata in x[j]])
@@ -269,16 +296,20 @@ def main(argv):
     ifile = "z:" + os.sep + "update" #"/mnt/cc-x/smb/fsv/update"
     opath = "y:" + os.sep + "spectra" + os.sep
     gpibAddress = 'TCPIP0::ikp060.ikp.kfa-juelich.de::gpib0,7::INSTR'
-    global revh, tuneh, intervall
+    global revh, tuneh, fast, intervall, averages, rows
     tuneh = 1
     revh = 1
+    fast = False
+    averages = None
+    rows = 0
     wait = 10.
     history = 7
+    tunes = None
     spectra = [0, 0, 0]
     l = 1
     # Read CMD-arguments given
     try:
-        opts, args = getopt.getopt(argv, "hg:i:ls:F:H:")
+        opts, args = getopt.getopt(argv, "ha:eg:i:lm:s:w:F:H:")
     except getopt.GetoptError as err:
         print(str(err)+"\n")
         usage()
@@ -287,6 +318,10 @@ def main(argv):
         if opt == "-h":
             usage()
             sys.exit()
+        elif opt == "-a":
+            tunes = tunehistory.TuneHistory(int(arg))
+        elif opt == "-e":
+            fast = True
         elif opt == "-g":
             gpibAddress = arg
         elif opt == "-i":
@@ -296,10 +331,14 @@ def main(argv):
             ifile = address[1]
         elif opt == "-l":
             l = 1
+        elif opt == "-m":
+            averages = [tunefit.Average(float(arg)) for j in range(3)]
         elif opt == "-o":
             ofile = arg
         elif opt == "-s":
             wait = float(arg)
+        elif opt == "-w":
+            rows = int(arg)
         elif opt == "-H":
             tuneh = float(arg)          
         elif opt == "-F":
@@ -338,6 +377,7 @@ def main(argv):
     fmax = [spectra[0][3], 0., 0.]
     data = [spectra[0][4:], 0., 0.]
     createplot(history, n[0], fmin[0], fmax[0])
+    logs = logwriter.LogWriter(maxqueue = 20) if l else None # PDFs and spectra of the last cycles while the share is away
     try:
         while True:
             try:
@@ -365,22 +405,26 @@ def main(argv):
             #print(spectra[2])
             lib.gpib_control_ren(nwa.session, 6) # Raw command to switch back to local                  
             tune, width = updateplot(spectra, wait)
+            print("fit latency p50 = %.1f ms, p99 = %.1f ms, max = %.1f ms" % tuple(1000. * t for t in peakfinder.latency()))
+            if tunes:
+                drifting = tunes.add(tune)
+                print(time.strftime("%Y-%m-%d %H:%M:%S") + ": " + tunes.payload())
+                if drifting:
+                    print(time.strftime("%Y-%m-%d %H:%M:%S") + ": drift of %s beyond threshold" % ", ".join(drifting))
             #print(time.strftime("%Y-%m-%d %H:%M:%S") + r"frev ")
             if l:
                 t = time.strftime("%Y-%m-%d_%H-%M-%S")
-                try:
-                    plt.savefig(opath + t + "_tunespectra.pdf", dpi = 300, orientation = 'landscape', papertype = 'a4', transparent = True)
-                    logfile = open(opath + t + "_tunespectra.log", 'w')
-                    logfile.write("sync. osz. spectrum: \n" + ":".join(map(str, spectra[0])) + "\n beta_x spectrum: \n" + ":".join(map(str, spectra[1])) + "\n beta_Y spectrum: \n" + ":".join(map(str, spectra[2])))
-                    logfile.close()
-                except FileNotFoundError as err:
-                    print(err)
-                    print("\\134.94.224.106\beamdynamics mounted as network drive Y:\ ?")
-                    continue                   
+                pdf = io.BytesIO() # rendered here, written to the share in the background
+                plt.savefig(pdf, format = 'pdf', dpi = 300, orientation = 'landscape', papertype = 'a4', transparent = True)
+                logs.write(pdf.getvalue(), opath + t + "_tunespectra.pdf")
+                logs.write("sync. osz. spectrum: \n" + ":".join(map(str, spectra[0])) + "\n beta_x spectrum: \n" + ":".join(map(str, spectra[1])) + "\n beta_Y spectrum: \n" + ":".join(map(str, spectra[2])), opath + t + "_tunespectra.log")
             time.sleep(wait)
     # Quit upon keyboard interrupt
     except (KeyboardInterrupt):
         print("Disconnecting...")
+        if logs:
+            logs.close()
+            logs.printstats()
         if sshIP and sshuser:
             ssh.close()
                     
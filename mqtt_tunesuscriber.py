@@ -1,23 +1,33 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
-import getopt, math, os, sys, datetime, time
+import getopt, math, sys, datetime, time
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
-import paho.mqtt.client as mqtt
+import latency, liveprofile, logtail, logwriter, metrics, mqttclient, peakfinder, spectrumcodec, tunefit, tunehistory, waterfall
 
 
 def usage():
     """
     Usage function
     """
-    print("""Usage: %s -f [frev] - H [Harmonic] -l -t [Topic]
+    print("""Usage: %s -a [Window] -B [Logfile] -D [Thresholds] -e -f [frev] - H [Harmonic] -l -m [N] -M [Interval] -r -R [Rotation] -t [Topic] -T [Timeout] -w [N]
 
 -h                   Show this help message and exit
+-a [Window]          Keep rolling statistics of f_rev and tunes over the last fits and publish them on "<Topic>/history"
+-B [Logfile]         Show the last spectra of a logfile written with -l, e.g. "tunes.log", at start
+-D [Thresholds]      With -a, flag a drift of the trend from the rolling mean beyond these thresholds of f_rev / kHz,
+                     q_x and q_y, separated by commas, or one for all, default "0.001,0.001,0.001"
+-e                   Fast mode, use closed-form peak estimates instead of fits
 -f [frev]            Revolution frequency in kHz, default is JEDI setting of "750.603"
 -H [Harmonic]        Harmonic of the revolution frequency the NWA is set up for, as in df=(H+dq)*frev, default "1"
 -l                   Enable logging to file .\\tunes.log
+-m [N]               Fit the mean of the last N spectra, or for 0 < N < 1 their exponentially weighted mean with weight N of the latest
+-M [Interval]        Publish histograms of the time spent to parse, fit, render and log on "<Topic>/$metrics/<client>" every Interval s
+-r                   Use the fit results published by mqtt_fitservice instead of fitting locally
+-T [Timeout]         With -r, fit locally if mqtt_fitservice has not sent results for Timeout s, default "3"
+-R [Rotation]        Start a new logfile at midnight with "daily" or when it reaches Rotation MB
 -t [Topic]           Optional MQTT topic, default "COSY\\tune"
+-w [N]               Show the last N spectra and fitted peaks as waterfall in a second window
 """ % sys.argv[0])
 
 
@@ -28,18 +38,16 @@ def lorentz_offset(x, amp, xpeak, fwhm_half, offset):
     return amp / (1 + ((x - xpeak) / fwhm_half)**2) + offset
 
         
-def peakfit(xdata, ydata):
+def peakfit(xdata, ydata, fast = False):
     """
-    A simple peakfinder
+    A simple peakfinder, seeded by the closed-form estimate, which is returned without errors in fast mode,
+    fits only the region around the peak unless that fit fails
     """
-    ymax = max(ydata)
-    ymin = min(ydata)
-    imax = ydata.index(ymax)
-    xmax = xdata[imax]
-    startvalues = (math.fabs(ymax - ymin), xmax, 1., ymin)
+    startvalues = peakfinder.estimate(xdata, ydata)
+    if fast:
+        return np.array(startvalues), np.zeros(4), np.zeros((4, 4))
     # see http://docs.scipy.org/doc/scipy-0.15.1/reference/generated/scipy.optimize.curve_fit.html#
-    fitpar, fitcovar = curve_fit(lorentz_offset, xdata, ydata, startvalues)
-    fitparerr = np.sqrt(np.diag(fitcovar))
+    fitpar, fitparerr, fitcovar = peakfinder.fit(xdata, ydata, startvalues) # FitTimeout with the best parameters so far at the deadline
     #chisq = 0.
     #for x, y in zip(xdata, ydata):
     #    chisq += (lorentz_offset(x, fitpar[0], fitpar[1], fitpar[2], fitpar[3]) - y)**2
@@ -52,7 +60,7 @@ def createplot(ntraces, npoints, fmin, fmax):
     """
     Create empty plot with all the traces used later on
     """
-    global direction, f, axarr, x, y, l, lfit
+    global direction, f, axarr, x, y, l, lfit, lavg, waterfalls
     direction = ["synch. osz.", r"$q_x$", r"$q_y$"]
     color = ['g', 'r', 'b']
     f, axarr = plt.subplots(3, 1)#, sharex='col') # 2 plots in one
@@ -66,24 +74,34 @@ def createplot(ntraces, npoints, fmin, fmax):
     y = [[[0] * 2*npoints], [[0] * npoints], [[0] * npoints]] # Fill y-data for plots with zeros
     l = [[0] * (ntraces + 1), [0] * (ntraces + 1), [0] * (ntraces + 1)]
     lfit = [[0], [0], [0]]
+    lavg = [[0], [0], [0]]
     for j, ax in enumerate(axarr):
         for i in range(ntraces):
             y[j].append([0] * len(x[j]))
             l[j][i], = ax.plot(x[j], y[j][i], c = str( 0.1 + 0.1 * float(i)), ls = '-') # Append empty history spectra
         l[j][ntraces], = ax.plot(x[j], [0] * len(x[j]), '%s-' %color[j], lw = 2, label = "current %s tune" % direction[j]) # Last trace for empty, current sprectrum
         lfit[j], = ax.plot(x[j], [0] * len(x[j]), 'k--', lw = 2, label = "Lorentzian") # Add empty fit function 
+        if averages: # Empty averaged spectrum
+            lavg[j], = ax.plot(x[j], [0] * len(x[j]), '%s:' %color[j], lw = 2, label = "averaged %s tune" % direction[j])
         ax.legend(fancybox=True, framealpha=0.5)
         ax.set_ylabel("Amplitude %s" % direction[j])
         ax.ticklabel_format(style='sci', axis='x', scilimits=(-3, 3))
         ax.ticklabel_format(style='sci', axis='y', scilimits=(-3, 3))
+    waterfalls = None
+    if rows: # Waterfall of the spectrum history in a second window
+        fw, axw = plt.subplots(3, 1)
+        fw.suptitle("Beam Spectra History")
+        waterfalls = [waterfall.Waterfall(axw[j], rows) for j in range(3)]
+        axw[-1].set_xlabel("f / Hz")
+        plt.figure(f.number) # the spectra stay the current figure
     plt.show()
     #plt.tight_layout()
     return
 
 
-def updateplot(spectrumlist):
+def updateplot(spectrumlist, fits = None):
     """
-    Fill plot with measured data and perform fit
+    Fill plot with measured data and perform fit, unless the fit results of mqtt_fitservice are given
     """
     peaks = [0., 0., 0.]
     peakerrs = [0., 0., 0.]
@@ -96,6 +114,11 @@ def updateplot(spectrumlist):
         fmax = float(spectrumlist[j][3])
         data = [float(x) for x in spectrumlist[j][4:]]
         x[j] = [fmin + n * (fmax - fmin) / (npoints-1) for n in range(npoints)]
+        y[j].append(data) # Append latest measurement
+        del y[j][0] # Delete oldest measurement
+        if averages and not fits: # fit the averaged spectrum instead
+            data = averages[j].add(data, fmin, fmax).tolist()
+            lavg[j].set_data(x[j], data)
         ymax = max(data)
         imax = data.index(ymax)
         xmax = x[j][imax]
@@ -103,8 +126,18 @@ def updateplot(spectrumlist):
         imin = data.index(ymin)
         xmin = x[j][imin]
         # Peakfit
+        timedout = False
         try:
-            pars, parerrs, covariance = peakfit(x[j], data)#, redchisq
+            if fits:
+                pars, parerrs, converged = fits[j]
+                if not converged:
+                    raise UserWarning
+            else:
+                with timing.time("fit"):
+                    try:
+                        pars, parerrs, covariance = peakfit(x[j], data, fast)#, redchisq
+                    except peakfinder.FitTimeout as err:
+                        pars, parerrs, timedout = err.pars, np.zeros(4), True
             if pars[1] < x[j][0] or pars[1] > x[j][-1]:
                 raise UserWarning
             if j == 0:
@@ -121,22 +154,28 @@ def updateplot(spectrumlist):
                 result = (time.strftime("%Y-%m-%d %H:%M:%S") + r": %s spectrum" % direction[j], r"$f_{max} \pm FWHM/2 = (%.0f \pm %.0f) Hz \Rightarrow q = %.4f \pm %.4f$" % (pars[1], pars[2], peaks[j], fwhms[j]))
             print(time.strftime("%Y-%m-%d %H:%M:%S") + r": %s f_max = (%.2f +- %.2f) Hz, FWHM/2 = (%.2f +- %.2f) Hz" % (direction[j], pars[1], parerrs[1], pars[2], parerrs[2]))
             conv = 1
+            if timedout: # best-effort result, shown but flagged as not converged
+                print(time.strftime("%Y-%m-%d %H:%M:%S") + ": fit to %s stopped at its deadline" % direction[j])
+                result = (result[0], "Stopped at deadline, " + result[1])
+                conv = 0
         # Catch faulty/ non-converged fits
         except (RuntimeError, UserWarning):
+            xmax = peakfinder.estimate(x[j], data)[1]
             print(time.strftime("%Y-%m-%d %H:%M:%S") + ": fit to %s did not converge, max. amp at %.3f kHz" % (direction[j], xmax/1000.))
             if j == 0:
                 peaks[0] = xmax / revh / 1000.
                 peakerrs[0] = 0.01
             result = (time.strftime("%Y-%m-%d %H:%M:%S") + r": %s spectrum" % direction[j], "Fit did not converge, max. amp. at $%.3f kHz$" % (xmax/1000.))
             conv = 0
+            timedout = False # best parameters so far outside the spectrum
+        if waterfalls:
+            waterfalls[j].add(y[j][-1], fmin, fmax, pars[1] if conv == 1 or timedout else np.nan)
         # Plot
-        y[j].append(data) # Append latest measurement
-        del y[j][0] # Delete oldest measurement
         for i, line in enumerate(l[j]): # Update plot data
             if len(y[j][i]) != len(x[j]):
                 y[j][i] = [0] * len(x[j])
             line.set_data(x[j], y[j][i])
-        if conv == 1:
+        if conv == 1 or timedout:
             lfit[j].set_data(x[j], [lorentz_offset(xdata, pars[0], pars[1], pars[2], pars[3]) for xdata in x[j]])
         elif conv == 0:
             #lfit[j].set_data(x[j], [lorentz_offset(xdata, math.fabs(ymax-ymin), xmax, 5000., ymin) for xdata in x[j]])
@@ -149,25 +188,33 @@ def updateplot(spectrumlist):
     return peaks, fwhms
 
 
-def connect(ip, port):
+def preload(path):
     """
-    Generate unique client name and connect to mqtt broker
+    Fill history traces and waterfalls with the last spectra of a logfile, only the newest one is fitted
     """
-    pid = os.getpid()
-    uid = "mqtt_tunesuscriber_"+str(pid)
-    global client
-    client = mqtt.Client(uid, False)
-    client.connect(ip, port)
-    
+    records = logtail.tail(path, max(len(y[0]), rows), "\n\n")
+    spectra = [s for s in (spectrumcodec.parse(record)[1] for record in records) if len(s) == 3]
+    for spectrumlist in spectra[:-1]:
+        for j, spectrum in enumerate(spectrumlist):
+            data = spectrum[4:]
+            y[j].append(data)
+            del y[j][0]
+            if averages:
+                averages[j].add(data, spectrum[2], spectrum[3])
+            if waterfalls: # estimates are good enough for the peak line
+                waterfalls[j].add(data, spectrum[2], spectrum[3], peakfinder.estimate(np.linspace(spectrum[2], spectrum[3], len(data)), data)[1])
+    if spectra:
+        updateplot(spectra[-1])
+        plt.pause(0.001)
+    print("%d spectra loaded from %s" % (len(spectra), path))
 
-def on_connect(client, userdata, flags, rc):
+
+def connect(ip, port):
     """
-    Callback for when the client receives a CONNACK response from the server
+    Generate unique client name and connect to mqtt broker
     """
-    print("Connected with result code "+str(rc))
-    # debug
-    #print(topic)
-    client.subscribe(topic)
+    global client
+    client = mqttclient.connect(ip, port, "mqtt_tunesuscriber")
 
 
 def updatetime(t):
@@ -182,14 +229,58 @@ def on_message(client, userdata, msg):
     """
     callback for when a PUBLISH message is received from the server
     """
-    t = msg.topic
-    p = msg.payload.decode('utf-8')
-    plist = p.split(":")
-    frev = plist[1:int(plist[2])+5]
-    del plist[:int(plist[2])+5]
-    channel1 = plist[1:int(plist[2])+5]
-    del plist[:int(plist[2])+5]
-    channel2 = plist[1:]
+    global pending, lastfit, arrival
+    received = time.time()
+    if msg.topic.endswith(tunefit.FITTOPIC): # results of mqtt_fitservice
+        lastfit = tunefit.unpack(msg.payload.decode('utf-8'))
+        if pending and math.fabs(float(pending[0][0][0]) - lastfit[0]) < 1E-3: # same acquisition
+            show(pending[0], pending[1], lastfit[1])
+            pending = None
+        return
+    key = None
+    if not msg.topic.endswith(spectrumcodec.KEYTOPIC):
+        key = tunefit.digest(msg.payload)
+        if cache.get(key):
+            print("Spectra received again, skipped")
+            return
+    with timing.time("parse"):
+        parsed = tunefit.parse(msg, decoder)
+    if not parsed:
+        return
+    arrival = (latency.split(msg.payload)[1], received)
+    t = float(parsed[0][0][0])
+    if key:
+        cache.put(key, t)
+    if msg.retain and lasttime and t <= lasttime: # retained spectra after a reconnect, already shown
+        print("Retained spectra already shown, skipped")
+        return
+    if remote:
+        if lastfit and math.fabs(float(parsed[0][0][0]) - lastfit[0]) < 1E-3:
+            show(parsed[0], parsed[1], lastfit[1])
+        else: # wait for the fit results, newer spectra replace older ones waiting
+            pending = (parsed[0], parsed[1], pending[2] if pending else received)
+            expire(client)
+        return
+    show(parsed[0], parsed[1])
+
+
+def expire(client):
+    """
+    Fit the spectra waiting for the results of mqtt_fitservice locally once they waited longer than the timeout
+    """
+    global pending
+    if pending and time.time() - pending[2] > remotetimeout:
+        print(time.strftime("%Y-%m-%d %H:%M:%S") + ": no fit results from mqtt_fitservice for %.1f s, fitting locally" % (time.time() - pending[2]))
+        spectra, p = pending[:2]
+        pending = None
+        show(spectra, p)
+
+
+def show(spectra, p, fits = None):
+    """
+    Print, log and plot received spectra
+    """
+    frev, channel1, channel2 = spectra
     t = [float(frev[0]), float(channel1[0]), float(channel2[0])]
     strft = [datetime.datetime.fromtimestamp(time).strftime("%Y-%m-%d %H:%M:%S") for time in t]
     n = [int(frev[1]), int(channel1[1]), int(channel2[1])]
@@ -199,8 +290,25 @@ def on_message(client, userdata, msg):
     print("%s: x tunespectrum with %d entries received, fmin = %.0f Hz, fmax = %.0f Hz" % (strft[1], n[1], fmin[1], fmax[1]))
     print("%s: y tunespectrum with %d entries received, fmin = %.0f Hz, fmax = %.0f Hz" % (strft[2], n[2], fmin[2], fmax[2]))
     if logfile:
-        logfile.write(p+"\n\n")
-    updateplot([frev, channel1, channel2])
+        with timing.time("log"):
+            logfile.write(p+"\n\n")
+    peaks, fwhms = updateplot([frev, channel1, channel2], fits)
+    with timing.time("render"): # draw now, the pause below only keeps the window alive
+        f.canvas.draw()
+        if waterfalls:
+            waterfalls[0].ax.figure.canvas.draw()
+    if not fits:
+        print("fit latency p50 = %.1f ms, p99 = %.1f ms, max = %.1f ms" % tuple(1000. * t for t in peakfinder.latency()))
+    if arrival and arrival[0]: # spectra of a publisher that sends its timestamps
+        shown = time.time()
+        delays.add(arrival[0], arrival[1], shown)
+        print("latency: " + latency.describe(arrival[0], arrival[1], shown))
+    timing.publish()
+    if history:
+        drifting = history.add(peaks)
+        client.publish(topic + tunehistory.HISTORYTOPIC, history.payload(t[0]), retain = True)
+        if drifting:
+            print("%s: drift of %s beyond threshold" % (strft[0], ", ".join(drifting)))
     # Apply hack
     if lasttime:
         print("waiting %f s" % (t[0] - lasttime))
@@ -218,15 +326,33 @@ def main(argv):
     brokerPort = 1883
     topic = "COSY/tune"
     logfile = ''
-    global revh, tuneh, lasttime
+    global revh, tuneh, fast, lasttime, decoder, history, remote, remotetimeout, pending, lastfit, cache, averages, rows, arrival, delays, timing
+    backfill = None
+    decoder = spectrumcodec.Decoder()
+    cache = tunefit.FitCache()
+    history = None
+    window = 0
+    thresholds = (0.001, 0.001, 0.001)
+    averages = None
+    rows = 0
+    remote = False
+    remotetimeout = 3.
+    pending = None # spectra waiting for their fit results, their text and the time since waiting
+    lastfit = None
+    arrival = None
+    delays = latency.Tracker()
+    timing = metrics.OFF
+    metricsinterv = 0.
+    rotate = None
     tuneh = 1.
     revh = 1.
+    fast = False
     lasttime = ''
-    history = 7
+    traces = 7
     
     # Read CMD-arguments given
     try:         
-        opts, args = getopt.getopt(argv, "hf:H:lpt:")
+        opts, args = getopt.getopt(argv, "ha:B:D:ef:H:lm:M:rR:t:T:w:")
     except getopt.GetoptError as err:
         print(str(err)+"\n")
         usage()
@@ -235,14 +361,39 @@ def main(argv):
         if opt == "-h":
             usage()
             sys.exit()
+        elif opt == "-a":
+            window = int(arg)
+        elif opt == "-B":
+            backfill = arg
+        elif opt == "-D":
+            thresholds = [float(v) for v in arg.split(",")]
+            thresholds = thresholds * 3 if len(thresholds) == 1 else thresholds
+        elif opt == "-e":
+            fast = True
         elif opt == "-f":
             frev = float(arg)
         elif opt == "-H":
             harm = float(arg)
         elif opt == "-l":
-            logfile = open("tunes.log", 'a')
+            logfile = "tunes.log"
+        elif opt == "-m":
+            averages = [tunefit.Average(float(arg)) for j in range(3)]
+        elif opt == "-M":
+            metricsinterv = float(arg)
+        elif opt == "-r":
+            remote = True
+        elif opt == "-R":
+            rotate = arg
         elif opt == "-t":
             topic = str(arg)
+        elif opt == "-T":
+            remotetimeout = float(arg)
+        elif opt == "-w":
+            rows = int(arg)
+    if window:
+        history = tunehistory.TuneHistory(window, thresholds = thresholds)
+    if logfile:
+        logfile = logwriter.LogWriter(logfile, rotate) # written in the background, not in the MQTT callback
                         
     th = input("Harmonic the Network Analyzer for tune measurements is set to, ENTER for H = 1 as in fq=(H+q)*frev: ")
     if th:
@@ -251,17 +402,30 @@ def main(argv):
     if fh:
         revh = int(fh)
         
+    if not fast:
+        peakfinder.preload() # also with -r, for fitting locally when mqtt_fitservice does not answer
     connect(brokerIP, brokerPort)
-    createplot(history, 401, 0.5*750.603, 0.7*750.603)
+    liveprofile.install("mqtt_tunesuscriber") # SIGUSR1 samples the stacks, SIGUSR2 the allocations
+    if metricsinterv:
+        timing = metrics.Metrics(client, topic, metricsinterv)
+    createplot(traces, 401, 0.5*750.603, 0.7*750.603)
+    if backfill:
+        preload(backfill)
     try:
-        client.on_connect = on_connect
+        client.subscribe(topic) # renewed after every reconnect
+        client.subscribe(topic + spectrumcodec.KEYTOPIC) # keyframes in case spectra are delta encoded
+        if remote:
+            client.subscribe(topic + tunefit.FITTOPIC)
+            client.on_tick = expire
         client.on_message = on_message
         # blocking call that processes network traffic, dispatches callbacks and handles reconnecting.
-        client.loop_forever()
+        client.loop_forever(retry_first_connection = True)
     except (KeyboardInterrupt):
         if logfile:
             logfile.close()
+            logfile.printstats()
         print("Disconnecting...")        
+        print(delays.report())
         client.disconnect()
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Shared MQTT client for all publishers and subscribers: runs the network loop with automatic reconnect
+(exponential backoff), renews subscriptions after reconnecting, limits the in-flight window and keeps
+publish latency statistics. With a mqttspool.Spool attached, messages published while the broker is
+unreachable are stored on disk and sent later. They are also sent with at least QoS 1 then, as a QoS 0 message
+written to a connection that died before paho noticed would be lost without a trace: paho resends unacknowledged
+messages after reconnecting and those still unacknowledged on a clean disconnect go to the spool for the next run.
+"""
+import os, threading, time
+import paho.mqtt.client as mqtt
+
+
+class Client(mqtt.Client):
+    """
+    paho client that survives broker restarts, use connect() below to create one
+    """
+    def __init__(self, uid, maxinflight = 20, mindelay = 0.05, maxdelay = 1., history = 1000):
+        mqtt.Client.__init__(self, uid, False)
+        self.uid = uid
+        self.max_inflight_messages_set(maxinflight)
+        self.maxinflight = maxinflight
+        self.reconnect_delay_set(mindelay, maxdelay) # first retry after mindelay, doubled until maxdelay
+        self.on_connect = self._connected
+        self.on_disconnect = self._disconnected
+        self.on_publish = self._published
+        self.broker = ""
+        self.subscriptions = {}
+        self.connected = False
+        self.reconnects = []
+        self.spool = None
+        self.on_tick = None # on_tick(client) is called from the network loop at least once a second
+        self._lock = threading.RLock()
+        self._pending = {} # mid: (publish time, qos, message to spool if never acknowledged or None)
+        self._latencies = [0.] * history
+        self._nlatencies = 0
+        self._lost = 0.
+
+    def _connected(self, client, userdata, flags, rc):
+        """
+        Callback for CONNACK, renews the subscriptions and measures the downtime
+        """
+        if rc != 0:
+            print("Broker %s refused connection: %s" % (self.broker, mqtt.connack_string(rc)))
+            return
+        self.connected = True
+        if self._lost:
+            self.reconnects.append(time.time() - self._lost)
+            print(time.strftime("%Y-%m-%d %H:%M:%S") + ": reconnected to broker %s after %.3f s" % (self.broker, self.reconnects[-1]))
+            self._lost = 0.
+        else:
+            print("Connected to Broker %s" % self.broker)
+        for topic, qos in self.subscriptions.items():
+            mqtt.Client.subscribe(self, topic, qos)
+
+    def _disconnected(self, client, userdata, rc):
+        """
+        Callback for lost connections, the network loop takes care of reconnecting
+        """
+        self.connected = False
+        with self._lock: # QoS 0 messages still queued are gone, paho keeps QoS 1 and 2 for resending
+            for mid in [mid for mid, (start, qos, message) in self._pending.items() if qos == 0]:
+                del self._pending[mid]
+            if rc == 0 and self.spool: # exiting, keep what the broker has not acknowledged for the next run
+                for mid, (start, qos, message) in list(self._pending.items()):
+                    if message is not None:
+                        self.spool.append(*message)
+                        del self._pending[mid]
+        if rc != 0:
+            self._lost = time.time()
+            print(time.strftime("%Y-%m-%d %H:%M:%S") + ": lost connection to broker %s, reconnecting..." % self.broker)
+
+    def _published(self, client, userdata, mid):
+        """
+        Callback for sent (QoS 0) or acknowledged (QoS 1, 2) messages
+        """
+        with self._lock:
+            sent = self._pending.pop(mid, None)
+            if sent is not None:
+                self._latencies[self._nlatencies % len(self._latencies)] = time.time() - sent[0]
+                self._nlatencies += 1
+
+    def loop_misc(self):
+        rc = mqtt.Client.loop_misc(self)
+        if self.on_tick:
+            self.on_tick(self)
+        return rc
+
+    def subscribe(self, topic, qos = 0):
+        """
+        Subscribe and remember the topic so it is renewed after every reconnect
+        """
+        self.subscriptions[topic] = qos
+        if self.connected:
+            return mqtt.Client.subscribe(self, topic, qos)
+        return (mqtt.MQTT_ERR_NO_CONN, None)
+
+    def unsubscribe(self, topic):
+        self.subscriptions.pop(topic, None)
+        return mqtt.Client.unsubscribe(self, topic)
+
+    def publish(self, topic, payload = None, qos = 0, retain = False, spool = True):
+        """
+        Publish and record the time until the message left (QoS 0) or was acknowledged (QoS 1, 2).
+        With a spool, messages that cannot be sent go to the spool and the others are sent with at least QoS 1,
+        so they are kept until the broker acknowledged them
+        """
+        spool = spool and self.spool is not None
+        if spool and not self.connected:
+            self.spool.append(topic, payload, qos, retain)
+            return mqtt.MQTTMessageInfo(0) # rc = MQTT_ERR_SUCCESS, the spool takes care of it
+        with self._lock: # on_publish may fire before the mid is known otherwise
+            start = time.time()
+            info = mqtt.Client.publish(self, topic, payload, max(qos, 1) if spool else qos, retain)
+            if info.rc == mqtt.MQTT_ERR_SUCCESS or (spool and info.rc == mqtt.MQTT_ERR_NO_CONN):
+                # with QoS 1 paho queues the message for resending also without a connection
+                self._pending[info.mid] = (start, max(qos, 1) if spool else qos, (topic, payload, qos, retain) if spool else None)
+        return info
+
+    def inflight(self):
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self):
+        """
+        Publish latency percentiles in s over the last messages and reconnect times
+        """
+        with self._lock:
+            latencies = sorted(self._latencies[:min(self._nlatencies, len(self._latencies))])
+            inflight = len(self._pending)
+        result = {"published": self._nlatencies, "inflight": inflight, "reconnects": len(self.reconnects), "reconnect_max": max(self.reconnects) if self.reconnects else 0.}
+        if self.spool:
+            result["spooled"] = self.spool.drained
+            result["spooldropped"] = self.spool.dropped
+        for p in (50, 90, 99, 100):
+            result["p%d" % p] = latencies[min(len(latencies) - 1, len(latencies) * p // 100)] if latencies else 0.
+        return result
+
+    def printstats(self):
+        s = self.stats()
+        print("%d messages published, %d in flight, latency p50 = %.1f ms, p99 = %.1f ms, max = %.1f ms, %d reconnects (max %.3f s)" % (s["published"], s["inflight"], 1000 * s["p50"], 1000 * s["p99"], 1000 * s["p100"], s["reconnects"], s["reconnect_max"]))
+
+
+def connect(ip, port, name, keepalive = 30, maxinflight = 20, maxdelay = 1.):
+    """
+    Generate unique client name and connect to mqtt broker in the background, the first connection attempt is retried like a reconnect
+    """
+    client = Client(name + "_" + str(os.getpid()), maxinflight, maxdelay = maxdelay)
+    client.broker = "%s:%s" % (ip, str(port))
+    client.connect_async(ip, int(port), keepalive)
+    return client
@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Disk-backed store-and-forward queue for publishers: messages that cannot be sent while the broker is unreachable
+are appended to segment files and drained at a limited rate once the connection is back.
+Payloads carry their own acquisition timestamps, so drained messages keep their original time.
+"""
+import glob, os, struct, threading, time
+import paho.mqtt.client as mqtt
+
+
+HEADER = struct.Struct("<dIHBB") # enqueue time, payload length, topic length, qos, retain
+
+
+class Spool:
+    """
+    Bounded queue of MQTT messages in numbered segment files below path
+    """
+    def __init__(self, path, maxbytes = 100 * 2**20, segmentbytes = 2**20, syncinterv = 1.):
+        self.path = path
+        self.maxbytes = maxbytes
+        self.segmentbytes = segmentbytes
+        self.syncinterv = syncinterv
+        self.dropped = 0 # messages lost because the queue was full
+        self.drained = 0
+        os.makedirs(path, exist_ok = True)
+        self._lock = threading.Lock()
+        self._segments = [int(os.path.basename(s).split(".")[0]) for s in sorted(glob.glob(os.path.join(path, "*.spool")))]
+        self._size = sum(os.path.getsize(self._name(s)) for s in self._segments)
+        self._wfile = None # never append to an old segment, its last record may be torn
+        self._lastsync = time.time()
+        self._rfile = None
+        self._cursor = 0
+        try:
+            with open(os.path.join(path, "cursor"), 'r') as f:
+                seg, offset = map(int, f.read().split(":"))
+            if self._segments and seg == self._segments[0]:
+                self._cursor = offset
+        except (OSError, ValueError):
+            pass
+        if self._segments:
+            print("Spool %s: %d segments (%.1f MB) left from last run" % (path, len(self._segments), self._size / 2**20))
+
+    def _name(self, seg):
+        return os.path.join(self.path, "%012d.spool" % seg)
+
+    def _sync(self):
+        self._wfile.flush()
+        os.fsync(self._wfile.fileno())
+        self._lastsync = time.time()
+
+    def _rotate(self):
+        """
+        Close the current write segment and start a new one
+        """
+        if self._wfile:
+            self._sync()
+            self._wfile.close()
+        seg = self._segments[-1] + 1 if self._segments else 0
+        self._segments.append(seg)
+        self._wfile = open(self._name(seg), 'ab')
+
+    def _count(self, seg, offset):
+        """
+        Number of complete records in a segment from offset on
+        """
+        n = 0
+        with open(self._name(seg), 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return n
+                t, lpayload, ltopic, qos, retain = HEADER.unpack(header)
+                if len(f.read(ltopic + lpayload)) < ltopic + lpayload:
+                    return n
+                n += 1
+
+    def _remove(self, seg):
+        """
+        Delete a segment, the oldest one unless the queue is full
+        """
+        if self._segments[0] == seg: # the cursor belongs to the oldest segment
+            if self._rfile:
+                self._rfile.close()
+                self._rfile = None
+            self._cursor = 0
+        if self._wfile and self._segments[-1] == seg:
+            self._wfile.close()
+            self._wfile = None
+        self._size -= os.path.getsize(self._name(seg))
+        os.remove(self._name(seg))
+        self._segments.remove(seg)
+
+    def append(self, topic, payload, qos = 0, retain = False):
+        """
+        Queue one message, fsync is batched to once per syncinterv
+        """
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elif payload is None:
+            payload = b""
+        btopic = topic.encode('utf-8')
+        record = HEADER.pack(time.time(), len(payload), len(btopic), qos, retain) + btopic + payload
+        with self._lock:
+            if self._wfile is None or self._wfile.tell() + len(record) > self.segmentbytes:
+                self._rotate()
+            self._wfile.write(record)
+            self._size += len(record)
+            while self._size > self.maxbytes and len(self._segments) > 1: # queue full, sacrifice the oldest data
+                seg = self._segments[0]
+                n = self._count(seg, self._cursor)
+                self.dropped += n
+                print("Spool %s full, dropping oldest segment with %d messages" % (self.path, n))
+                self._remove(seg)
+            if time.time() - self._lastsync > self.syncinterv:
+                self._sync()
+
+    def peek(self):
+        """
+        Return the oldest queued message as (topic, payload, qos, retain, enqueue time) or None, without removing it
+        """
+        with self._lock:
+            while self._segments:
+                seg = self._segments[0]
+                if self._wfile and seg == self._segments[-1]:
+                    self._wfile.flush() # make the segment being written readable
+                if self._rfile is None:
+                    self._rfile = open(self._name(seg), 'rb')
+                self._rfile.seek(self._cursor)
+                header = self._rfile.read(HEADER.size)
+                if len(header) == HEADER.size:
+                    t, lpayload, ltopic, qos, retain = HEADER.unpack(header)
+                    body = self._rfile.read(ltopic + lpayload)
+                    if len(body) == ltopic + lpayload:
+                        return (body[:ltopic].decode('utf-8'), body[ltopic:], qos, bool(retain), t)
+                # end of segment (or torn last record), continue with the next one
+                self._remove(seg)
+            return None
+
+    def advance(self):
+        """
+        Remove the message returned by peek() after it has been handed to the broker
+        """
+        with self._lock:
+            if self._rfile:
+                self._cursor = self._rfile.tell()
+                self.drained += 1
+                if self.drained % 100 == 0:
+                    self._savecursor()
+
+    def _savecursor(self):
+        with open(os.path.join(self.path, "cursor"), 'w') as f:
+            f.write("%d:%d" % (self._segments[0], self._cursor))
+
+    def pending(self):
+        with self._lock:
+            return bool(self._segments) and (len(self._segments) > 1 or self._size > self._cursor)
+
+    def close(self):
+        with self._lock:
+            if self._wfile:
+                self._sync()
+                self._wfile.close()
+                self._wfile = None
+            if self._segments:
+                self._savecursor()
+            else:
+                try:
+                    os.remove(os.path.join(self.path, "cursor"))
+                except OSError:
+                    pass
+
+    def start(self, client, rate = 50.):
+        """
+        Drain the queue through a connected mqttclient.Client in a background thread with at most rate messages/s.
+        Backlog messages are only sent while the in-flight window is less than half full so live traffic goes first,
+        and are never retained, they would overwrite newer retained values.
+        """
+        def drain():
+            while True:
+                record = self.peek() if client.connected and client.inflight() < client.maxinflight // 2 else None
+                if record is None:
+                    time.sleep(0.1)
+                    continue
+                topic, payload, qos, retain, t = record
+                rc = client.publish(topic, payload, max(qos, 1), False, spool = False).rc
+                if rc in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN): # paho resends unacknowledged QoS 1 itself
+                    self.advance()
+                time.sleep(1. / rate)
+        thread = threading.Thread(target = drain, name = "spool-drain")
+        thread.daemon = True
+        thread.start()
+        return thread
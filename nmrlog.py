@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+NMR readings as fixed size binary records, float64 time, uint8 lock state (the character "L", "S" or "N") and
+float64 field, little endian and packed to 17 bytes after a 16 byte header "COSYNMR1", header size, record size.
+load() maps the file with np.memmap without parsing anything, between() finds a time range by binary search on the
+timestamps, so a month of 10 Hz readings is sliced in milliseconds. A record cut short at the end, e.g. by a crash
+while writing, is ignored. The main converts text logs "t:lock:field" as written by mqtt_nmrplot -l.
+"""
+import bisect, getopt, os, struct, sys, time
+import numpy as np
+
+
+MAGIC = b"COSYNMR1"
+EXT = ".nmrlog"
+DTYPE = np.dtype([("t", "<f8"), ("lock", "u1"), ("field", "<f8")])
+_HEADER = struct.Struct("<8sII")
+_RECORD = struct.Struct("<dBd")
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -e [End] -o [Output] -s [Start] Logfile ...
+
+Convert text logs of NMR readings to a binary log, or show the readings of a binary log between start and end.
+
+-h            Show this help message and exit
+-e [End]      End of the readings to show, "YYYY-mm-dd HH:MM:SS" or s since the epoch, default the last one
+-o [Output]   Append the readings of the text logs, oldest first, to the binary log Output, e.g. "nmr.nmrlog"
+-s [Start]    Start of the readings to show, default the first one
+""" % sys.argv[0])
+
+
+def header():
+    return _HEADER.pack(MAGIC, _HEADER.size, DTYPE.itemsize)
+
+
+def pack(t, lock, field):
+    """
+    One reading as record
+    """
+    return _RECORD.pack(t, ord(lock[:1] or "\0"), field)
+
+
+def isbinary(path):
+    """
+    Whether path is a binary NMR log and not a text log
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load(path):
+    """
+    Map the readings of a binary log read only as structured array with fields t, lock and field
+    """
+    with open(path, 'rb') as f:
+        magic, size, itemsize = _HEADER.unpack(f.read(_HEADER.size).ljust(_HEADER.size, b"\0"))
+    if magic != MAGIC or itemsize != DTYPE.itemsize:
+        raise ValueError("%s is not a binary NMR log" % path)
+    n = (os.path.getsize(path) - size) // itemsize
+    if n <= 0:
+        return np.zeros(0, DTYPE)
+    return np.memmap(path, DTYPE, 'r', size, (n,))
+
+
+def between(records, start = None, end = None):
+    """
+    Records from start to before end, by binary search as the readings are in order of time
+    """
+    t = records["t"] # a strided view, np.searchsorted would copy it
+    i = 0 if start is None else bisect.bisect_left(t, start)
+    j = len(t) if end is None else bisect.bisect_left(t, end, i)
+    return records[i:j]
+
+
+def readings(records):
+    """
+    List of (t, lock, field) as the displays take them
+    """
+    return [(float(t), chr(lock), float(field)) for t, lock, field in records.tolist()]
+
+
+def convert(ipaths, opath, chunk = 100000):
+    """
+    Append the readings of text logs to a binary log, return the number of readings and of lines skipped
+    """
+    n = 0
+    skipped = 0
+    with open(opath, 'ab') as out:
+        if not out.tell():
+            out.write(header())
+        for ipath in ipaths:
+            with open(ipath, 'r', errors = 'replace') as f:
+                while True:
+                    lines = f.readlines(chunk * 32)
+                    if not lines:
+                        break
+                    records = np.zeros(len(lines), DTYPE)
+                    k = 0
+                    for line in lines:
+                        try:
+                            t, lock, field = line.split(":")
+                            records[k] = (float(t), ord(lock[:1] or "\0"), float(field))
+                            k += 1
+                        except ValueError:
+                            skipped += line.strip() != ""
+                    records[:k].tofile(out)
+                    n += k
+    return n, skipped
+
+
+def parsetime(s):
+    try:
+        return float(s)
+    except ValueError:
+        return time.mktime(time.strptime(s, "%Y-%m-%d %H:%M:%S"))
+
+
+def main(argv):
+    opath = None
+    start = None
+    end = None
+    try:
+        opts, args = getopt.getopt(argv, "he:o:s:")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-e":
+            end = parsetime(arg)
+        elif opt == "-o":
+            opath = arg
+        elif opt == "-s":
+            start = parsetime(arg)
+    if not args:
+        usage()
+        sys.exit(2)
+
+    if opath:
+        t0 = time.perf_counter()
+        n, skipped = convert(args, opath)
+        dt = time.perf_counter() - t0
+        print("%d readings written to %s in %.1f s, %.0f readings/s, %d lines skipped" % (n, opath, dt, n / max(dt, 1E-9), skipped))
+        return
+    for path in args:
+        t0 = time.perf_counter()
+        records = load(path)
+        selected = between(records, start, end)
+        dt = time.perf_counter() - t0
+        print("%s: %d readings, %d selected in %.3f ms" % (path, len(records), len(selected), 1000. * dt))
+        if len(selected):
+            field = selected["field"]
+            print("%s to %s, field mean %.7f T, min %.7f T, max %.7f T, locked %.1f %%" % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(selected["t"][0])), time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(selected["t"][-1])), field.mean(), field.min(), field.max(), 100. * np.mean(selected["lock"] == ord("L"))))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
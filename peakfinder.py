@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Closed-form estimate of a Lorentzian peak on an equidistant frequency grid, used as start values for curve_fit
+and as the result itself in fast mode: three-point interpolation of 1/(y - offset), which is a parabola for a
+Lorentzian, around the maximum and a half maximum search for the width.
+fit() only fits a region of a few FWHM around that estimate, where the peak is, and falls back to the full span.
+Fits are bounded in parameters, iterations and wall-clock time, so one bad spectrum cannot stall a display.
+"""
+import getopt, importlib, math, sys, time
+import numpy as np
+
+
+durations = [0.] * 1000 # ring buffer of the last fit durations / s
+nfits = 0
+
+
+class FitTimeout(RuntimeError):
+    """
+    Fit ran out of its time budget, pars holds the best parameters evaluated so far
+    """
+    def __init__(self, pars):
+        RuntimeError.__init__(self, "fit exceeded its time budget")
+        self.pars = pars
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -i [Logfile]
+
+Compare fit iterations, failed fits and fit time of the old seed (maximum, width 1 Hz), the estimate and the
+region of interest fit on recorded spectra, and the agreement of the region of interest with full span fits.
+
+-h             Show this help message and exit
+-i [Logfile]   Logfile with one text payload per paragraph, default "tunes.log"
+""" % sys.argv[0])
+
+
+def lorentz_offset(x, amp, xpeak, fwhm_half, offset):
+    """
+    Lorentzian with offset as fit function
+    """
+    return amp / (1 + ((x - xpeak) / fwhm_half)**2) + offset
+
+
+def estimate(xdata, ydata):
+    """
+    Return (amp, xpeak, fwhm_half, offset) of the highest peak, as arrays if ydata holds one spectrum per row
+    """
+    x = np.asarray(xdata, dtype = float)
+    y = np.atleast_2d(np.asarray(ydata, dtype = float))
+    n = y.shape[-1]
+    dx = (x[-1] - x[0]) / (n - 1)
+    rows = np.arange(y.shape[0])
+    offset = np.median(y, axis = -1) # the noise floor covers most of the span
+    imax = np.argmax(y, axis = -1)
+    i = np.clip(imax, 1, n - 2)
+    y0, y1, y2 = y[rows, i - 1], y[rows, i], y[rows, i + 1]
+    # Lorentzian: 1/(y - offset) = (1 + ((x - xpeak)/w)^2) / amp is a parabola through the three points
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        u0, u1, u2 = 1. / (y0 - offset), 1. / (y1 - offset), 1. / (y2 - offset)
+        c = u0 - 2. * u1 + u2
+        d = (u0 - u2) / (2. * c)
+        vertex = u1 - c * d**2 / 2.
+        lorentz = (y0 > offset) & (y1 > offset) & (y2 > offset) & (c > 0) & (np.abs(d) <= 1.) & (vertex > 0)
+        # plain parabola through the points otherwise
+        cp = y0 - 2. * y1 + y2
+        dp = np.where(cp < 0, (y0 - y2) / (2. * cp), 0.)
+        d = np.where(lorentz, d, dp)
+        amp = np.where(lorentz, 1. / vertex, y1 - cp * dp**2 / 2. - offset)
+    amp = np.where(amp > 0, amp, y[rows, imax] - offset)
+    xpeak = x[0] + (i + d) * dx
+    # half maximum crossings left and right of the maximum, linearly interpolated
+    level = (offset + amp / 2.)[:, None]
+    idx = np.arange(n)
+    below = y < level
+    left = np.where(below & (idx < imax[:, None]), idx, -1).max(axis = -1)
+    right = np.where(below & (idx > imax[:, None]), idx, n).min(axis = -1)
+    l = np.clip(left, 0, n - 2)
+    r = np.clip(right, 1, n - 1)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        xl = np.where(left >= 0, l + (level[:, 0] - y[rows, l]) / (y[rows, l + 1] - y[rows, l]), 0.)
+        xr = np.where(right < n, r - (level[:, 0] - y[rows, r]) / (y[rows, r - 1] - y[rows, r]), n - 1.)
+    width = np.maximum(np.nan_to_num((xr - xl) / 2., nan = 0.5), 0.5) * math.fabs(dx)
+    if np.ndim(ydata) == 1:
+        return float(amp[0]), float(xpeak[0]), float(width[0]), float(offset[0])
+    return amp, xpeak, width, offset
+
+
+def preload():
+    """
+    Import scipy.optimize now, e.g. at startup, instead of within the time budget of the first fit
+    """
+    importlib.import_module("scipy.optimize")
+
+
+def _boundedfit(x, y, startvalues, deadline, maxfev, best):
+    """
+    curve_fit with xpeak inside the data, positive width and positive amplitude, aborted at the deadline.
+    The unbounded Levenberg-Marquardt fit is several times faster than the bounded trust region fit,
+    so the latter only runs if the former leaves the box.
+    """
+    from scipy.optimize import curve_fit
+    dx = math.fabs(x[1] - x[0])
+    lower = [0., x[0], dx / 100., -np.inf]
+    upper = [np.inf, x[-1], math.fabs(x[-1] - x[0]), np.inf]
+    start = [min(max(s, lo), hi) for s, lo, hi in zip(startvalues, lower, upper)]
+    def model(xdata, *pars):
+        if time.perf_counter() > deadline:
+            raise FitTimeout(best[1])
+        yfit = lorentz_offset(xdata, *pars)
+        chisq = np.sum((yfit - y)**2)
+        if chisq < best[0]:
+            best[0], best[1] = chisq, np.array(pars)
+        return yfit
+    # see http://docs.scipy.org/doc/scipy-0.15.1/reference/generated/scipy.optimize.curve_fit.html
+    try:
+        fitpar, fitcovar = curve_fit(model, x, y, start, maxfev = maxfev)
+        fitpar[2] = math.fabs(fitpar[2]) # the Lorentzian is even in the width
+        if all(lo <= p <= hi for p, lo, hi in zip(fitpar, lower, upper)):
+            return fitpar, fitcovar
+    except RuntimeError as err:
+        if isinstance(err, FitTimeout):
+            raise
+    return curve_fit(model, x, y, start, bounds = (lower, upper), max_nfev = maxfev)
+
+
+def fit(xdata, ydata, startvalues = None, window = 3., minpoints = 15, budget = 0.1, maxfev = 200):
+    """
+    Fit Lorentzian with offset to xpeak +- window * FWHM, or to the full span if that fit fails its checks,
+    returns fit parameters, their errors and the covariance matrix like curve_fit, raises RuntimeError if both fail
+    and FitTimeout with the best parameters so far once budget seconds are used up
+    """
+    global nfits
+    preload() # the first import takes longer than the whole budget
+    x = np.asarray(xdata, dtype = float)
+    y = np.asarray(ydata, dtype = float)
+    if startvalues is None:
+        startvalues = estimate(x, y)
+    start = time.perf_counter()
+    deadline = start + budget
+    amp, xpeak, width, offset = startvalues
+    best = [np.inf, np.array(startvalues, dtype = float)]
+    dx = math.fabs(x[1] - x[0])
+    half = max(window * 2. * width, minpoints / 2. * dx)
+    lo = max(int(np.searchsorted(x, xpeak - half)), 0)
+    hi = min(int(np.searchsorted(x, xpeak + half)) + 1, len(x))
+    try:
+        if window and hi - lo < len(x):
+            try:
+                fitpar, fitcovar = _boundedfit(x[lo:hi], y[lo:hi], startvalues, deadline, maxfev, [np.inf, best[1]])
+                fitparerr = np.sqrt(np.diag(fitcovar))
+                # the peak has to be inside and narrower than the window, otherwise the offset is not constrained
+                if x[lo] < fitpar[1] < x[hi - 1] and fitpar[2] < half and np.all(np.isfinite(fitparerr)):
+                    return fitpar, fitparerr, fitcovar
+            except FitTimeout:
+                raise
+            except (RuntimeError, ValueError):
+                pass
+        try:
+            fitpar, fitcovar = _boundedfit(x, y, startvalues, deadline, maxfev, best)
+        except ValueError as err: # e.g. infinite covariance
+            raise RuntimeError(str(err))
+        return fitpar, np.sqrt(np.diag(fitcovar)), fitcovar
+    finally:
+        durations[nfits % len(durations)] = time.perf_counter() - start
+        nfits += 1
+
+
+def latency():
+    """
+    Percentiles 50, 99, 100 of the last fit durations / s
+    """
+    last = sorted(durations[:min(nfits, len(durations))])
+    if not last:
+        return 0., 0., 0.
+    return last[len(last) // 2], last[min(len(last) - 1, len(last) * 99 // 100)], last[-1]
+
+
+def main(argv):
+    from scipy.optimize import curve_fit
+    import spectrumcodec
+    ifile = "tunes.log"
+    try:
+        opts, args = getopt.getopt(argv, "hi:")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-i":
+            ifile = arg
+
+    with open(ifile, 'r') as f:
+        payloads = [p for p in f.read().split("\n\n") if p.strip()]
+    results = {"old seed": [0, 0, 0.], "estimate": [0, 0, 0.]}
+    nspectra = 0
+    testimate = 0.
+    roi = [0, 0., 0.] # failed fits, time, max. deviation from the full span fit in errors
+    for p in payloads:
+        for spectrum in spectrumcodec.parse(p)[1]:
+            npoints, fmin, fmax = int(spectrum[1]), spectrum[2], spectrum[3]
+            ydata = spectrum[4:]
+            xdata = [fmin + n * (fmax - fmin) / (npoints - 1) for n in range(npoints)]
+            ymax, ymin = max(ydata), min(ydata)
+            t = time.perf_counter()
+            seed = estimate(xdata, ydata)
+            testimate += time.perf_counter() - t
+            nspectra += 1
+            full = None
+            for name, start in (("old seed", (math.fabs(ymax - ymin), xdata[ydata.index(ymax)], 1., ymin)), ("estimate", seed)):
+                t = time.perf_counter()
+                try:
+                    pars, covar, info, msg, ier = curve_fit(lorentz_offset, xdata, ydata, start, full_output = True)
+                    if pars[1] < xdata[0] or pars[1] > xdata[-1]:
+                        raise UserWarning
+                    results[name][0] += info["nfev"]
+                    full = (pars, np.sqrt(np.diag(covar)))
+                except (RuntimeError, UserWarning):
+                    results[name][1] += 1
+                results[name][2] += time.perf_counter() - t
+            t = time.perf_counter()
+            try:
+                pars, parerrs, covar = fit(xdata, ydata, seed)
+                roi[1] += time.perf_counter() - t
+                if full:
+                    roi[2] = max(roi[2], math.fabs(pars[1] - full[0][1]) / max(full[1][1], 1E-12))
+            except RuntimeError:
+                roi[0] += 1
+                roi[1] += time.perf_counter() - t
+    p50, p99, pmax = latency()
+    print("%d spectra, estimate takes %.0f us" % (nspectra, 1E6 * testimate / max(nspectra, 1)))
+    for name, (nfev, failed, duration) in results.items():
+        print("%-8s: %d failed fits, %.0f function calls and %.1f ms per converged fit" % (name, failed, nfev / max(nspectra - failed, 1), 1000. * duration / max(nspectra, 1)))
+    print("%-8s: %d failed fits, %.1f ms per fit, peak positions within %.2f errors of the full span fits" % ("roi", roi[0], 1000. * roi[1] / max(nspectra, 1), roi[2]))
+    print("fit latency with deadline: p50 = %.1f ms, p99 = %.1f ms, max = %.1f ms" % (1000. * p50, 1000. * p99, 1000. * pmax))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
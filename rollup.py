@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Rollups of time series in buckets of 1 s, 1 min and 1 h: count, mean, standard deviation, min, max and the number
+of samples per NMR lock state. A sample goes into the open 1 s bucket in O(1), a closed bucket is written and merged
+into the open bucket of the next tier. Every tier of a series is a file of fixed size records like the binary NMR
+log, "<series>_<tier>.rollup" with a 16 byte header "COSYRLP1", header size, record size. A query picks the finest
+tier with no more than maxbuckets buckets in the range, so questions about weeks only read the hourly file.
+The buckets still open are not in the files.
+"""
+import bisect, getopt, os, re, struct, sys, time
+import numpy as np
+import nmrlog
+
+
+MAGIC = b"COSYRLP1"
+TIERS = ((1., "1s"), (60., "1min"), (3600., "1h"))
+LOCKS = "LSN" # locked, searching, no lock
+DTYPE = np.dtype([("t", "<f8"), ("n", "<u4"), ("mean", "<f8"), ("std", "<f8"), ("min", "<f8"), ("max", "<f8"), ("locks", "<u4", (len(LOCKS),))])
+_HEADER = struct.Struct("<8sII")
+_RECORD = struct.Struct("<dIddddIII")
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -d [Directory] -e [End] -n [Buckets] -s [Start] -v Series ...
+
+Statistics of series rolled up by mqtt_rollup between start and end, from the coarsest tier needed.
+
+-h               Show this help message and exit
+-d [Directory]   Directory of the rollups, default "rollup"
+-e [End]         End, "YYYY-mm-dd HH:MM:SS" or s since the epoch, default now
+-n [Buckets]     Use the finest tier with at most this many buckets in the range, default "2000"
+-s [Start]       Start, default one day before the end
+-v               Print the buckets as well
+Series           Names of the series, e.g. "nmr", default all in the directory
+""" % sys.argv[0])
+
+
+def header():
+    return _HEADER.pack(MAGIC, _HEADER.size, DTYPE.itemsize)
+
+
+def name(topic):
+    """
+    Name of the series of a topic, usable as file name
+    """
+    return re.sub(r"[^\w.-]+", "_", topic.split("/", 1)[-1]).strip("_")
+
+
+def path(directory, series, tier):
+    return os.path.join(directory, "%s_%s.rollup" % (series, TIERS[tier][1]))
+
+
+class Series:
+    """
+    Open buckets of all tiers of one series, closed ones are passed to write(record, path)
+    """
+    def __init__(self, name, directory, write):
+        self.name = name
+        self.directory = directory
+        self.write = write
+        self.buckets = [self._empty() for tier in TIERS] # start, n, mean, sum of squared deviations, min, max, locks
+        self.current = float("-inf") # start of the newest 1 s bucket
+        self.samples = 0
+        self.late = 0
+
+    @staticmethod
+    def _empty():
+        return [0., 0, 0., 0., float("inf"), float("-inf"), [0] * len(LOCKS)]
+
+    def add(self, t, value, lock = ""):
+        """
+        Add a sample, samples before the open 1 s bucket are counted as late and dropped
+        """
+        start = t - t % TIERS[0][0]
+        if start < self.current:
+            self.late += 1
+            return
+        if start != self.current and self.buckets[0][1]:
+            self._close(0)
+        self.current = start
+        b = self.buckets[0]
+        b[0] = start
+        b[1] += 1
+        d = value - b[2]
+        b[2] += d / b[1]
+        b[3] += d * (value - b[2])
+        b[4] = min(b[4], value)
+        b[5] = max(b[5], value)
+        if lock and lock in LOCKS:
+            b[6][LOCKS.index(lock)] += 1
+        self.samples += 1
+
+    def _close(self, tier):
+        b = self.buckets[tier]
+        self.write(_RECORD.pack(b[0], b[1], b[2], (b[3] / b[1]) ** .5, b[4], b[5], *b[6]), path(self.directory, self.name, tier))
+        self.buckets[tier] = self._empty()
+        if tier + 1 == len(TIERS):
+            return
+        c = self.buckets[tier + 1]
+        start = b[0] - b[0] % TIERS[tier + 1][0]
+        if c[1] and start != c[0]:
+            self._close(tier + 1)
+            c = self.buckets[tier + 1]
+        if not c[1]:
+            c[0] = start
+        n = c[1] + b[1] # merge mean and squared deviations of both
+        d = b[2] - c[2]
+        c[2] += d * b[1] / n
+        c[3] += b[3] + d * d * b[1] * c[1] / n
+        c[1] = n
+        c[4] = min(c[4], b[4])
+        c[5] = max(c[5], b[5])
+        c[6] = [i + j for i, j in zip(c[6], b[6])]
+
+    def flush(self):
+        """
+        Write the open buckets of all tiers, e.g. before exiting
+        """
+        for tier in range(len(TIERS)):
+            if self.buckets[tier][1]:
+                self._close(tier)
+
+
+def load(path):
+    """
+    Map the buckets of a rollup file read only, empty if there is none
+    """
+    if not os.path.isfile(path):
+        return np.zeros(0, DTYPE)
+    with open(path, 'rb') as f:
+        magic, size, itemsize = _HEADER.unpack(f.read(_HEADER.size).ljust(_HEADER.size, b"\0"))
+    if magic != MAGIC or itemsize != DTYPE.itemsize:
+        raise ValueError("%s is not a rollup" % path)
+    n = (os.path.getsize(path) - size) // itemsize
+    if n <= 0:
+        return np.zeros(0, DTYPE)
+    return np.memmap(path, DTYPE, 'r', size, (n,))
+
+
+def query(directory, series, start, end, maxbuckets = 2000):
+    """
+    Return the tier and its buckets that overlap start to end, the finest tier with at most maxbuckets of them
+    """
+    for tier, (width, label) in enumerate(TIERS):
+        if (end - start) / width <= maxbuckets or tier + 1 == len(TIERS):
+            break
+    buckets = load(path(directory, series, tier))
+    t = buckets["t"]
+    return tier, buckets[bisect.bisect_left(t, start - start % width):bisect.bisect_left(t, end)]
+
+
+def combine(buckets):
+    """
+    Count, mean, standard deviation, min, max and fraction of each lock state of all samples in buckets
+    """
+    n = buckets["n"].astype(float)
+    total = n.sum()
+    if not total:
+        return 0, 0., 0., 0., 0., [0.] * len(LOCKS)
+    mean = (n * buckets["mean"]).sum() / total
+    std = (((n * (buckets["std"] ** 2 + (buckets["mean"] - mean) ** 2)).sum()) / total) ** .5
+    return int(total), mean, std, buckets["min"].min(), buckets["max"].max(), list(buckets["locks"].sum(axis = 0) / total)
+
+
+def main(argv):
+    directory = "rollup"
+    start = None
+    end = time.time()
+    maxbuckets = 2000
+    verbose = False
+    try:
+        opts, args = getopt.getopt(argv, "hd:e:n:s:v")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-d":
+            directory = arg
+        elif opt == "-e":
+            end = nmrlog.parsetime(arg)
+        elif opt == "-n":
+            maxbuckets = int(arg)
+        elif opt == "-s":
+            start = nmrlog.parsetime(arg)
+        elif opt == "-v":
+            verbose = True
+    if start is None:
+        start = end - 86400.
+    if not args:
+        args = sorted(set(f.rsplit("_", 1)[0] for f in os.listdir(directory) if f.endswith(".rollup")))
+
+    for series in args:
+        t0 = time.perf_counter()
+        tier, buckets = query(directory, series, start, end, maxbuckets)
+        n, mean, std, lo, hi, locks = combine(buckets)
+        dt = time.perf_counter() - t0
+        print("%s: %d samples in %d buckets of %s read in %.1f ms" % (series, n, len(buckets), TIERS[tier][1], 1000. * dt))
+        if n:
+            print("  mean %.10g, std %.3g, min %.9g, max %.9g" % (mean, std, lo, hi) + ("" if not any(locks) else ", " + ", ".join("%s %.1f %%" % (lock, 100. * f) for lock, f in zip(LOCKS, locks))))
+        if verbose:
+            for b in buckets:
+                print("  %s %6d %.9g %.3g %.9g %.9g %s" % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(b["t"])), b["n"], b["mean"], b["std"], b["min"], b["max"], ":".join(map(str, b["locks"]))))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
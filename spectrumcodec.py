@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Compact binary encoding for the spectra sent on COSY/tune and COSY/frev: every N-th message is a keyframe with the
+amplitudes quantized relative to the minimum of each spectrum, the messages in between only carry the zlib
+compressed difference to the last keyframe.
+Keyframes are also published retained on <topic>/key, so a subscriber that missed one can still decode the deltas.
+"""
+import getopt, struct, sys, time, zlib
+import numpy as np
+
+
+MAGIC = b"SPZ2"
+HEADER = struct.Struct("<4sBIIH") # magic, keyframe flag, sequence number, sequence number of the keyframe, number of spectra
+SPECTRUM = struct.Struct("<4dIdd") # the 4 header values of a spectrum list, number of amplitudes, quantization step, offset
+COUNT = {"tune": 1, "frev": 3} # position of the number of points among the header values, tune: t, n, fstart, fend, frev: t, fstart, fend, n
+KEYTOPIC = "/key"
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -i [Logfile] -k [Keyframe interval] -b [Bits]
+
+Encode spectra recorded in a logfile (e.g. tunes.log written by mqtt_tunesuscriber -l) and report bandwidth and decode cost.
+
+-h                      Show this help message and exit
+-i [Logfile]            Logfile with one text payload per paragraph, default "tunes.log"
+-k [Keyframe interval]  Send a full spectrum every k messages, default "10"
+-b [Bits]               Resolution of the quantization over the range of a keyframe, default "16"
+""" % sys.argv[0])
+
+
+def isencoded(payload):
+    return payload[:len(MAGIC)] == MAGIC
+
+
+def parse(text):
+    """
+    Split a text payload like "frev:t:n:fstart:fend:a0:a1...:channel1:..." into its names and spectrum lists
+    """
+    names = []
+    spectra = []
+    for entry in text.strip().split(":"):
+        try:
+            value = float(entry)
+        except ValueError:
+            names.append(entry)
+            spectra.append([])
+            continue
+        if not spectra:
+            names.append("")
+            spectra.append([])
+        spectra[-1].append(value)
+    return names, spectra
+
+
+def totext(names, spectra):
+    """
+    Inverse of parse()
+    """
+    return ":".join((name + ":" if name else "") + ":".join(map(str, spectrum)) for name, spectrum in zip(names, spectra))
+
+
+def _shuffle(q):
+    """
+    Transpose int32 array into byte planes, the high bytes of small deltas are all zero and compress to nothing
+    """
+    return q.astype('<i4').view(np.uint8).reshape(-1, 4).T.tobytes()
+
+
+def _unshuffle(blob):
+    return np.frombuffer(blob, np.uint8).reshape(4, -1).T.copy().view('<i4').ravel()
+
+
+class Encoder:
+    """
+    Encoder for the spectra of one topic, keeps the last keyframe
+    """
+    def __init__(self, keyinterv = 10, bits = 16):
+        self.keyinterv = keyinterv
+        self.bits = bits
+        self.seq = int(time.time()) & 0xffffffff # sequence numbers must not repeat after a restart
+        self.keyseq = None
+        self.key = None
+        self.steps = None
+        self.offsets = None
+
+    def encode(self, spectra):
+        """
+        Encode a list of spectrum lists, 4 header values followed by the amplitudes, returns payload and keyframe flag
+        """
+        self.seq = (self.seq + 1) & 0xffffffff
+        amps = [np.asarray(spectrum[4:], dtype = float) for spectrum in spectra]
+        iskey = self.key is None or (self.seq - self.keyseq) & 0xffffffff >= self.keyinterv or [len(a) for a in amps] != [len(k) for k in self.key]
+        if not iskey:
+            q = [np.rint((a - offset) / step).astype(np.int64) - k for a, step, offset, k in zip(amps, self.steps, self.offsets, self.key)]
+            iskey = any(len(d) and np.abs(d).max() >= 2**30 for d in q) # spectrum changed completely
+        if iskey:
+            self.offsets = [float(a.min()) if len(a) else 0. for a in amps]
+            # flat spectra keep a step relative to their value for the deltas, the keyframe itself is exact
+            self.steps = [(a.max() - a.min() if len(a) and a.max() > a.min() else abs(offset) or 1.) / 2**self.bits for a, offset in zip(amps, self.offsets)]
+            self.key = [np.rint((a - offset) / step).astype(np.int64) for a, step, offset in zip(amps, self.steps, self.offsets)]
+            self.keyseq = self.seq
+            q = self.key
+        payload = [HEADER.pack(MAGIC, iskey, self.seq, self.keyseq, len(spectra))]
+        for spectrum, a, step, offset in zip(spectra, amps, self.steps, self.offsets):
+            payload.append(SPECTRUM.pack(*[float(h) for h in spectrum[:4]], len(a), step, offset))
+        payload.append(zlib.compress(_shuffle(np.concatenate(q)) if q else b"", 6))
+        return b"".join(payload), iskey
+
+
+class Decoder:
+    """
+    Decoder for the spectra of one topic, deltas that arrive before their keyframe are kept until it comes.
+    kind is the order of the header values, "tune" or "frev" as in COUNT
+    """
+    def __init__(self, kind = "tune"):
+        self.count = COUNT[kind]
+        self.keyseq = None
+        self.key = None
+        self.waiting = None
+        self.missed = 0
+
+    def _unpack(self, payload):
+        magic, iskey, seq, keyseq, nspectra = HEADER.unpack_from(payload)
+        offset = HEADER.size
+        headers = []
+        for i in range(nspectra):
+            headers.append(SPECTRUM.unpack_from(payload, offset))
+            offset += SPECTRUM.size
+        q = _unshuffle(zlib.decompress(payload[offset:])).astype(np.int64)
+        return iskey, seq, keyseq, headers, q
+
+    def _spectra(self, headers, q):
+        spectra = []
+        start = 0
+        for header in headers:
+            n, step, offset = header[4:]
+            header = list(header[:4])
+            header[self.count] = int(header[self.count])
+            spectra.append(header + (offset + q[start:start + n] * step).tolist())
+            start += n
+        return spectra
+
+    def decode(self, payload):
+        """
+        Return the list of spectrum lists of a payload, or None if its keyframe has not arrived yet
+        """
+        iskey, seq, keyseq, headers, q = self._unpack(payload)
+        if iskey:
+            self.key, self.keyseq, self.waiting = q, seq, None
+            return self._spectra(headers, q)
+        if self.key is None or keyseq != self.keyseq or len(q) != len(self.key):
+            self.missed += 1
+            self.waiting = (keyseq, headers, q)
+            return None
+        return self._spectra(headers, self.key + q)
+
+    def setkey(self, payload):
+        """
+        Take keyframe from the retained <topic>/key, returns the spectra of a delta that was waiting for it
+        """
+        iskey, seq, keyseq, headers, q = self._unpack(payload)
+        if seq == self.keyseq:
+            return None
+        self.key, self.keyseq = q, seq
+        if self.waiting and self.waiting[0] == seq and len(self.waiting[2]) == len(q):
+            keyseq, headers, q = self.waiting
+            self.waiting = None
+            return self._spectra(headers, self.key + q)
+        return None
+
+
+def main(argv):
+    ifile = "tunes.log"
+    keyinterv = 10
+    bits = 16
+    try:
+        opts, args = getopt.getopt(argv, "hi:k:b:")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-i":
+            ifile = arg
+        elif opt == "-k":
+            keyinterv = int(arg)
+        elif opt == "-b":
+            bits = int(arg)
+
+    with open(ifile, 'r') as f:
+        payloads = [p for p in f.read().split("\n\n") if p.strip()]
+    encoder = Encoder(keyinterv, bits)
+    decoder = Decoder()
+    textbytes = codedbytes = keybytes = 0
+    tencode = tdecode = 0.
+    maxerr = 0.
+    for p in payloads:
+        names, spectra = parse(p)
+        t = time.perf_counter()
+        payload, iskey = encoder.encode(spectra)
+        tencode += time.perf_counter() - t
+        t = time.perf_counter()
+        decoded = decoder.decode(payload)
+        tdecode += time.perf_counter() - t
+        textbytes += len(p.encode('utf-8'))
+        codedbytes += len(payload)
+        if iskey:
+            keybytes += len(payload) # also published on <topic>/key
+        for spectrum, result, step in zip(spectra, decoded, encoder.steps):
+            if len(spectrum) > 4:
+                maxerr = max(maxerr, np.abs(np.asarray(spectrum[4:]) - result[4:]).max() / step)
+    n = max(len(payloads), 1)
+    print("%d messages, text %.1f kB/msg, encoded %.2f kB/msg incl. keyframes on %s (%.1fx smaller)" % (len(payloads), textbytes / n / 1000., (codedbytes + keybytes) / n / 1000., KEYTOPIC, textbytes / max(codedbytes + keybytes, 1)))
+    print("encode %.0f us/msg, decode %.0f us/msg, max. error %.2f quantization steps" % (1E6 * tencode / n, 1E6 * tdecode / n, maxerr))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
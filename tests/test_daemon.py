@@ -0,0 +1,32 @@
+import os, subprocess, sys, threading, time
+import mqtt_daemon
+
+
+def test_executor_result_and_errors():
+    executor = mqtt_daemon.DaemonExecutor()
+    assert executor.submit(sum, [1, 2]).result(1.) == 3
+    def fail():
+        sys.exit(2) # like the device functions of the single publishers
+    assert isinstance(executor.submit(fail).exception(1.), SystemExit)
+
+
+def test_hung_device_does_not_block_exit():
+    code = "import time, mqtt_daemon\nmqtt_daemon.DaemonExecutor().submit(time.sleep, 60)\n"
+    start = time.time()
+    subprocess.run([sys.executable, "-c", code], cwd = os.path.dirname(mqtt_daemon.__file__), check = True, timeout = 30)
+    assert time.time() - start < 10.
+
+
+def test_one_thread_per_executor():
+    executor = mqtt_daemon.DaemonExecutor("device")
+    before = threading.active_count()
+    names = [executor.submit(lambda: threading.current_thread().name).result(1.) for i in range(20)]
+    assert names == ["device"] * 20
+    assert threading.active_count() == before
+    blocked = threading.Event()
+    hung = executor.submit(blocked.wait) # later calls wait for the hung one
+    later = executor.submit(sum, [1, 2])
+    time.sleep(0.05)
+    assert not later.done() and threading.active_count() == before
+    blocked.set()
+    assert hung.result(1.) and later.result(1.) == 3
@@ -0,0 +1,78 @@
+import types
+import pytest
+import matplotlib
+matplotlib.use("Agg")
+import historycache
+import mqtt_nmrsuscriber
+
+
+def test_cache_ring_and_eviction():
+    cache = historycache.Cache(n = 3, maxbytes = 10)
+    for i in range(5):
+        cache.add("COSY/a", b"%d" % i)
+    assert cache.get("COSY/a", 10) == [("COSY/a", b"2"), ("COSY/a", b"3"), ("COSY/a", b"4")]
+    assert cache.get("COSY/a", 2) == [("COSY/a", b"3"), ("COSY/a", b"4")]
+    assert cache.last("COSY/a") == b"4" and cache.size == 3
+    cache.add("COSY/b", b"12345")
+    cache.get("COSY/a", 1) # a is used more recently than b now
+    cache.add("COSY/c", b"12345")
+    assert list(cache.topics) == ["COSY/a", "COSY/c"] and cache.evicted == 1
+    assert cache.get("COSY/#", 1) == [("COSY/a", b"4"), ("COSY/c", b"12345")]
+
+
+def test_pack_unpack():
+    messages = [("COSY/nmr", b"1.0:L:0.5"), ("COSY/ä", b""), ("COSY/nmr", bytes(range(256)))]
+    assert historycache.unpack(historycache.pack("1700000000.000001", messages)) == ("1700000000.000001", messages)
+    assert historycache.unpack(historycache.pack("", [])) == ("", [])
+    with pytest.raises(ValueError):
+        historycache.unpack(b"NOPE" + bytes(6))
+
+
+def test_merge():
+    history = [(1., "a"), (2., "b"), (3., "c")]
+    live = [(3., "live"), (5., "d"), (4., "e")]
+    assert historycache.merge(history + live) == [(1., "a"), (2., "b"), (3., "c"), (4., "e"), (5., "d")]
+    assert historycache.merge(history + live, 3.) == [(4., "e"), (5., "d")]
+    assert historycache.merge([["x", 2.], ["x", 1.]], 1., column = 1) == [["x", 2.]]
+
+
+@pytest.fixture
+def plot(monkeypatch):
+    shown = []
+    def updateplot(time, lock, field):
+        mqtt_nmrsuscriber.newest = time
+        shown.append(time)
+    monkeypatch.setattr(mqtt_nmrsuscriber, "updateplot", updateplot)
+    monkeypatch.setattr(mqtt_nmrsuscriber, "newest", float("-inf"))
+    monkeypatch.setattr(mqtt_nmrsuscriber, "waiting", [[], None])
+    for name in ("x", "y", "c"):
+        monkeypatch.setattr(mqtt_nmrsuscriber, name, [0] * 5, raising = False)
+    monkeypatch.setattr(mqtt_nmrsuscriber, "logfile", "", raising = False)
+    monkeypatch.setattr(mqtt_nmrsuscriber, "binlog", "", raising = False)
+    return shown
+
+
+def message(t):
+    return types.SimpleNamespace(topic = "COSY/nmr", payload = b"%.1f:L:1.5" % t)
+
+
+def test_history_after_live(plot):
+    mqtt_nmrsuscriber.on_message(None, None, message(10.)) # retained, also in the history
+    mqtt_nmrsuscriber.on_message(None, None, message(11.))
+    assert plot == [] # held back
+    mqtt_nmrsuscriber.history([("COSY/nmr", b"%.1f:L:1.0" % t) for t in (7., 8., 9., 10.)])
+    assert mqtt_nmrsuscriber.y == [0, 1., 1., 1., 1.] # 7 to 10 from the history in order
+    assert plot == [11.]
+    assert mqtt_nmrsuscriber.waiting is None
+    mqtt_nmrsuscriber.on_message(None, None, message(11.)) # sent again after a reconnect
+    mqtt_nmrsuscriber.on_message(None, None, message(12.))
+    assert plot == [11., 12.]
+
+
+def test_history_overdue(plot):
+    mqtt_nmrsuscriber.on_message(None, None, message(10.))
+    mqtt_nmrsuscriber.waiting[1] -= historycache.TIMEOUT + 1.
+    mqtt_nmrsuscriber.on_message(None, None, message(11.))
+    assert plot == [11.] and mqtt_nmrsuscriber.y[-1] == 1.5
+    mqtt_nmrsuscriber.history([("COSY/nmr", b"%.1f:L:1.0" % t) for t in (9., 10., 11.)]) # too late
+    assert plot == [11.] and mqtt_nmrsuscriber.y == [0, 0, 0, 0, 1.5]
@@ -0,0 +1,28 @@
+import latency
+
+
+def test_stamp_off_by_default():
+    assert not latency.enabled
+    assert latency.stamp("1.0:L:1.5", 1., 2.) == "1.0:L:1.5"
+    assert latency.stamp(b"SPZ1", 1., 2.) == b"SPZ1"
+
+
+def test_stamp_split(monkeypatch):
+    monkeypatch.setattr(latency, "enabled", True)
+    payload, stamps = latency.split(latency.stamp("1.0:L:1.5", 1., 2.))
+    assert payload == "1.0:L:1.5"
+    assert stamps[:2] == (1., 2.) and stamps[2] >= 2.
+    payload, stamps = latency.split(latency.stamp(b"\x00|\x01", 1., 2.))
+    assert payload == b"\x00|\x01" and stamps[:2] == (1., 2.)
+
+
+def test_split_unstamped():
+    assert latency.split("1.0:L:1.5") == ("1.0:L:1.5", None)
+    assert latency.split("a|b:c") == ("a|b:c", None)
+
+
+def test_stages():
+    tracker = latency.Tracker()
+    tracker.add((1., 2., 2.5), 3., 4.)
+    assert dict(latency.stages((1., 2., 2.5), 3., 4.)) == {"acquire": 1., "queue": .5, "transit": .5, "render": 1., "total": 3.}
+    assert tracker.percentiles("total") == (3., 3., 3.)
@@ -0,0 +1,42 @@
+import numpy as np
+import lodbuffer
+
+
+def test_coarse_level_keeps_spike_and_flag():
+    n = 4096
+    values = np.zeros(n)
+    values[1000] = 100.
+    buf = lodbuffer.LODBuffer(n)
+    for i, value in enumerate(values):
+        buf.add(float(i), value, 0., int(i == 2000))
+    t, lo, hi, mean, flag = buf.get(100)
+    assert len(t) < n // 4
+    assert hi.max() == 100.
+    assert flag.sum() == 1
+    assert abs(np.sum(mean * np.diff(np.append(t, n))) - 100.) < 1E-9 # weighted by the readings per block
+
+
+def test_window_drops_old_readings():
+    buf = lodbuffer.LODBuffer(1000)
+    for i in range(3000):
+        buf.add(float(i), float(i))
+    assert len(buf) == 1000
+    t, lo, hi, mean, flag = buf.get(10)
+    assert t[0] >= 2000.
+    assert hi.max() == 2999.
+
+
+def test_load_equals_add():
+    rng = np.random.default_rng(0)
+    n = 5000
+    t = np.arange(n, dtype = float)
+    values = rng.standard_normal(n)
+    flags = (values > 2.5).astype(int)
+    added = lodbuffer.LODBuffer(2000)
+    for reading in zip(t, values, np.full(n, 0.1), flags):
+        added.add(*reading)
+    loaded = lodbuffer.LODBuffer(2000)
+    loaded.load(t, values, 0.1, flags)
+    for npixels in (2000, 500, 100):
+        for a, b in zip(added.get(npixels), loaded.get(npixels)):
+            assert np.allclose(a, b)
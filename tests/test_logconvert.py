@@ -0,0 +1,83 @@
+import numpy as np
+import logconvert
+
+
+def test_detect():
+    assert logconvert.detect("/data/nmr.log.20261019-000000") == "nmr"
+    assert logconvert.detect("picopoll.log") == "pico"
+    assert logconvert.detect("tunes.log") == "tunes"
+    assert logconvert.detect("x/2026-10-19_tunespectra.log") == "tunespectra"
+    assert logconvert.detect("other.log") is None
+
+
+def test_shards(tmp_path):
+    path = tmp_path / "nmr.log"
+    lines = [b"%d.5:L:1.%07d\n" % (1700000000 + i, i) for i in range(1000)]
+    path.write_bytes(b"".join(lines))
+    ranges = logconvert.shards(str(path), b"\n", 1000)
+    assert ranges[0][0] == 0 and ranges[-1][1] == path.stat().st_size
+    assert all(end == start for (s, end), (start, e) in zip(ranges[:-1], ranges[1:]))
+    data = path.read_bytes()
+    assert all(data[end - 1:end] == b"\n" for start, end in ranges)
+    assert len(ranges) > 10
+    assert logconvert.shards(str(path), b"\n", 1 << 20) == [(0, len(data))]
+
+
+def test_nmr():
+    columns, skipped = logconvert._nmr(b"1.5:L:0.25\n2.5:S:0.5\n\n3.5:N:0.75\n")
+    assert list(columns["t"]) == [1.5, 2.5, 3.5] and list(columns["field"]) == [.25, .5, .75]
+    assert bytes(columns["lock"]) == b"LSN" and skipped == 0
+    columns, skipped = logconvert._nmr(b"1.5:L:0.25\ngarbage\n3.5:X:0.75\n")
+    assert list(columns["t"]) == [1.5, 3.5] and bytes(columns["lock"]) == b"LX" and skipped == 1
+
+
+def test_pico():
+    data = b"2026-10-19 12:00:00: D, Vpp:1.0:2.0:0.1/n/t2026-10-19 12:00:01: E:3.0:4.0:0.2/n/tbad/n/t2026-10-19 12:00:02: D, Vpp:5.0:x:0.3/n/t"
+    columns, skipped = logconvert._pico(data)
+    assert list(columns["names"]) == ["D, Vpp", "E"] and list(columns["name"]) == [0, 1]
+    assert list(columns["t"]) == [1., 3.] and list(columns["value"]) == [2., 4.] and list(columns["err"]) == [.1, .2]
+    assert skipped == 2
+
+
+def spectra(t, n):
+    return ":".join("%s:%s:%d:0:1:" % (name, t, n) + ":".join(str(j) for j in range(n)) for name in logconvert.NAMES)
+
+
+def test_tunes():
+    data = ("\n\n".join([spectra(1., 2), spectra(2., 3), "frev:3:5:0:1:1"]) + "\n\n").encode()
+    columns, skipped = logconvert._tunes(data)
+    assert skipped == 1
+    assert list(columns["frev_t"]) == [1., 2.] and list(columns["channel2_n"]) == [2, 3]
+    assert list(columns["channel1_offset"]) == [0, 2, 5]
+    assert list(columns["channel1_amplitude"]) == [0, 1, 0, 1, 2]
+
+
+def test_join():
+    a, skipped = logconvert._tunes(spectra(1., 2).encode())
+    b, skipped = logconvert._tunes(spectra(2., 3).encode())
+    joined = logconvert.join("tunes", [a, b])
+    assert list(joined["frev_offset"]) == [0, 2, 5] and list(joined["frev_amplitude"]) == [0, 1, 0, 1, 2]
+    a, skipped = logconvert._pico(b"d: A:1:2:3/n/td: B:4:5:6/n/t")
+    b, skipped = logconvert._pico(b"d: B:7:8:9/n/td: C:1:1:1/n/t")
+    joined = logconvert.join("pico", [a, b])
+    assert list(joined["names"]) == ["A", "B", "C"] and list(joined["name"]) == [0, 1, 1, 2]
+    assert list(joined["t"]) == [1., 4., 7., 1.]
+
+
+def test_main(tmp_path, capsys):
+    nmr = tmp_path / "nmr.log"
+    nmr.write_bytes(b"".join(b"%d.5:%c:1.%07d\n" % (1700000000 + i, b"LSN"[i % 3], i) for i in range(20000)))
+    pico = tmp_path / "picopoll.log"
+    pico.write_bytes(b"".join(b"d: %s:%d:%d:0.5/n/t" % (b"AB"[i % 2:i % 2 + 1], i, 2 * i) for i in range(100)))
+    for k in range(3):
+        (tmp_path / ("%d_tunespectra.log" % k)).write_text("sync. osz. spectrum: \n%d:2:0:1:0:%d\n beta_x spectrum: \n%d:2:0:1:0:%d\n beta_Y spectrum: \n%d:2:0:1:0:%d" % ((k, k) * 3))
+    out = tmp_path / "out"
+    logconvert.main(["-o", str(out), "-s", "0.05", "-w", "2", str(nmr), str(pico)] + [str(tmp_path / ("%d_tunespectra.log" % k)) for k in range(3)])
+    assert "20000 records written" in capsys.readouterr().out
+    with np.load(out / "nmr.npz") as columns:
+        assert len(columns["t"]) == 20000 and np.all(np.diff(columns["t"]) == 1.)
+        assert bytes(columns["lock"][:3]) == b"LSN" and columns["field"][-1] == 1.0019999
+    with np.load(out / "picopoll.npz") as columns:
+        assert list(columns["names"]) == ["A", "B"] and list(columns["value"][:3]) == [0., 2., 4.]
+    with np.load(out / "tunespectra.npz") as columns:
+        assert list(columns["frev_t"]) == [0., 1., 2.] and list(columns["channel1_amplitude"]) == [0, 0, 0, 1, 0, 2]
@@ -0,0 +1,20 @@
+import logtail
+
+
+def test_tail_across_blocks(tmp_path):
+    path = tmp_path / "nmr.log"
+    path.write_text("".join("%d:L:%d\n" % (i, i) for i in range(1000)))
+    records = logtail.tail(str(path), 10, blocksize = 7)
+    assert records == ["%d:L:%d" % (i, i) for i in range(990, 1000)]
+    assert len(logtail.tail(str(path), 5000, blocksize = 64)) == 1000
+
+
+def test_tail_paragraphs_and_match(tmp_path):
+    path = tmp_path / "tunes.log"
+    path.write_text("".join("%s:%d\n\n" % ("ab"[i % 2], i) for i in range(20)))
+    assert logtail.tail(str(path), 2, "\n\n", blocksize = 3) == ["a:18", "b:19"]
+    assert logtail.tail(str(path), 2, "\n\n", lambda record: record[0] == "a", 5) == ["a:16", "a:18"]
+
+
+def test_missing_file(tmp_path):
+    assert logtail.tail(str(tmp_path / "none.log"), 10) == []
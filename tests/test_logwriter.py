@@ -0,0 +1,67 @@
+import os, time
+import logwriter
+
+
+def test_write_and_header(tmp_path):
+    path = str(tmp_path / "nmr.bin")
+    writer = logwriter.LogWriter(path, header = b"HEAD")
+    for i in range(100):
+        writer.write(b"%03d" % i)
+    writer.close()
+    with open(path, 'rb') as f:
+        assert f.read() == b"HEAD" + b"".join(b"%03d" % i for i in range(100))
+    assert writer.stats()["dropped"] == 0
+
+
+def test_rotation_within_one_second(tmp_path):
+    path = str(tmp_path / "nmr.log")
+    writer = logwriter.LogWriter(path, rotate = "0.00001", interval = 0.) # 10 bytes per file
+    for i in range(5):
+        writer.write("%09d\n" % i)
+        while writer.queue.qsize() or writer.written < 10 * (i + 1):
+            time.sleep(0.001)
+    writer.close()
+    files = sorted(os.listdir(str(tmp_path)))
+    assert len(files) == 5 and writer.rotations == 4 # none overwritten, though in the same second
+    lines = sorted(open(str(tmp_path / name)).read() for name in files)
+    assert lines == ["%09d\n" % i for i in range(5)]
+
+
+class FailingFile:
+    """
+    File that writes only half of the data, then fails
+    """
+    def __init__(self, f):
+        self.f = f
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+    def write(self, data):
+        self.f.write(data[:len(data) // 2])
+        self.f.flush()
+        raise OSError("share lost")
+
+
+def test_retry_after_partial_write(tmp_path):
+    path = str(tmp_path / "picopoll.log")
+    writer = logwriter.LogWriter(path, interval = 0.)
+    writer.write("first\n")
+    writer.close()
+    writer.files = {}
+    new = writer._new
+    failing = [True]
+    def flaky(path):
+        f = new(path)
+        if failing:
+            failing.pop()
+            return FailingFile(f)
+        return f
+    writer._new = flaky
+    batch = writer._flush([(path, "second\n"), (path, "third\n")])
+    assert len(batch) == 2 and writer.errors == 1
+    assert writer._flush(batch) == []
+    writer._flush([(path, "fourth\n")])
+    for f in writer.files.values():
+        f.close()
+    assert open(path).read() == "first\nsecond\nthird\nfourth\n"
@@ -0,0 +1,42 @@
+import metrics
+
+
+class FakeClient:
+    uid = "test_1"
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, qos = 0, retain = False, spool = True):
+        self.published.append((topic, payload))
+
+
+def test_buckets():
+    m = metrics.Metrics(FakeClient(), "COSY/tune")
+    for duration in (0.5E-6, 1.5E-6, 3E-6, 1E3):
+        m.add("fit", duration)
+    count, total, longest, buckets = m.stages["fit"]
+    assert count == 4 and longest == 1E3
+    assert buckets[0] == 1 and buckets[1] == 1 and buckets[2] == 1 and buckets[-1] == 1
+
+
+def test_publish_parse():
+    client = FakeClient()
+    m = metrics.Metrics(client, "COSY/tune", interval = 0.)
+    with m.time("fit"):
+        pass
+    m.add("render", 0.01)
+    m.publish()
+    topic, payload = client.published[0]
+    assert topic == "COSY/tune/$metrics/test_1"
+    t, interval, stages = metrics.parse(payload)
+    assert set(stages) == {"fit", "render"}
+    assert stages["render"][0] == 1 and abs(stages["render"][1] - 0.01) < 1E-9
+    assert metrics.percentile(stages["render"][3], 50) >= 0.01
+    assert m.stages == {} # restarted
+
+
+def test_off():
+    with metrics.OFF.time("fit"):
+        pass
+    metrics.OFF.publish()
@@ -0,0 +1,9 @@
+import mqttclient
+
+
+def test_on_tick():
+    client = mqttclient.Client("test")
+    ticks = []
+    client.on_tick = ticks.append
+    client.loop_misc()
+    assert ticks == [client]
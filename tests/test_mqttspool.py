@@ -0,0 +1,86 @@
+import paho.mqtt.client as mqtt
+import mqttclient, mqttspool
+
+
+def drain(spool):
+    messages = []
+    while True:
+        record = spool.peek()
+        if record is None:
+            return messages
+        messages.append(record[:4])
+        spool.advance()
+
+
+def test_roundtrip(tmp_path):
+    spool = mqttspool.Spool(str(tmp_path))
+    spool.append("COSY/nmr", "1.0:L:1.5", 0, True)
+    spool.append("COSY/tune", b"\x00\x01", 1, False)
+    assert spool.pending()
+    assert drain(spool) == [("COSY/nmr", b"1.0:L:1.5", 0, True), ("COSY/tune", b"\x00\x01", 1, False)]
+    assert spool.drained == 2
+    assert not spool.pending()
+    spool.close()
+
+
+def test_reopen_continues_at_cursor(tmp_path):
+    spool = mqttspool.Spool(str(tmp_path))
+    for i in range(5):
+        spool.append("COSY/nmr", str(i))
+    spool.peek()
+    spool.advance()
+    spool.close()
+    spool = mqttspool.Spool(str(tmp_path))
+    assert [payload for topic, payload, qos, retain in drain(spool)] == [b"1", b"2", b"3", b"4"]
+
+
+def test_dropped_counts_messages(tmp_path):
+    spool = mqttspool.Spool(str(tmp_path), maxbytes = 1000, segmentbytes = 200)
+    n = 100
+    for i in range(n):
+        spool.append("COSY/nmr", "%03d" % i)
+    left = drain(spool)
+    assert spool.dropped > 1 # more than one message per dropped segment
+    assert spool.dropped + len(left) == n
+    assert left[-1][1] == b"099"
+
+
+def test_dropped_excludes_drained(tmp_path):
+    spool = mqttspool.Spool(str(tmp_path), maxbytes = 150, segmentbytes = 100)
+    for i in range(3):
+        spool.append("COSY/nmr", "%03d" % i)
+    spool.peek()
+    spool.advance()
+    for i in range(3, 20):
+        spool.append("COSY/nmr", "%03d" % i)
+    assert spool.dropped + len(drain(spool)) == 19
+
+
+def test_publish_spools_while_disconnected(tmp_path):
+    client = mqttclient.Client("test")
+    client.spool = mqttspool.Spool(str(tmp_path))
+    assert client.publish("COSY/nmr", "1").rc == mqtt.MQTT_ERR_SUCCESS
+    assert drain(client.spool) == [("COSY/nmr", b"1", 0, False)]
+
+
+def test_unacknowledged_spooled_on_exit(tmp_path):
+    # the broker died before the client noticed: the message is kept until acknowledged, not lost as QoS 0
+    client = mqttclient.Client("test")
+    client.spool = mqttspool.Spool(str(tmp_path))
+    client.connected = True
+    client.publish("COSY/nmr", "1", retain = True)
+    assert client.inflight() == 1
+    assert not client.spool.pending()
+    client._disconnected(client, None, 0)
+    assert drain(client.spool) == [("COSY/nmr", b"1", 0, True)]
+    assert client.inflight() == 0
+
+
+def test_acknowledged_not_spooled(tmp_path):
+    client = mqttclient.Client("test")
+    client.spool = mqttspool.Spool(str(tmp_path))
+    client.connected = True
+    info = client.publish("COSY/nmr", "1")
+    client._published(client, None, info.mid)
+    client._disconnected(client, None, 0)
+    assert not client.spool.pending()
@@ -0,0 +1,48 @@
+import numpy as np
+import nmrlog
+
+
+def write(path, readings, torn = b""):
+    with open(path, 'wb') as f:
+        f.write(nmrlog.header())
+        for reading in readings:
+            f.write(nmrlog.pack(*reading))
+        f.write(torn)
+
+
+def test_load_memmap(tmp_path):
+    path = str(tmp_path / "nmr.nmrlog")
+    readings = [(1000. + 0.1 * i, "LSN"[i % 3], 1. + 1E-7 * i) for i in range(100)]
+    write(path, readings, torn = b"\x01" * 5) # last record cut short
+    records = nmrlog.load(path)
+    assert isinstance(records, np.memmap)
+    assert records.dtype.itemsize == 17 and len(records) == 100
+    assert nmrlog.readings(records) == readings
+    assert nmrlog.isbinary(path)
+
+
+def test_between_bounds(tmp_path):
+    path = str(tmp_path / "nmr.nmrlog")
+    write(path, [(float(t), "L", 1.) for t in range(10)])
+    records = nmrlog.load(path)
+    assert list(nmrlog.between(records, 3., 6.)["t"]) == [3., 4., 5.] # start included, end excluded
+    assert list(nmrlog.between(records, 2.5, 3.)["t"]) == []
+    assert len(nmrlog.between(records)) == 10
+    assert list(nmrlog.between(records, 8.5)["t"]) == [9.]
+
+
+def test_empty_and_text(tmp_path):
+    path = str(tmp_path / "nmr.nmrlog")
+    write(path, [])
+    assert len(nmrlog.load(path)) == 0
+    text = tmp_path / "nmr.log"
+    text.write_text("1.0:L:1.5\n")
+    assert not nmrlog.isbinary(str(text))
+
+
+def test_convert(tmp_path):
+    text = tmp_path / "nmr.log"
+    text.write_text("1.0:L:1.5\ngarbage\n\n2.0:N:1.25\n")
+    path = str(tmp_path / "nmr.nmrlog")
+    assert nmrlog.convert([str(text)], path) == (2, 1)
+    assert nmrlog.readings(nmrlog.load(path)) == [(1., "L", 1.5), (2., "N", 1.25)]
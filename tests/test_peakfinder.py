@@ -0,0 +1,67 @@
+import os, subprocess, sys
+import numpy as np
+import pytest
+import peakfinder, tunefit
+
+
+def spectrum(amp = 10., xpeak = 1234.5, fwhm_half = 20., offset = 1., noise = 0.05, n = 401, seed = 0):
+    x = np.linspace(1000., 1500., n)
+    rng = np.random.default_rng(seed)
+    return x, peakfinder.lorentz_offset(x, amp, xpeak, fwhm_half, offset) + noise * rng.standard_normal(n)
+
+
+def test_estimate():
+    x, y = spectrum(noise = 0.)
+    amp, xpeak, width, offset = peakfinder.estimate(x, y)
+    assert abs(xpeak - 1234.5) < 0.1
+    assert abs(amp + offset - 11.) < 0.1
+    assert 15. < width < 25.
+
+
+def test_estimate_rows():
+    x, y0 = spectrum(xpeak = 1100.)
+    x, y1 = spectrum(xpeak = 1400., seed = 1)
+    amp, xpeak, width, offset = peakfinder.estimate(x, np.array([y0, y1]))
+    assert np.allclose(xpeak, [1100., 1400.], atol = 1.)
+    assert abs(xpeak[0] - peakfinder.estimate(x, y0)[1]) < 1E-9
+
+
+
+def test_fit():
+    x, y = spectrum()
+    pars, parerrs, covariance = peakfinder.fit(x, y)
+    assert abs(pars[1] - 1234.5) < 5 * parerrs[1] + 1E-3
+    assert abs(pars[2] - 20.) < 1.
+
+
+def test_first_fit_within_budget():
+    # a new process imports scipy in its first fit, which must not count against the budget
+    code = "import numpy as np, peakfinder\nx = np.linspace(1000., 1500., 401)\npeakfinder.fit(x, peakfinder.lorentz_offset(x, 10., 1234.5, 20., 1.), budget = 0.05)"
+    subprocess.run([sys.executable, "-c", code], cwd = os.path.dirname(peakfinder.__file__), check = True)
+
+
+def test_weak_peak_is_fitted():
+    # a line only a few times the noise, e.g. before averaging, is fitted like any other
+    x, y = spectrum(amp = 2., noise = 0.5)
+    pars, parerrs, covariance = peakfinder.fit(x, y, budget = 1.)
+    assert abs(pars[1] - 1234.5) < 5.
+
+
+def test_deadline():
+    x, y = spectrum()
+    with pytest.raises(peakfinder.FitTimeout) as err:
+        peakfinder.fit(x, y, budget = 0.)
+    assert len(err.value.pars) == 4
+
+
+def test_timeout_not_converged(monkeypatch):
+    def timeout(x, y, startvalues):
+        raise peakfinder.FitTimeout(np.array(startvalues))
+    monkeypatch.setattr(peakfinder, "fit", timeout)
+    spectra = []
+    for xpeak in (1234.5, 1100., 1400.):
+        x, y = spectrum(xpeak = xpeak)
+        spectra.append([0., len(x), x[0], x[-1]] + list(y))
+    fits, results = tunefit.fitspectra(spectra)
+    assert [conv for pars, parerrs, conv in fits] == [0, 0, 0]
+    assert np.all(np.isfinite(results))
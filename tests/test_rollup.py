@@ -0,0 +1,59 @@
+import numpy as np
+import rollup
+
+
+def roll(tmp_path, samples):
+    written = {}
+    def write(record, path):
+        written.setdefault(path, []).append(record)
+    series = rollup.Series("nmr", str(tmp_path), write)
+    for sample in samples:
+        series.add(*sample)
+    series.flush()
+    for path, records in written.items():
+        with open(path, 'wb') as f:
+            f.write(rollup.header() + b"".join(records))
+    return series
+
+
+def test_bucket_boundaries(tmp_path):
+    # a sample exactly at the start of a bucket belongs to it and not to the one before
+    samples = [(3599.5, 1., "L"), (3600., 2., "L"), (3659.999, 3., "S"), (3660., 4., "N")]
+    roll(tmp_path, samples)
+    seconds = rollup.load(rollup.path(str(tmp_path), "nmr", 0))
+    assert list(seconds["t"]) == [3599., 3600., 3659., 3660.]
+    minutes = rollup.load(rollup.path(str(tmp_path), "nmr", 1))
+    assert list(minutes["t"]) == [3540., 3600., 3660.]
+    assert list(minutes["n"]) == [1, 2, 1]
+    hours = rollup.load(rollup.path(str(tmp_path), "nmr", 2))
+    assert list(hours["t"]) == [0., 3600.]
+    assert list(hours["n"]) == [1, 3]
+    assert [list(locks) for locks in hours["locks"]] == [[1, 0, 0], [1, 1, 1]]
+
+
+def test_statistics_match_samples(tmp_path):
+    rng = np.random.default_rng(0)
+    t = np.sort(rng.uniform(0., 7200., 20000))
+    values = rng.normal(1., 1E-3, len(t))
+    roll(tmp_path, [(ti, vi) for ti, vi in zip(t, values)])
+    for tier in range(3):
+        n, mean, std, lo, hi, locks = rollup.combine(rollup.load(rollup.path(str(tmp_path), "nmr", tier)))
+        assert n == len(t)
+        assert abs(mean - values.mean()) < 1E-12 and abs(std - values.std()) < 1E-12
+        assert lo == values.min() and hi == values.max()
+
+
+def test_late_samples(tmp_path):
+    series = roll(tmp_path, [(10.5, 1.), (9.5, 2.), (10.7, 3.)])
+    assert series.late == 1 and series.samples == 2
+
+
+def test_query_tier(tmp_path):
+    roll(tmp_path, [(float(t), 1.) for t in range(0, 7200, 10)])
+    tier, buckets = rollup.query(str(tmp_path), "nmr", 60., 120., maxbuckets = 100)
+    assert tier == 0 and list(buckets["t"]) == [60., 70., 80., 90., 100., 110.]
+    tier, buckets = rollup.query(str(tmp_path), "nmr", 90., 3600., maxbuckets = 100)
+    assert tier == 1 and buckets["t"][0] == 60. and buckets["t"][-1] == 3540. # bucket holding the start included
+    tier, buckets = rollup.query(str(tmp_path), "nmr", 0., 7200., maxbuckets = 10)
+    assert tier == 2 and len(buckets) == 2
+    assert len(rollup.query(str(tmp_path), "none", 0., 1.)[1]) == 0
@@ -0,0 +1,76 @@
+import numpy as np
+import spectrumcodec
+
+
+def spectrum(t, header, n = 200, seed = 0):
+    rng = np.random.default_rng(seed)
+    return header + list(1E-3 * rng.standard_normal(n) + np.linspace(0., 1., n))
+
+
+def test_parse_totext():
+    text = "frev:1.5:3:1000.0:2000.0:0.1:0.2:0.3:channel1:1.5:2:10.0:20.0:1.0:2.0"
+    names, spectra = spectrumcodec.parse(text)
+    assert names == ["frev", "channel1"]
+    assert spectra[1] == [1.5, 2., 10., 20., 1., 2.]
+    assert spectrumcodec.parse(spectrumcodec.totext(names, spectra)) == (names, spectra)
+
+
+def test_keyframe_and_delta():
+    encoder = spectrumcodec.Encoder(keyinterv = 3)
+    decoder = spectrumcodec.Decoder()
+    flags = []
+    for i in range(6):
+        spectra = [spectrum(i, [1E9 + i, 200, 1.5E6, 1.6E6], seed = i)]
+        payload, iskey = encoder.encode(spectra)
+        flags.append(iskey)
+        decoded = decoder.decode(payload)
+        assert decoded[0][:4] == [1E9 + i, 200, 1.5E6, 1.6E6]
+        assert isinstance(decoded[0][1], int)
+        step = encoder.steps[0]
+        assert np.abs(np.array(decoded[0][4:]) - spectra[0][4:]).max() <= step
+    assert flags == [True, False, False, True, False, False]
+
+
+def test_frev_header():
+    # t, fstart, fend, n: fstart must not be truncated to the count
+    header = [1E9, 1.5E6 + 0.25, 1.6E6 + 0.75, 200]
+    encoder = spectrumcodec.Encoder()
+    decoder = spectrumcodec.Decoder("frev")
+    for i in range(2):
+        payload, iskey = encoder.encode([spectrum(0, header, seed = i)])
+        decoded = decoder.decode(payload)
+        assert decoded[0][:4] == header
+        assert isinstance(decoded[0][3], int)
+
+
+def test_delta_waits_for_keyframe():
+    encoder = spectrumcodec.Encoder(keyinterv = 10)
+    key, iskey = encoder.encode([spectrum(0, [1., 200, 2., 3.])])
+    delta, iskey = encoder.encode([spectrum(0, [2., 200, 2., 3.], seed = 1)])
+    decoder = spectrumcodec.Decoder()
+    assert decoder.decode(delta) is None
+    assert decoder.missed == 1
+    decoded = decoder.setkey(key)
+    assert decoded[0][0] == 2.
+
+
+def test_large_offset_small_span():
+    # quantized relative to the minimum, 1E5 / step would not fit into 32 bit
+    amps = list(100000. + np.linspace(0., 0.004, 5))
+    encoder = spectrumcodec.Encoder()
+    decoder = spectrumcodec.Decoder()
+    for i in range(2):
+        payload, iskey = encoder.encode([[1., 5, 0., 1.] + amps])
+        decoded = decoder.decode(payload)
+        assert np.abs(np.array(decoded[0][4:]) - amps).max() <= encoder.steps[0]
+
+
+def test_flat_spectrum():
+    encoder = spectrumcodec.Encoder()
+    decoder = spectrumcodec.Decoder()
+    payload, iskey = encoder.encode([[1., 5, 0., 1.] + [-60.5] * 5])
+    assert decoder.decode(payload)[0][4:] == [-60.5] * 5
+    amps = [-60.5, -60.49, -60.5, -60.51, -60.5]
+    payload, iskey = encoder.encode([[2., 5, 0., 1.] + amps]) # delta to the flat keyframe
+    assert not iskey
+    assert np.abs(np.array(decoder.decode(payload)[0][4:]) - amps).max() < 1E-3
@@ -0,0 +1,39 @@
+import numpy as np
+import tunefit
+
+
+def test_pack_unpack():
+    fits = [(np.array([1., 2., 3., 4.]), np.array([.1, .2, .3, .4]), conv) for conv in (1, 0, 1)]
+    results = [[750.6, .1, .2], [1E-3, 1E-4, 1E-4], [.5, .01, .02], [1E-2, 1E-3, 1E-3]]
+    t, unpacked, unresults = tunefit.unpack(tunefit.pack(1700000000.5, fits, results))
+    assert t == 1700000000.5
+    for (pars, parerrs, conv), (upars, uparerrs, uconv) in zip(fits, unpacked):
+        assert np.allclose(pars, upars) and np.allclose(parerrs, uparerrs) and conv == uconv
+    assert np.allclose(results, unresults)
+
+
+def test_reorder():
+    reorder = tunefit.Reorder(1.)
+    reorder.add(2., "b", now = 0.)
+    reorder.add(1., "a", now = 0.5)
+    assert reorder.ready(now = 0.9) == []
+    assert reorder.ready(now = 1.6) == [(1., "a"), (2., "b")]
+    reorder.add(1.5, "late", now = 2.)
+    assert reorder.late == 1
+    reorder.add(3., "c", now = 2.)
+    assert reorder.ready(flush = True) == [(3., "c")]
+
+
+def test_fitcache():
+    cache = tunefit.FitCache(2)
+    cache.put(b"a", 1)
+    cache.put(b"b", 2)
+    assert cache.get(b"a") == 1
+    cache.put(b"c", 3) # drops b, a was used more recently
+    assert cache.get(b"b") is None
+    assert cache.get(b"a") == 1 and cache.hits == 2
+
+
+def test_digest_ignores_publish_timestamps():
+    assert tunefit.digest(b"1:2:3|10:11:12") == tunefit.digest(b"1:2:3|20:21:22")
+    assert tunefit.digest(b"1:2:3") != tunefit.digest(b"1:2:4")
@@ -0,0 +1,48 @@
+import math
+import numpy as np
+import tunehistory
+
+
+def test_rolling_window():
+    rng = np.random.default_rng(0)
+    values = 1E3 + rng.standard_normal(57)
+    stats = tunehistory.RollingStats(n = 10)
+    for k, v in enumerate(values):
+        stats.add(v)
+        window = values[max(0, k - 9):k + 1]
+        assert stats.count == len(window)
+        assert abs(stats.mean - window.mean()) < 1E-9
+        assert abs(stats.std() - (window.std(ddof = 1) if len(window) > 1 else 0.)) < 1E-9
+
+
+def test_window_of_one():
+    stats = tunehistory.RollingStats(n = 1)
+    for v in (1., 2., 4.):
+        stats.add(v)
+        assert stats.count == 1 and stats.mean == v and stats.std() == 0.
+
+
+def test_ewma_and_drift():
+    stats = tunehistory.RollingStats(n = 100, alpha = 0.5, threshold = 0.1)
+    for v in (1., 1., 1.):
+        stats.add(v)
+    assert stats.ewma == 1. and not stats.drift()
+    stats.add(2.)
+    assert stats.ewma == 1.5 # 0.5 * 2 + 0.5 * 1
+    assert math.isclose(stats.mean, 1.25) and stats.drift()
+    stats = tunehistory.RollingStats(n = 100, alpha = 0.5)
+    for v in (1., 5.):
+        stats.add(v)
+    assert not stats.drift() # no threshold, no flag
+
+
+def test_tune_history():
+    history = tunehistory.TuneHistory(n = 5, alpha = 0.5, thresholds = (1., 0.001, 0.001))
+    assert history.add([750.6, 0.2, 0.]) == [] # failed fit of q_y skipped
+    assert history.stats[2].count == 0
+    assert history.add([750.6, 0.2, 0.3]) == []
+    assert history.add([750.6, 0.5, 0.3]) == ["q_x"]
+    fields = history.payload(1.5).split(":")
+    assert fields[0] == "1.500000" and fields[1:3] == ["f_rev", "3"] and fields[6] == "0"
+    assert fields[7:9] == ["q_x", "3"] and fields[12] == "1"
+    assert fields[13:15] == ["q_y", "2"] and fields[-1] == "0"
@@ -0,0 +1,35 @@
+import time
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+import metrics, mqtt_tunesuscriber, peakfinder
+
+
+def test_remote_fit_timeout(monkeypatch):
+    shown = []
+    monkeypatch.setattr(mqtt_tunesuscriber, "show", lambda spectra, p, fits = None: shown.append((p, fits)))
+    monkeypatch.setattr(mqtt_tunesuscriber, "remotetimeout", 3., raising = False)
+    monkeypatch.setattr(mqtt_tunesuscriber, "pending", (["spectra"], "text", time.time() - 1.), raising = False)
+    mqtt_tunesuscriber.expire(None)
+    assert shown == []
+    mqtt_tunesuscriber.pending = (["spectra"], "text", time.time() - 4.)
+    mqtt_tunesuscriber.expire(None)
+    assert shown == [("text", None)] # fitted locally
+    assert mqtt_tunesuscriber.pending is None
+
+
+def test_fit_stopped_at_deadline(monkeypatch):
+    for name, value in (("averages", None), ("rows", 0), ("fast", False), ("revh", 1), ("tuneh", 1), ("timing", metrics.OFF)):
+        monkeypatch.setattr(mqtt_tunesuscriber, name, value, raising = False)
+    def timeout(x, y, startvalues):
+        raise peakfinder.FitTimeout(np.array([10., x[0] + 0.3 * (x[-1] - x[0]), 20., 1.]))
+    monkeypatch.setattr(peakfinder, "fit", timeout)
+    mqtt_tunesuscriber.createplot(2, 101, 0., 1000.)
+    x = np.linspace(1000., 1500., 101)
+    spectra = [[0., 101, 1000., 1500.] + list(peakfinder.lorentz_offset(x, 10., 1200., 20., 1.)) for j in range(3)]
+    peaks, fwhms = mqtt_tunesuscriber.updateplot(spectra)
+    assert abs(peaks[0] - 1.15) < 1E-9 # best parameters so far, not the estimate
+    fit = mqtt_tunesuscriber.lfit[0].get_ydata()
+    assert max(fit) > 10. # best-effort peak drawn
+    labels = [text.get_text() for text in mqtt_tunesuscriber.axarr[0].get_legend().get_texts()]
+    assert labels[1].startswith("Stopped at deadline")
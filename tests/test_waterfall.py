@@ -0,0 +1,38 @@
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import waterfall
+
+
+def rows(wf):
+    return np.asarray(wf.image.get_array())
+
+
+def test_ring():
+    fig, ax = plt.subplots()
+    wf = waterfall.Waterfall(ax, 4)
+    for k in range(3):
+        wf.add([k, k + 1.], 0., 1., peak = 0.5 * k)
+    assert np.all(np.isnan(rows(wf)[0])) # oldest first, one row still empty
+    assert rows(wf)[1:, 0].tolist() == [0., 1., 2.]
+    for k in range(3, 10):
+        wf.add([k, k + 1.], 0., 1., peak = 0.5 * k)
+    assert rows(wf)[:, 0].tolist() == [6., 7., 8., 9.] # newest on top
+    assert wf.line.get_xdata().tolist() == [3., 3.5, 4., 4.5]
+    wf.add([1., 2., 3.], 0., 1.) # new span starts over
+    assert np.all(np.isnan(rows(wf)[:3])) and rows(wf)[3].tolist() == [1., 2., 3.]
+    plt.close(fig)
+
+
+def test_clim_of_rows_shown():
+    fig, ax = plt.subplots()
+    wf = waterfall.Waterfall(ax, 3)
+    wf.add([0., 1.], 0., 1.)
+    assert wf.image.get_clim() == (0., 1.)
+    wf.add([0., 1000.], 0., 1.) # e.g. a saturated sweep
+    assert wf.image.get_clim() == (0., 1000.)
+    for k in range(3):
+        wf.add([1., 2.], 0., 1.)
+    assert wf.image.get_clim() == (1., 2.) # the outlier has scrolled out
+    plt.close(fig)
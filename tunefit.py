@@ -0,0 +1,304 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Parsing and fitting of the COSY/tune messages shared by the displays and the central fit service, and the compact
+fit result messages the service publishes on <topic>/fit:
+t:frev:conv:amp:xpeak:fwhm_half:offset:amp_err:xpeak_err:fwhm_half_err:offset_err:channel1:...:channel2:...:
+result:f_rev:f_rev_err:fwhm:fwhm_err:q_x:q_x_err:fwhm:fwhm_err:q_y:q_y_err:fwhm:fwhm_err
+Several fit services can share the work through a shared subscription, their results are put back into
+timestamp order by Reorder before they are published on <topic>/fit.
+"""
+import collections, getopt, hashlib, heapq, itertools, math, sys, threading, time
+import numpy as np
+import latency, peakfinder, spectrumcodec
+
+
+FITTOPIC = "/fit"
+RAWTOPIC = "/fit/raw" # unordered results of the workers of a shared subscription
+NAMES = ["frev", "channel1", "channel2"]
+
+
+def usage():
+    """
+    Usage function
+    """
+    print("""Usage: %s -i [Logfile] -w [Workers]
+
+Fit the spectra recorded in a logfile with 1 to w worker processes, fed round robin like the broker feeds the
+members of a shared subscription, and report the throughput and the order of the results after Reorder.
+
+-h             Show this help message and exit
+-i [Logfile]   Logfile with one text payload per paragraph, default "tunes.log"
+-w [Workers]   Maximum number of worker processes, default "4"
+""" % sys.argv[0])
+
+
+def parse(msg, decoder):
+    """
+    Return the spectrum lists [timestamp, n, fstart, fend, amplitudes...] of sync. osz., x and y spectrum in a
+    text or delta encoded message and the text payload for logging, or None if the message cannot be decoded yet
+    """
+    payload = latency.split(msg.payload)[0]
+    if msg.topic.endswith(spectrumcodec.KEYTOPIC): # retained keyframe of delta encoded spectra
+        spectra = decoder.setkey(payload)
+        if not spectra:
+            return None
+    elif spectrumcodec.isencoded(payload):
+        spectra = decoder.decode(payload)
+        if not spectra:
+            print("Delta encoded spectra received, waiting for keyframe")
+            return None
+    else:
+        p = payload.decode('utf-8')
+        plist = p.split(":")
+        frev = plist[1:int(plist[2])+5]
+        del plist[:int(plist[2])+5]
+        channel1 = plist[1:int(plist[2])+5]
+        del plist[:int(plist[2])+5]
+        channel2 = plist[1:]
+        return [frev, channel1, channel2], p
+    return spectra, spectrumcodec.totext(NAMES, spectra)
+
+
+def digest(payload):
+    """
+    Content hash of a payload as key of FitCache, without the timestamps of publishing which differ when it is sent again
+    """
+    return hashlib.blake2b(latency.split(payload)[0], digest_size = 16).digest()
+
+
+class FitCache:
+    """
+    Least recently used fit results keyed by the digest of their payload, so spectra delivered again,
+    e.g. the retained message after every reconnect, are not parsed and fitted again
+    """
+    def __init__(self, size = 64):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last = False)
+
+
+class Average:
+    """
+    Mean of the last n spectra of one panel, or their exponentially weighted mean if 0 < n < 1 is the weight of
+    the newest, updated in place per spectrum instead of summing up all traces again
+    """
+    def __init__(self, n = 7):
+        self.alpha = n if 0. < n < 1. else 0.
+        self.n = 1 if self.alpha else int(n)
+        self.span = None
+        self.count = 0
+        self.total = 0
+
+    def add(self, data, fmin = 0., fmax = 0.):
+        """
+        Add spectrum, starts over if the number of points or the frequency span changed, returns the mean
+        """
+        data = np.asarray(data, dtype = float)
+        if self.span != (len(data), fmin, fmax):
+            self.span = (len(data), fmin, fmax)
+            self.ring = np.zeros((self.n, len(data)))
+            self.sum = np.zeros(len(data))
+            self.count = 0
+            self.total = 0
+        if self.alpha:
+            self.sum = data.copy() if self.count == 0 else self.sum + self.alpha * (data - self.sum)
+            self.count = 1
+            return self.sum
+        i = self.total % self.n
+        self.sum += data - self.ring[i]
+        self.ring[i] = data
+        self.total += 1
+        self.count = min(self.count + 1, self.n)
+        if self.total % self.n == 0: # recompute once per window so rounding errors cannot pile up
+            self.sum = self.ring.sum(axis = 0)
+        return self.sum / self.count
+
+
+def fitspectra(spectrumlist, revh = 1., tuneh = 1., fast = False):
+    """
+    Fit all three spectra, returns [(pars, parerrs, conv)] and [peaks, peakerrs, fwhms, fwhmerrs] in the units of mqtt_tunesuscriber.
+    conv is 0 for spectra that could not be fitted or with a fit stopped at its deadline, their pars are
+    the estimate or the best parameters so far with errors 0 like the failed fits of the displays
+    """
+    fits = []
+    peaks = [0., 0., 0.]
+    peakerrs = [0., 0., 0.]
+    fwhms = [0., 0., 0.]
+    fwhmerrs = [0., 0., 0.]
+    for j, spectrum in enumerate(spectrumlist):
+        npoints = int(spectrum[1])
+        fmin = float(spectrum[2])
+        fmax = float(spectrum[3])
+        data = np.array(spectrum[4:], dtype = float)
+        x = fmin + np.arange(npoints) * (fmax - fmin) / (npoints-1)
+        startvalues = peakfinder.estimate(x, data)
+        try:
+            if fast:
+                pars, parerrs = np.array(startvalues), np.zeros(4)
+            else:
+                pars, parerrs, covariance = peakfinder.fit(x, data, startvalues)
+        except RuntimeError as err: # also FitTimeout
+            pars, parerrs = np.array(err.pars if isinstance(err, peakfinder.FitTimeout) else startvalues), np.zeros(4)
+            fits.append((pars, parerrs, 0))
+            if j == 0:
+                peaks[0] = pars[1] / revh / 1000.
+                peakerrs[0] = 0.01
+            continue
+        fits.append((pars, parerrs, 1))
+        if j == 0:
+            peaks[0] = pars[1] / revh / 1000. # Revolution frequency / kHz
+            peakerrs[0] = parerrs[1] / revh / 1000.
+            fwhms[0] = pars[2] / revh / 1000. # Actually FWHM/2 / kHz
+            fwhmerrs[0] = parerrs[2] / revh / 1000.
+        else:
+            peaks[j] = pars[1] / peaks[0] / 1000. - tuneh # Fractional betatron tune
+            peakerrs[j] = math.sqrt((parerrs[1] /1000. / peaks[0])**2 +(pars[1] / 1000. / peaks[0]**2 * peakerrs[0])**2) # Tune error
+            fwhms[j] = pars[2] / peaks[0] / 1000.
+            fwhmerrs[j] = parerrs[2] / peaks[0] / 1000.
+    return fits, [peaks, peakerrs, fwhms, fwhmerrs]
+
+
+def pack(t, fits, results):
+    """
+    Text payload of the fit results for <topic>/fit
+    """
+    payload = ["%f" % t]
+    for name, (pars, parerrs, conv) in zip(NAMES, fits):
+        payload.append(name + ":%d:" % conv + ":".join("%.9g" % v for v in list(pars) + list(parerrs)))
+    payload.append("result:" + ":".join("%.9g:%.9g:%.9g:%.9g" % (peak, peakerr, fwhm, fwhmerr) for peak, peakerr, fwhm, fwhmerr in zip(*results)))
+    return ":".join(payload)
+
+
+def unpack(payload):
+    """
+    Inverse of pack(), returns timestamp, fits and results
+    """
+    plist = payload.split(":")
+    t = float(plist[0])
+    fits = []
+    for j in range(len(NAMES)):
+        entry = plist[1 + 10 * j: 11 + 10 * j]
+        values = [float(v) for v in entry[2:]]
+        fits.append((np.array(values[:4]), np.array(values[4:]), int(entry[1])))
+    values = [float(v) for v in plist[2 + 10 * len(NAMES):]]
+    results = [values[i::4] for i in range(4)]
+    return t, fits, results
+
+
+class Reorder:
+    """
+    Buffer results arriving out of order and release them sorted by timestamp once they waited window seconds,
+    results older than the last released one are dropped and counted as late
+    """
+    def __init__(self, window = 1.):
+        self.window = window
+        self.heap = []
+        self.lock = threading.Lock()
+        self.count = itertools.count() # tie breaker, items need not be comparable
+        self.last = None
+        self.late = 0
+
+    def add(self, t, item, now = None):
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.last is not None and t <= self.last:
+                self.late += 1
+                return
+            heapq.heappush(self.heap, (t, now + self.window, next(self.count), item))
+
+    def ready(self, now = None, flush = False):
+        """
+        Return the [(t, item)] due for release in timestamp order
+        """
+        now = time.time() if now is None else now
+        released = []
+        with self.lock:
+            while self.heap and (flush or self.heap[0][1] <= now):
+                t, due, n, item = heapq.heappop(self.heap)
+                released.append((t, item))
+                self.last = t
+        return released
+
+
+def _worker(inqueue, outqueue):
+    """
+    Fit service stand-in for the benchmark, fits spectra until it gets None
+    """
+    while True:
+        p = inqueue.get()
+        if p is None:
+            break
+        names, spectra = spectrumcodec.parse(p)
+        fits, results = fitspectra(spectra)
+        outqueue.put((spectra[0][0], pack(spectra[0][0], fits, results)))
+
+
+def main(argv):
+    import multiprocessing
+    ifile = "tunes.log"
+    nworkers = 4
+    try:
+        opts, args = getopt.getopt(argv, "hi:w:")
+    except getopt.GetoptError as err:
+        print(str(err)+"\n")
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            sys.exit()
+        elif opt == "-i":
+            ifile = arg
+        elif opt == "-w":
+            nworkers = int(arg)
+
+    with open(ifile, 'r') as f:
+        payloads = [p for p in f.read().split("\n\n") if p.strip()]
+    print("%d messages, %d CPUs" % (len(payloads), multiprocessing.cpu_count()))
+    single = None
+    for n in range(1, nworkers + 1):
+        # one queue per worker, the broker hands the messages of a shared subscription round robin to its members
+        inqueues = [multiprocessing.Queue() for i in range(n)]
+        outqueue = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target = _worker, args = (inqueue, outqueue)) for inqueue in inqueues]
+        for worker in workers:
+            worker.start()
+        for inqueue in inqueues: # warm up, imports and first fits are not part of the throughput
+            inqueue.put(payloads[0])
+        for i in range(n):
+            outqueue.get()
+        reorder = Reorder(0.)
+        start = time.perf_counter()
+        for i, p in enumerate(payloads):
+            inqueues[i % n].put(p)
+        order = []
+        for i in payloads:
+            t, payload = outqueue.get()
+            reorder.add(t, payload)
+            order.append(t)
+        rate = len(payloads) / (time.perf_counter() - start)
+        for inqueue in inqueues:
+            inqueue.put(None)
+        for worker in workers:
+            worker.join()
+        released = [t for t, payload in reorder.ready(flush = True)]
+        single = single or rate
+        print("%d workers: %.0f messages/s (%.2fx), %d results out of order, %d after Reorder" % (n, rate, rate / single, sum(a > b for a, b in zip(order, order[1:])), sum(a > b for a, b in zip(released, released[1:]))))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
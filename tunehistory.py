@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Streaming history of the fitted revolution frequency and tunes: rolling mean and variance over a fixed window
+(Welford, O(1) per value), exponentially weighted trend and a drift flag when the trend leaves the rolling mean.
+"""
+import math, time
+
+
+HISTORYTOPIC = "/history"
+NAMES = ["f_rev", "q_x", "q_y"]
+
+
+class RollingStats:
+    """
+    Mean and variance of the last n values, updated in O(1) by adding the new and removing the oldest value
+    """
+    def __init__(self, n = 1000, alpha = 0.1, threshold = 0.):
+        self.n = n
+        self.alpha = alpha
+        self.threshold = threshold
+        self.values = [0.] * n # ring buffer
+        self.count = 0
+        self.total = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.ewma = None
+
+    def add(self, x):
+        i = self.total % self.n
+        if self.count == self.n:
+            old = self.values[i]
+            if self.count > 1:
+                mean = self.mean - (old - self.mean) / (self.count - 1)
+                self.m2 -= (old - self.mean) * (old - mean)
+                self.mean = mean
+            else: # window of one value, nothing left
+                self.mean = self.m2 = 0.
+            self.count -= 1
+        self.values[i] = x
+        self.count += 1
+        self.total += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if self.total % self.n == 0: # recompute once per window so rounding errors of the removals cannot pile up
+            self.mean = sum(self.values) / self.n
+            self.m2 = sum((v - self.mean)**2 for v in self.values)
+        self.ewma = x if self.ewma is None else self.alpha * x + (1. - self.alpha) * self.ewma
+
+    def std(self):
+        return math.sqrt(max(self.m2, 0.) / (self.count - 1)) if self.count > 1 else 0.
+
+    def drift(self):
+        """
+        Trend deviates from the rolling mean by more than the threshold
+        """
+        return self.threshold > 0. and self.count > 1 and math.fabs(self.ewma - self.mean) > self.threshold
+
+
+class TuneHistory:
+    """
+    Rolling statistics for f_rev / kHz, q_x and q_y, thresholds of the drift flag in the same units
+    """
+    def __init__(self, n = 1000, alpha = 0.1, thresholds = (0.001, 0.001, 0.001)):
+        self.stats = [RollingStats(n, alpha, threshold) for threshold in thresholds]
+
+    def add(self, values):
+        """
+        Add one set of fit results, zeros from failed fits are skipped, returns the names of drifting quantities
+        """
+        for stat, value in zip(self.stats, values):
+            if value:
+                stat.add(value)
+        return [name for name, stat in zip(NAMES, self.stats) if stat.drift()]
+
+    def payload(self, t = None):
+        """
+        Aggregates as "t:f_rev:count:mean:std:ewma:drift:q_x:...", published on <topic>/history
+        """
+        t = time.time() if t is None else t
+        return "%f:" % t + ":".join("%s:%d:%.7f:%.7f:%.7f:%d" % (name, stat.count, stat.mean, stat.std(), stat.ewma or 0., stat.drift()) for name, stat in zip(NAMES, self.stats))
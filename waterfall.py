@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Waterfall view of the spectrum history: the last n spectra as rows of one image, newest on top, with the fitted
+peak positions as one line. The rows are kept twice in a 2n x points ring buffer, so the n rows in time order are
+always a contiguous view and an update only writes one row, however long the history is. The color range is
+that of the rows shown, from the minimum and maximum kept per row, so an outlier only sets it while it is shown.
+"""
+import numpy as np
+
+
+class Waterfall:
+    """
+    Waterfall of one panel, the buffer is allocated with the first spectrum and again if the span changes
+    """
+    def __init__(self, ax, n = 1000, cmap = 'viridis'):
+        self.ax = ax
+        self.n = n
+        self.cmap = cmap
+        self.span = None
+        self.image = None
+        self.y = np.arange(n) - n + 0.5 # row centers, 0 is now
+        self.line, = ax.plot([], [], 'w-', lw = 1, label = "fitted peak")
+        ax.set_ylabel("Spectra ago")
+
+    def _reset(self, npoints, fmin, fmax):
+        self.span = (npoints, fmin, fmax)
+        self.rows = np.full((2 * self.n, npoints), np.nan, dtype = np.float32)
+        self.peaks = np.full(2 * self.n, np.nan)
+        self.lows = np.full(2 * self.n, np.nan) # minimum and maximum of each row
+        self.highs = np.full(2 * self.n, np.nan)
+        self.count = 0
+        extent = (fmin, fmax, -self.n, 0)
+        if self.image is None:
+            self.image = self.ax.imshow(self.rows[:self.n], aspect = 'auto', origin = 'lower', extent = extent, interpolation = 'nearest', cmap = self.cmap)
+        else:
+            self.image.set_data(self.rows[:self.n])
+            self.image.set_extent(extent)
+        self.ax.set_xlim(fmin, fmax)
+        self.ax.set_ylim(-self.n, 0)
+
+    def add(self, data, fmin, fmax, peak = np.nan):
+        """
+        Add spectrum and the fitted peak position, NaN if the fit failed
+        """
+        data = np.asarray(data, dtype = np.float32)
+        if self.span != (len(data), fmin, fmax):
+            self._reset(len(data), fmin, fmax)
+        i = self.count % self.n
+        self.rows[i] = self.rows[i + self.n] = data
+        self.peaks[i] = self.peaks[i + self.n] = peak
+        if len(data):
+            self.lows[i] = self.lows[i + self.n] = data.min()
+            self.highs[i] = self.highs[i + self.n] = data.max()
+        self.count += 1
+        start = self.count % self.n # oldest row
+        self.image.set_data(self.rows[start:start + self.n])
+        self.line.set_data(self.peaks[start:start + self.n], self.y)
+        lows = self.lows[start:start + self.n]
+        highs = self.highs[start:start + self.n]
+        if np.isfinite(lows).any():
+            lo, hi = float(np.nanmin(lows)), float(np.nanmax(highs))
+            if hi > lo:
+                self.image.set_clim(lo, hi)
+        self.ax.figure.canvas.draw_idle()